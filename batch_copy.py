@@ -0,0 +1,462 @@
+# autorclone batch copy engine
+#
+# For trees of millions of small files rclone spends its time on API round trips:
+# every file costs at least one files.copy call, paced by --tpslimit. With
+# --engine batch the Drive to Drive copy is done here instead, straight from the
+# manifest: the files.copy calls go through the batch endpoint of the Drive API
+# (new_batch_http_request, as masshare.py does), up to BATCH_SIZE per HTTP request,
+# every account paced at --batch_tps calls per second. The destination folders are
+# looked up and created the same way, one level of the tree at a time.
+#
+# An account is dropped for the next one of the pool on its first quota error
+# (dailyLimitExceeded, upload limit: the rule of the rclone path), after RATE_LIMIT_BATCHES
+# batches in a row rate limited without copying anything, or once its budget is used.
+# Rate limits and server errors are retried after a back off, a rate limited account
+# with a batch of one file.
+#
+# files.copy is not idempotent: a copy whose answer was lost (connection error, 5xx)
+# may have been made. Before it is sent again the destination is searched for the
+# name in its folder, and a file found there counts as copied.
+#
+import io
+import json
+import posixpath
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from log_tail import is_quota_error, is_rate_limit
+from metrics import METRICS
+
+BATCH_SIZE = 100  # the most calls the Drive API takes in one batch request
+SCOPES = ['https://www.googleapis.com/auth/drive']
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+COPY_ATTEMPTS = 3  # give up a file after it failed that many times on errors worth retrying
+BACKOFF_MAX = 64  # seconds, the back off after a rate limit or server error doubles up to this
+QUEUE_FILES = 10000  # files read from the manifest at a time
+RATE_LIMIT_BATCHES = 5  # drop an account rate limited for that many batches in a row without copying anything
+
+
+class Item(object):
+    """a file to copy: its path, size and Drive ID in the source"""
+
+    def __init__(self, path, size, file_id):
+        self.path = path
+        self.size = max(size, 0)
+        self.file_id = file_id
+        self.attempts = 0
+        # a copy of it was sent but its answer lost: it may be in the destination already
+        self.unsure = False
+
+
+def drive_service(sa_file, api_endpoint=None, token_uri=None):
+    """a Drive v3 client acting as the service account of the json key sa_file,
+        api_endpoint and token_uri for a local stand-in (see fake_drive_api.py)
+    """
+    # Only needed with --engine batch
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+
+    with io.open(sa_file, 'r', encoding='utf-8') as fp:
+        info = json.load(fp)
+    if token_uri:
+        info['token_uri'] = token_uri
+    credentials = service_account.Credentials.from_service_account_info(info, scopes=SCOPES)
+    options = {'api_endpoint': api_endpoint.rstrip('/') + '/drive/v3/'} if api_endpoint else None
+    return build('drive', 'v3', credentials=credentials, cache_discovery=False, client_options=options)
+
+
+def execute(service, requests, api_endpoint=None):
+    """run requests through the batch endpoint, BATCH_SIZE per HTTP request,
+        returns [(response, exception)] in their order
+    """
+    from google.auth.exceptions import RefreshError, TransportError
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import BatchHttpRequest
+    from httplib2 import HttpLib2Error
+
+    results = [None] * len(requests)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    for start in range(0, len(requests), BATCH_SIZE):
+        # new_batch_http_request() always posts to www.googleapis.com, whatever api_endpoint says
+        if api_endpoint:
+            batch = BatchHttpRequest(callback=callback, batch_uri=api_endpoint.rstrip('/') + '/batch/drive/v3')
+        else:
+            batch = service.new_batch_http_request(callback=callback)
+        for k in range(start, min(start + BATCH_SIZE, len(requests))):
+            batch.add(requests[k], request_id=str(k))
+        try:
+            batch.execute()
+        except (HttpError, HttpLib2Error, OSError, RefreshError, TransportError) as error:
+            # The whole batch request failed: so did every call of it not answered
+            for k in range(start, min(start + BATCH_SIZE, len(requests))):
+                if results[k] is None:
+                    results[k] = (None, error)
+    return results
+
+
+def error_reason(exception):
+    """(HTTP status or None, reason and message) of a failed call"""
+    from googleapiclient.errors import HttpError
+
+    if not isinstance(exception, HttpError):
+        return None, str(exception)
+    try:
+        error = json.loads(exception.content.decode('utf-8'))['error']
+        reason = ' '.join([item.get('reason', '') for item in error.get('errors', [])] + [error.get('message', '')])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        reason = str(exception)
+    return exception.resp.status, reason
+
+
+def worth_retrying(status, reason):
+    # Connection trouble, rate limits and server errors, not a file that cannot be copied
+    return status is None or status >= 500 or status in (408, 429) or 'rateLimitExceeded' in reason
+
+
+def maybe_done(status):
+    # The call may have been carried out even though it failed: no answer, a timeout or a server error
+    return status is None or status >= 500 or status == 408
+
+
+def is_account_error(exception):
+    # The account cannot even get a token (key revoked, account deleted): no call of it can work
+    from google.auth.exceptions import RefreshError
+    return isinstance(exception, RefreshError)
+
+
+def quote(name):
+    # A value in a files.list query
+    return "'{}'".format(name.replace('\\', '\\\\').replace("'", "\\'"))
+
+
+class Folders(object):
+    """the ids of the destination folders by path, looked up (or created) a tree level at a time"""
+
+    def __init__(self, root_id, api_endpoint=None):
+        self.ids = {'': root_id}
+        self.api_endpoint = api_endpoint
+        # one lane at a time, two would both create a missing folder
+        self.lock = threading.Lock()
+
+    def resolve(self, service, paths, pace=None):
+        """find or create the folders paths (and their parents), calling pace with the number
+            of calls before every batch of them, returns the errors of the calls that failed
+        """
+        pace = pace or (lambda calls: None)
+        with self.lock:
+            return self._resolve(service, paths, pace)
+
+    def _resolve(self, service, paths, pace):
+        wanted = set()
+        for path in paths:
+            while path not in self.ids and path not in wanted:
+                wanted.add(path)
+                path = posixpath.dirname(path)
+        errors = []
+        for depth in sorted(set(path.count('/') for path in wanted)):
+            level = sorted(path for path in wanted if path.count('/') == depth and posixpath.dirname(path) in self.ids)
+            files = service.files()
+            pace(len(level))
+            found = execute(service, [files.list(
+                q="name = {} and {} in parents and mimeType = '{}' and trashed = false".format(
+                    quote(posixpath.basename(path)), quote(self.ids[posixpath.dirname(path)]), FOLDER_MIME),
+                fields='files(id)', pageSize=1, supportsAllDrives=True, includeItemsFromAllDrives=True)
+                for path in level], self.api_endpoint)
+            missing = []
+            for path, (response, exception) in zip(level, found):
+                if exception is not None:
+                    errors.append(exception)
+                elif response.get('files'):
+                    self.ids[path] = response['files'][0]['id']
+                else:
+                    missing.append(path)
+            pace(len(missing))
+            created = execute(service, [files.create(
+                body={'name': posixpath.basename(path), 'mimeType': FOLDER_MIME, 'parents': [self.ids[posixpath.dirname(path)]]},
+                fields='id', supportsAllDrives=True) for path in missing], self.api_endpoint)
+            for path, (response, exception) in zip(missing, created):
+                if exception is not None:
+                    errors.append(exception)
+                else:
+                    self.ids[path] = response['id']
+        return errors
+
+
+class Lane(object):
+    """one account copying, one batch at a time"""
+
+    def __init__(self, sa_id, email, service, budget, tps):
+        self.sa_id = sa_id
+        self.email = email
+        self.service = service
+        self.budget = budget
+        self.tps = tps
+        # bytes copied, and in flight
+        self.copied = 0
+        self.committed = 0
+        self.started = time.time()
+        self.next_at = 0
+        self.backoff = 0
+        self.busy = False
+        # batches in a row rate limited without copying anything
+        self.rate_limited = 0
+
+    def pace(self, calls):
+        # At most tps calls a second, batched or not: Drive counts every call of a batch
+        if not calls:
+            return
+        now = time.time()
+        if self.next_at > now:
+            time.sleep(self.next_at - now)
+        if self.tps:
+            self.next_at = max(now, self.next_at) + calls / float(self.tps)
+
+
+class BatchCopier(object):
+    """copies what the manifest has left with accounts of pool, workers of them at a time"""
+
+    def __init__(self, pool, service_of, manifest, root_id, root_path='', workers=1, tps=None,
+                 full_budget=650 * 2 ** 30, api_endpoint=None, on_event=None):
+        self.pool = pool
+        # sa_id -> Drive client of the account
+        self.service_of = service_of
+        self.manifest = manifest
+        self.root_path = root_path.strip('/')
+        self.workers = max(1, workers)
+        self.tps = tps
+        # an account given back with less than this left goes to the end of the pool
+        self.full_budget = full_budget
+        self.api_endpoint = api_endpoint
+        self.on_event = on_event or (lambda event, **fields: None)
+        self.folders = Folders(root_id, api_endpoint)
+        self.lanes = []
+        self.pending = deque()
+        # paths pending or in flight (retries go back to pending), and the ones given up
+        self.queued = set()
+        self.failed = {}
+        # manifest position, every path is read once
+        self.after = None
+        self.out_of_accounts = False
+
+    def folder_of(self, item):
+        folder = posixpath.dirname(item.path)
+        return '/'.join(part for part in (self.root_path, folder) if part)
+
+    def give_up(self, item, reason):
+        self.queued.discard(item.path)
+        self.failed[item.path] = reason
+        print('giving up {}: {}'.format(item.path, reason))
+        self.on_event('copy_failed', path=item.path, error=reason)
+
+    def fill(self):
+        # Keep a few batches per account queued, from the manifest in path order
+        while len(self.pending) < 2 * BATCH_SIZE * self.workers:
+            rows = self.manifest.todo_ids(self.after, QUEUE_FILES).fetchall()
+            if not rows:
+                return
+            self.after = rows[-1][0]
+            for path, size, file_id in rows:
+                if path in self.queued or path in self.failed:
+                    continue
+                item = Item(path, size, file_id)
+                self.queued.add(path)
+                if file_id is None:
+                    self.give_up(item, 'no Drive ID in the manifest')
+                elif item.size > self.full_budget:
+                    self.give_up(item, 'bigger than the budget of an account')
+                else:
+                    self.pending.append(item)
+
+    def new_lane(self):
+        sa_id = self.pool.next_id()
+        if sa_id is None:
+            self.out_of_accounts = True
+            return None
+        email = self.pool.email(sa_id)
+        try:
+            service = self.service_of(sa_id)
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            print('{:03d} ({}): {}'.format(sa_id, email, error))
+            return self.new_lane()
+        lane = Lane(sa_id, email, service, self.pool.budget_bytes(sa_id), self.pool.tpslimit(sa_id, self.tps) if self.tps else None)
+        self.pool.started(sa_id)
+        self.lanes.append(lane)
+        print('>> Let us go {:03d} ({}) {}'.format(sa_id, email, time.strftime("%H:%M:%S")))
+        self.on_event('sa_started', sa_id=sa_id, email=email, budget=lane.budget)
+        return lane
+
+    def stop(self, lane, reason):
+        self.lanes.remove(lane)
+        print('{:03d} ({}) stopped after {:.2f}GB: {}.'.format(lane.sa_id, lane.email, lane.copied / 2 ** 30, reason))
+        METRICS.inc('autorclone_switches_total', reason=reason)
+        self.on_event('sa_stopped', sa_id=lane.sa_id, bytes=lane.copied, reason=reason)
+        self.pool.record_run(lane.sa_id, lane.copied, time.time() - lane.started, reason)
+        self.pool.stopped(lane.sa_id)
+        if reason == 'quota' and lane.email is not None:
+            self.pool.ledger.mark_exhausted(lane.email)
+        elif reason in ('finished', 'failed'):
+            self.pool.give_back(lane.sa_id, last=reason == 'failed' or self.pool.budget_bytes(lane.sa_id) < self.full_budget)
+        self.pool.ledger.save()
+
+    def take(self, lane):
+        """the next batch of lane, [] if it has none"""
+        items, skipped = [], []
+        # A rate limited account is tried with one file until it copies again, not a whole batch of calls
+        size = 1 if lane.rate_limited else BATCH_SIZE
+        while self.pending and len(items) < size:
+            item = self.pending.popleft()
+            if item.size <= lane.budget - lane.committed:
+                items.append(item)
+                lane.committed += item.size
+            else:
+                # For an account with more quota left
+                skipped.append(item)
+        self.pending.extendleft(reversed(skipped))
+        if not items:
+            # None of the files left fits what the account may still copy
+            self.stop(lane, 'budget')
+        return items
+
+    def copy(self, lane, items):
+        """in a thread of the executor: the folders of items, then one batch request of files.copy,
+            returns [(response, exception)] of items ((None, None) for the ones not sent) and the
+            errors of the folder calls
+        """
+        errors = self.folders.resolve(lane.service, set(self.folder_of(item) for item in items), lane.pace)
+        results = [(None, None)] * len(items)
+        ready = [k for k, item in enumerate(items) if self.folder_of(item) in self.folders.ids]
+        files = lane.service.files()
+
+        # A copy that may have been made already is looked up first, not made twice
+        unsure = [k for k in ready if items[k].unsure]
+        lane.pace(len(unsure))
+        found = execute(lane.service, [files.list(
+            q='name = {} and {} in parents and trashed = false'.format(
+                quote(posixpath.basename(items[k].path)), quote(self.folders.ids[self.folder_of(items[k])])),
+            fields='files(id)', pageSize=1, supportsAllDrives=True, includeItemsFromAllDrives=True)
+            for k in unsure], self.api_endpoint)
+        for k, (response, exception) in zip(unsure, found):
+            if exception is not None:
+                results[k] = (None, exception)
+            elif response.get('files'):
+                results[k] = ({'id': response['files'][0]['id']}, None)
+            else:
+                items[k].unsure = False
+
+        todo = [k for k in ready if results[k] == (None, None)]
+        lane.pace(len(todo))
+        copied = execute(lane.service, [files.copy(
+            fileId=items[k].file_id, body={'name': posixpath.basename(items[k].path),
+                                           'parents': [self.folders.ids[self.folder_of(items[k])]]},
+            fields='id', supportsAllDrives=True) for k in todo], self.api_endpoint)
+        for k, result in zip(todo, copied):
+            results[k] = result
+        return results, errors
+
+    def retry(self, item, error):
+        item.attempts += 1
+        if item.attempts >= COPY_ATTEMPTS:
+            self.give_up(item, error_reason(error)[1] if isinstance(error, Exception) else error)
+        else:
+            self.pending.append(item)
+
+    def settle(self, lane, items, results, errors):
+        """what a batch did: copied files to the ledger and the manifest, the others queued again"""
+        copied, quota, backoff, limited = [], None, False, False
+        # The account is out of quota (or cannot get a token) if a folder call says so
+        for error in errors:
+            if is_account_error(error) or is_quota_error(error_reason(error)[1]):
+                quota = quota or error
+            elif is_rate_limit(error_reason(error)[1]):
+                limited = True
+        for item, (response, exception) in zip(items, results):
+            lane.committed -= item.size
+            if response is not None:
+                copied.append(item)
+                continue
+            if exception is None:
+                # Not sent, its folder is missing
+                exception = errors[0] if errors else 'folder not created'
+                if quota is not None or limited:
+                    self.pending.appendleft(item)
+                else:
+                    self.retry(item, exception)
+                continue
+            status, reason = error_reason(exception)
+            if is_account_error(exception) or is_quota_error(reason):
+                quota = quota or exception
+                self.pending.appendleft(item)
+            elif is_rate_limit(reason):
+                # Not carried out, and not the file's fault: no attempt used
+                limited = True
+                self.pending.appendleft(item)
+            elif worth_retrying(status, reason):
+                backoff = True
+                item.unsure = item.unsure or maybe_done(status)
+                self.retry(item, exception)
+            else:
+                self.give_up(item, reason)
+
+        size = sum(item.size for item in copied)
+        lane.copied += size
+        lane.committed += size
+        if copied:
+            for item in copied:
+                self.queued.discard(item.path)
+            if lane.email is not None:
+                self.pool.ledger.record(lane.email, size)
+            METRICS.inc('autorclone_bytes_transferred_total', size)
+            METRICS.inc('autorclone_sa_bytes_total', size, sa='{:03d}'.format(lane.sa_id), email=lane.email or '')
+            self.manifest.mark_done([item.path for item in copied])
+            self.on_event('files_completed', sa_id=lane.sa_id, files=[item.path for item in copied])
+
+        # A rate limit is only the account's end when it persists without anything copied
+        if copied:
+            lane.rate_limited = 0
+        elif limited:
+            lane.rate_limited += 1
+        if backoff or limited:
+            lane.backoff = min(max(1, lane.backoff * 2), BACKOFF_MAX)
+            lane.next_at = max(lane.next_at, time.time() + lane.backoff)
+        else:
+            lane.backoff = 0
+        if quota is not None:
+            print('{:03d} ({}): {}'.format(lane.sa_id, lane.email, error_reason(quota)[1]))
+            self.stop(lane, 'failed' if is_account_error(quota) else 'quota')
+        elif lane.rate_limited >= RATE_LIMIT_BATCHES:
+            print('{:03d} ({}): rate limited for {} batches without copying anything'.format(
+                lane.sa_id, lane.email, RATE_LIMIT_BATCHES))
+            self.stop(lane, 'quota')
+
+    def run(self):
+        """copy until the manifest has nothing left, returns False if the accounts ran out first"""
+        running = {}
+        with ThreadPoolExecutor(self.workers) as executor:
+            while True:
+                self.fill()
+                while self.pending and len(self.lanes) < self.workers and self.new_lane() is not None:
+                    pass
+                for lane in [lane for lane in self.lanes if not lane.busy]:
+                    items = self.take(lane) if self.pending else []
+                    if items:
+                        lane.busy = True
+                        running[executor.submit(self.copy, lane, items)] = (lane, items)
+                if not running:
+                    if self.pending and self.lanes:
+                        continue
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    lane, items = running.pop(future)
+                    lane.busy = False
+                    self.settle(lane, items, *future.result())
+        for lane in list(self.lanes):
+            self.stop(lane, 'finished')
+        if self.failed:
+            print('{} files could not be copied.'.format(len(self.failed)))
+        return not self.pending
@@ -0,0 +1,163 @@
+# autorclone benchmark: batched server side copy
+#
+# Copies the same tree of small files twice against fake_drive_api.py (no Google
+# account, no network): once with the batch copy engine of --engine batch, up to
+# 100 files.copy calls per HTTP request, and once the way rclone does it, one
+# files.copy per HTTP request. rclone itself cannot be pointed at a local Drive API,
+# so that second run is a model of it: its own API calls, not rclone.
+#
+# Both run at the same calls per second per account (--tpslimit): Drive counts every
+# call of a batch, so what batching saves is round trips, not quota. --batch_tps adds
+# a run of the engine at another rate, to show the effect of the rate on its own.
+#
+#   python3 bench_batch_copy.py --files 300 --accounts 4 --workers 2 --rtt 0.1
+#
+from __future__ import print_function
+import argparse
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from batch_copy import BatchCopier, drive_service, error_reason
+from fake_drive_api import FakeDrive, start_drive_server
+from log_tail import is_quota_error, is_rate_limit
+from manifest import Manifest, SRC
+from rclone_sa_magic import SaPool, TPSLIMIT
+from sa_ledger import QuotaLedger
+
+
+def fake_keys(workdir, count):
+    # One real RSA key for every account: the token endpoint of the stand-in takes any signature
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    pem = rsa.generate_private_key(public_exponent=65537, key_size=2048).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()).decode('ascii')
+    sa_files = {}
+    for i in range(1, count + 1):
+        sa_files[i] = os.path.join(workdir, 'sa{:03d}.json'.format(i))
+        with io.open(sa_files[i], 'w', encoding='utf-8') as fp:
+            json.dump({'type': 'service_account', 'project_id': 'bench', 'private_key_id': 'key{}'.format(i),
+                       'private_key': pem, 'client_email': 'bench{}@bench.iam.gserviceaccount.com'.format(i),
+                       'client_id': str(i), 'token_uri': 'https://oauth2.googleapis.com/token'}, fp)
+    return sa_files
+
+
+def fake_manifest(path, files, folders):
+    manifest = Manifest(path)
+    manifest.add_entries(SRC, ({'Path': 'folder{:03d}/file{:06d}.txt'.format(i % folders, i), 'Size': 4096,
+                                'ID': 'src{:08d}'.format(i)} for i in range(files)))
+    return manifest
+
+
+def per_file(sa_files, manifest, endpoint, workers, tps):
+    """the rclone way: one files.copy per HTTP request, tps of them a second per account"""
+    todo = [(path, file_id) for path, _, file_id in manifest.todo_ids()]
+    accounts = sorted(sa_files)
+    lock = threading.Lock()
+    folders = {}
+
+    def worker():
+        service, next_at = None, 0
+        while True:
+            with lock:
+                if not todo:
+                    return
+                if service is None:
+                    if not accounts:
+                        return
+                    service = drive_service(sa_files[accounts.pop(0)], endpoint, endpoint + '/token')
+                path, file_id = todo.pop()
+            now = time.time()
+            if next_at > now:
+                time.sleep(next_at - now)
+            next_at = max(now, next_at) + 1.0 / tps
+            folder = os.path.dirname(path)
+            with lock:
+                parent = folders.get(folder)
+            if parent is None:
+                parent = service.files().create(body={'name': folder, 'mimeType': 'application/vnd.google-apps.folder',
+                                                      'parents': ['root']}, fields='id').execute()['id']
+                with lock:
+                    parent = folders.setdefault(folder, parent)
+            try:
+                service.files().copy(fileId=file_id, body={'name': os.path.basename(path), 'parents': [parent]},
+                                     fields='id').execute()
+            except Exception as error:
+                with lock:
+                    todo.append((path, file_id))
+                if not is_quota_error(error_reason(error)[1]) and not is_rate_limit(error_reason(error)[1]):
+                    raise
+                # rclone stops on the quota error (the supervisor on a lasting rate limit), the next account takes over
+                service = None
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return not todo
+
+
+def batched(sa_files, manifest, endpoint, workers, tps, ledger_path):
+    pool = SaPool(1, len(sa_files), sa_files, QuotaLedger(ledger_path))
+    copier = BatchCopier(pool, lambda sa_id: drive_service(sa_files[sa_id], endpoint, endpoint + '/token'), manifest,
+                         'root', workers=workers, tps=tps, api_endpoint=endpoint)
+    return copier.run()
+
+
+def bench(label, run, drive, files):
+    requests, calls = drive.requests, drive.calls
+    wall_start = time.perf_counter()
+    done = run()
+    wall = time.perf_counter() - wall_start
+    print('{:<34} {:>8.2f} s {:>10.1f} files/s {:>8} requests {:>8} calls{}'.format(
+        label, wall, files / wall, drive.requests - requests, drive.calls - calls, '' if done else ' (not all copied)'))
+    return wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure batched Drive copies against one call per file.")
+    parser.add_argument('--files', type=int, default=300, help='number of small files to copy.')
+    parser.add_argument('--folders', type=int, default=6, help='number of folders they are in.')
+    parser.add_argument('--accounts', type=int, default=4, help='number of service accounts.')
+    parser.add_argument('--workers', type=int, default=2, help='accounts copying at the same time.')
+    parser.add_argument('--rtt', type=float, default=0.1, help='seconds every HTTP request to the stand-in takes.')
+    parser.add_argument('--quota_files', type=int, default=None, help='copies an account makes before its quota error.')
+    parser.add_argument('--tpslimit', type=float, default=TPSLIMIT, help='calls per second per account of both runs.')
+    parser.add_argument('--batch_tps', type=float, default=None,
+                        help='also run the batch engine at this many calls per second per account.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='autorclone-bench-')
+    try:
+        sa_files = fake_keys(workdir, args.accounts)
+        runs = [('one call per request, {:g}/s'.format(args.tpslimit), lambda manifest, endpoint: per_file(
+                    sa_files, manifest, endpoint, args.workers, args.tpslimit))]
+        for tps in [args.tpslimit] + ([args.batch_tps] if args.batch_tps not in (None, args.tpslimit) else []):
+            runs.append(('batch of 100 per request, {:g}/s'.format(tps), lambda manifest, endpoint, tps=tps: batched(
+                sa_files, manifest, endpoint, args.workers, tps, os.path.join(workdir, 'ledger_{:g}.json'.format(tps)))))
+        results = []
+        for label, run in runs:
+            # A fresh stand-in and manifest for every run
+            drive = FakeDrive(args.rtt, args.quota_files)
+            server = start_drive_server(drive)
+            endpoint = 'http://localhost:{}'.format(server.server_address[1])
+            manifest = fake_manifest(os.path.join(workdir, 'manifest_{}.db'.format(len(results))), args.files, args.folders)
+            results.append(bench(label, lambda: run(manifest, endpoint), drive, args.files))
+            manifest.close()
+            server.shutdown()
+        print('speedup at the same rate: {:.1f}x'.format(results[0] / max(results[1], 1e-9)))
+        if len(results) > 2:
+            print('speedup at {:g}/s: {:.1f}x, of which the rate: {:.1f}x'.format(
+                args.batch_tps, results[0] / max(results[2], 1e-9), results[1] / max(results[2], 1e-9)))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# autorclone benchmark: cost of one stats poll
+#
+# Compares the old way of polling rclone (fork a shell running `rclone rc core/stats`)
+# with the kept-alive RcClient, against a local stand-in rc endpoint, so no real
+# rclone copy or Google account is needed.
+#
+#   python3 bench_rc_poll.py -n 200
+#
+from __future__ import print_function
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from fake_rclone import Copy, start_rc_server
+from rclone_rc import RcClient
+
+
+def _cpu():
+    t = os.times()
+    # own CPU plus CPU of the forked shells and rclone/python children
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def bench(label, poll, n):
+    cpu_start, wall_start = _cpu(), time.perf_counter()
+    for _ in range(n):
+        poll()
+    wall = time.perf_counter() - wall_start
+    cpu = _cpu() - cpu_start
+    print('{:<28} {:>10.3f} ms/poll {:>10.3f} ms CPU/poll'.format(label, wall / n * 1000, cpu / n * 1000))
+    return wall / n, cpu / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the overhead of polling rclone remote control.")
+    parser.add_argument('-n', '--polls', type=int, default=100, help='number of polls for each method.')
+    parser.add_argument('--rc-addr', type=str, default=None,
+                        help='poll a running rclone instead of the local stand-in endpoint.')
+    parser.add_argument('--timeout', type=float, default=5, help='seconds one poll may take, like RC_TIMEOUT.')
+    args = parser.parse_args()
+
+    if args.rc_addr:
+        addr = args.rc_addr
+    else:
+        server = start_rc_server(Copy([['grow', 0, 1 << 20]], 'bench'))
+        addr = 'localhost:{}'.format(server.server_address[1])
+
+    # Old way: a shell and a whole rclone process per poll. Without rclone
+    # installed use a one-shot python client, which still pays for the fork/exec.
+    if shutil.which('rclone'):
+        old_label = 'subprocess rclone rc'
+        old_cmd = 'rclone rc --rc-addr="{}" core/stats'.format(addr)
+    else:
+        old_label = 'subprocess (python stand-in)'
+        old_cmd = '"{}" -c "import urllib.request as u; u.urlopen(u.Request(\'http://{}/core/stats\', b\'{{}}\'))"'.format(
+            sys.executable, addr)
+
+    old = bench(old_label, lambda: subprocess.check_output(old_cmd, shell=True), args.polls)
+
+    rc = RcClient(addr, timeout=args.timeout)
+    new = bench('RcClient keep-alive', rc.stats, args.polls)
+
+    print('speedup: {:.1f}x wall, {:.1f}x CPU'.format(old[0] / max(new[0], 1e-9), old[1] / max(new[1], 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+# autorclone coordinator
+#
+# The network link of one host caps the copy long before the service accounts do.
+# With --coordinator one rclone_sa_magic.py owns the account pool, the quota ledger,
+# the manifest and the plan, and hands work units (one account and a batch of files)
+# to nodes, rclone_sa_magic.py --node URL on other machines, over plain HTTP and json:
+#
+#   GET  /config    the rclone config for the nodes (keys inline) and the copy arguments
+#   POST /lease     {"node": name} -> {"unit": {"id", "sa_id", "paths", "size", "budget", "tpslimit"} or null,
+#                                      "done": true once there is nothing left to hand out}
+#   POST /progress  {"unit": id, "bytes": n, "files": [paths copied]} -> {"stop": true if the unit was taken back}
+#   POST /finish    {"unit": id, "reason": why rclone stopped, "bytes": n, "files": [...]}
+#   GET  /status    the units out, what is left
+#
+# The server is single threaded: the manifest (sqlite), the plan and the ledger are
+# only touched from the thread serving the requests. A unit whose node went quiet
+# for UNIT_TIMEOUT is taken back: its files missing go back to the plan, its account
+# stays out of the pool since the node may still be copying with it.
+#
+import hmac
+import json
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from metrics import METRICS
+
+UNIT_TIMEOUT = 300  # seconds without progress after which a unit is taken back from its node
+DONE_LINGER = 60  # seconds the coordinator keeps answering once done, for the nodes to learn it
+CLIENT_TIMEOUT = 30  # seconds a node waits for one answer of the coordinator
+
+
+class CoordinatorError(Exception):
+    pass
+
+
+class Unit(object):
+    """a batch of the plan, leased to a node with an account"""
+
+    def __init__(self, batch, sa_id, email, node, budget, tpslimit):
+        self.batch = batch
+        self.sa_id = sa_id
+        self.email = email
+        self.node = node
+        self.budget = budget
+        self.tpslimit = tpslimit
+        self.bytes = 0
+        self.files = 0
+        self.started = self.seen = time.time()
+
+    def to_json(self):
+        return {'id': self.batch.number, 'sa_id': self.sa_id, 'paths': self.batch.paths, 'size': self.batch.size,
+                'budget': self.budget, 'tpslimit': self.tpslimit}
+
+
+class Coordinator(object):
+    """hands the batches of plan to the nodes, with accounts of pool, and keeps the
+        ledger and the manifest up to date from what the nodes report
+    """
+
+    def __init__(self, pool, plan, manifest, node_config, token=None, tpslimit=3, full_budget=650 * 2 ** 30,
+                 batch_attempts=3, save_interval=30, on_event=None, unit_timeout=UNIT_TIMEOUT):
+        self.pool = pool
+        self.plan = plan
+        self.manifest = manifest
+        # what GET /config returns: {'rclone_config': text, 'args': {...}}
+        self.node_config = node_config
+        self.token = token
+        self.tpslimit = tpslimit
+        # an account given back with less than this left goes to the end of the pool
+        self.full_budget = full_budget
+        self.batch_attempts = batch_attempts
+        self.save_interval = save_interval
+        self.on_event = on_event or (lambda event, **fields: None)
+        self.unit_timeout = unit_timeout
+        # unit id (the batch number) -> Unit
+        self.units = {}
+        self.nodes = set()
+        self.told_done = set()
+        self.out_of_accounts = False
+        self.done_since = None
+        self.saved_at = time.time()
+
+    def done(self):
+        # Nothing out and nothing more to hand out (or no account to hand it out with)
+        return not self.units and (not self.plan.batches or self.out_of_accounts)
+
+    def finished(self):
+        if not self.done():
+            self.done_since = None
+            return False
+        if self.done_since is None:
+            self.done_since = time.time()
+        return self.nodes <= self.told_done or time.time() - self.done_since >= DONE_LINGER
+
+    def config(self):
+        return self.node_config
+
+    def lease(self, node):
+        self.nodes.add(node)
+        unit = self.next_unit(node)
+        if unit is not None:
+            return {'unit': unit.to_json(), 'done': False}
+        if self.done():
+            self.told_done.add(node)
+        return {'unit': None, 'done': self.done()}
+
+    def next_unit(self, node):
+        batch = self.plan.next_batch()
+        if batch is None:
+            return None
+        sa_id = batch.sa_id if batch.sa_id is not None else self.pool.next_id()
+        if sa_id is None:
+            # Wait for an account a node gives back
+            self.plan.batches.insert(0, batch)
+            self.out_of_accounts = True
+            return None
+        self.pool.started(sa_id)
+        unit = Unit(batch, sa_id, self.pool.email(sa_id), node, self.pool.budget_bytes(sa_id),
+                    self.pool.tpslimit(sa_id, self.tpslimit))
+        self.units[batch.number] = unit
+        print('unit {}: {} files ({:.2f}GB) with {:03d} ({}) to {}.'.format(
+            batch.number, len(batch.paths), batch.size / 2 ** 30, sa_id, unit.email, node))
+        self.on_event('sa_started', node=node, unit=batch.number, sa_id=sa_id, email=unit.email, budget=unit.budget)
+        return unit
+
+    def update(self, unit, nbytes, files):
+        # What the node reported since last time: bytes for the ledger, files for the manifest
+        unit.seen = time.time()
+        if nbytes > unit.bytes:
+            if unit.email is not None:
+                self.pool.ledger.record(unit.email, nbytes - unit.bytes)
+            METRICS.inc('autorclone_bytes_transferred_total', nbytes - unit.bytes)
+            METRICS.inc('autorclone_sa_bytes_total', nbytes - unit.bytes, sa='{:03d}'.format(unit.sa_id),
+                        email=unit.email or '')
+            unit.bytes = nbytes
+        if files:
+            unit.files += len(files)
+            self.manifest.mark_done(files)
+            self.on_event('files_completed', node=unit.node, sa_id=unit.sa_id, files=files)
+
+    def progress(self, unit_id, nbytes, files):
+        unit = self.units.get(unit_id)
+        if unit is None:
+            # Taken back: another node has its files by now
+            return {'stop': True}
+        self.update(unit, nbytes, files)
+        return {'stop': False}
+
+    def finish(self, unit_id, reason, nbytes, files):
+        unit = self.units.pop(unit_id, None)
+        if unit is None:
+            return {}
+        self.update(unit, nbytes, files)
+        print('unit {}: {} stopped {:03d} ({}) after {:.2f}GB: {}.'.format(
+            unit_id, unit.node, unit.sa_id, unit.email, unit.bytes / 2 ** 30, reason))
+        METRICS.inc('autorclone_switches_total', reason=reason)
+        self.on_event('sa_stopped', node=unit.node, unit=unit_id, sa_id=unit.sa_id, bytes=unit.bytes, reason=reason)
+        self.pool.record_run(unit.sa_id, unit.bytes, time.time() - unit.started, reason)
+        self.pool.stopped(unit.sa_id)
+        # A quota error, or a stalled account, means Google's daily limit was hit before our own count did
+        if reason in ('quota', 'stall') and unit.email is not None:
+            self.pool.ledger.mark_exhausted(unit.email)
+        elif reason in ('finished', 'failed'):
+            # rclone ran out of work (or never ran), not out of quota: the next unit can have the account
+            self.pool.give_back(unit.sa_id, last=reason == 'failed' or self.pool.budget_bytes(unit.sa_id) < self.full_budget)
+            self.out_of_accounts = False
+        self.requeue(unit.batch, reason == 'finished')
+        self.pool.ledger.save()
+        return {}
+
+    def requeue(self, batch, finished):
+        # What the unit did not copy is planned again for the next free account
+        paths, size = self.manifest.missing(batch.paths)
+        attempts = batch.attempts + finished
+        if paths and attempts > self.batch_attempts:
+            print('batch {}: giving up {} files that failed {} times.'.format(batch.number, len(paths), self.batch_attempts))
+            self.on_event('batch_failed', batch=batch.number, files=paths)
+            return
+        requeued = self.plan.requeue(paths, size, attempts)
+        if requeued is not None:
+            print('batch {}: {} files ({:.2f}GB) left, planned again as batch {}.'.format(
+                batch.number, len(paths), size / 2 ** 30, requeued.number))
+
+    def tick(self):
+        # Take back the units of the nodes gone quiet, save the ledger now and then
+        now = time.time()
+        for unit_id, unit in sorted(self.units.items()):
+            if now - unit.seen >= self.unit_timeout:
+                del self.units[unit_id]
+                print('unit {}: nothing from {} for {}s, taking it back.'.format(unit_id, unit.node, self.unit_timeout))
+                self.on_event('sa_stopped', node=unit.node, unit=unit_id, sa_id=unit.sa_id, bytes=unit.bytes, reason='lost')
+                self.pool.stopped(unit.sa_id)
+                self.requeue(unit.batch, False)
+        if now - self.saved_at >= self.save_interval:
+            self.pool.ledger.save()
+            self.saved_at = now
+
+    def status(self):
+        count, size = self.manifest.remaining()
+        return {'units': [{'id': unit_id, 'node': unit.node, 'sa_id': unit.sa_id, 'bytes': unit.bytes, 'files': unit.files,
+                           'seen': unit.seen} for unit_id, unit in sorted(self.units.items())],
+                'batches': len(self.plan.batches), 'remaining_files': count, 'remaining_bytes': size,
+                'left_files': len(self.plan.left_paths), 'nodes': sorted(self.nodes), 'done': self.done()}
+
+    def serve(self, port, addr='localhost', poll=1):
+        """answer the nodes until the copy is done and they know it"""
+        server = HTTPServer((addr, port), _CoordinatorHandler)
+        server.coordinator = self
+        server.timeout = poll
+        try:
+            while not self.finished():
+                server.handle_request()
+                self.tick()
+        finally:
+            server.server_close()
+
+
+class _CoordinatorHandler(BaseHTTPRequestHandler):
+
+    def reply(self, status, reply):
+        data = json.dumps(reply).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def authorized(self):
+        token = self.server.coordinator.token
+        if token is None or hmac.compare_digest(self.headers.get('Authorization', ''), 'Bearer ' + token):
+            return True
+        self.reply(401, {'error': 'unauthorized'})
+        return False
+
+    def do_GET(self):
+        coordinator = self.server.coordinator
+        routes = {'/config': coordinator.config, '/status': coordinator.status}
+        if not self.authorized():
+            return
+        if self.path not in routes:
+            return self.reply(404, {'error': 'not found'})
+        self.reply(200, routes[self.path]())
+
+    def do_POST(self):
+        coordinator = self.server.coordinator
+        if not self.authorized():
+            return
+        try:
+            params = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8') or '{}')
+            if self.path == '/lease':
+                reply = coordinator.lease(str(params['node']))
+            elif self.path == '/progress':
+                reply = coordinator.progress(int(params['unit']), int(params.get('bytes', 0)), params.get('files') or [])
+            elif self.path == '/finish':
+                reply = coordinator.finish(int(params['unit']), str(params.get('reason')), int(params.get('bytes', 0)),
+                                           params.get('files') or [])
+            else:
+                return self.reply(404, {'error': 'not found'})
+        except (KeyError, TypeError, ValueError) as error:
+            return self.reply(400, {'error': 'bad request: {}'.format(error)})
+        self.reply(200, reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class CoordinatorClient(object):
+    """the calls of a node to the coordinator at url, raising CoordinatorError"""
+
+    def __init__(self, url, token=None, timeout=CLIENT_TIMEOUT):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def call(self, path, params=None):
+        # GET without params, POST with
+        data = json.dumps(params).encode('utf-8') if params is not None else None
+        request = urllib.request.Request(self.url + path, data=data)
+        request.add_header('Content-Type', 'application/json')
+        if self.token:
+            request.add_header('Authorization', 'Bearer ' + self.token)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as error:
+            raise CoordinatorError('{} {}: {}'.format(path, error.code, error.read().decode('utf-8', 'replace')))
+        except (OSError, ValueError) as error:
+            raise CoordinatorError('{}: {}'.format(path, error))
+
+    def config(self):
+        return self.call('/config')
+
+    def lease(self, node):
+        return self.call('/lease', {'node': node})
+
+    def progress(self, unit_id, nbytes, files):
+        return self.call('/progress', {'unit': unit_id, 'bytes': nbytes, 'files': files})
+
+    def finish(self, unit_id, reason, nbytes, files):
+        return self.call('/finish', {'unit': unit_id, 'reason': reason, 'bytes': nbytes, 'files': files})
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# autorclone fake Drive API
+#
+# A local stand-in for the parts of the Drive v3 API and of the OAuth token endpoint
+# the batch copy engine uses, for measuring it offline: no Google account needed.
+#
+#   python3 fake_drive_api.py --port 8089 --rtt 0.1 --quota_files 5000
+#   python3 rclone_sa_magic.py --engine batch --drive_api http://localhost:8089 \
+#       --token_uri http://localhost:8089/token ...
+#
+#   POST /token                      any signed service account assertion gets a token
+#   POST /drive/v3/files/ID/copy     copies nothing, remembers the new file
+#   GET  /drive/v3/files?q=...       finds a file or folder by name and parent
+#   POST /drive/v3/files             creates a folder
+#   POST /batch/drive/v3             multipart/mixed of the calls above
+#
+# Every HTTP request waits --rtt seconds first, like a round trip to Google (the
+# calls inside a batch do not). After --quota_files copies an account only gets
+# 403 userRateLimitExceeded, and a file ID starting with "missing" is not found.
+# With --lost_replies a share of the copies is made but answered 503 backendError,
+# like a reply lost on the way back.
+#
+from __future__ import print_function
+import argparse
+import base64
+import email.parser
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeDrive(object):
+    """the files and folders made so far, and what every account did"""
+
+    def __init__(self, rtt=0.0, quota_files=None, lost_replies=0.0):
+        self.rtt = rtt
+        self.quota_files = quota_files
+        self.lost_replies = lost_replies
+        self.lock = threading.Lock()
+        # id -> {'name', 'parents', 'mimeType'}
+        self.files = {}
+        # email -> copies made
+        self.copies = {}
+        self.requests = 0
+        self.calls = 0
+
+    def new_id(self):
+        return 'fake{:08d}'.format(len(self.files) + 1)
+
+    def call(self, method, path, query, body, account):
+        """one API call, returns (status, json)"""
+        with self.lock:
+            self.calls += 1
+            match = re.match(r'^/drive/v3/files/([^/]+)/copy$', path)
+            if method == 'POST' and match:
+                if match.group(1).startswith('missing'):
+                    return 404, error(404, 'notFound', 'File not found: {}.'.format(match.group(1)))
+                if self.quota_files is not None and self.copies.get(account, 0) >= self.quota_files:
+                    return 403, error(403, 'userRateLimitExceeded', 'User rate limit exceeded.')
+                self.copies[account] = self.copies.get(account, 0) + 1
+                file_id = self.new_id()
+                self.files[file_id] = {'name': body.get('name'), 'parents': body.get('parents') or [],
+                                       'mimeType': 'application/octet-stream'}
+                if random.random() < self.lost_replies:
+                    return 503, error(503, 'backendError', 'Backend Error')
+                return 200, {'id': file_id}
+            if path == '/drive/v3/files' and method == 'POST':
+                file_id = self.new_id()
+                self.files[file_id] = {'name': body.get('name'), 'parents': body.get('parents') or [],
+                                       'mimeType': body.get('mimeType')}
+                return 200, {'id': file_id}
+            if path == '/drive/v3/files' and method == 'GET':
+                # name = 'x' and 'parent' in parents [and mimeType = '...'] and trashed = false
+                values = [value.replace("\\'", "'").replace('\\\\', '\\')
+                          for value in re.findall(r"'((?:[^'\\]|\\.)*)'", query.get('q', [''])[0])]
+                found = [{'id': file_id} for file_id, info in sorted(self.files.items())
+                         if len(values) >= 2 and info['name'] == values[0] and values[1] in info['parents']
+                         and (len(values) < 3 or info['mimeType'] == values[2])]
+                return 200, {'files': found[:1]}
+            return 404, error(404, 'notFound', 'Not found: {} {}'.format(method, path))
+
+
+def error(code, reason, message):
+    return {'error': {'code': code, 'message': message, 'errors': [{'reason': reason, 'message': message}]}}
+
+
+def account_of(headers):
+    # The token is "fake:<client_email>"
+    authorization = headers.get('Authorization', '')
+    return authorization[len('Bearer fake:'):] if authorization.startswith('Bearer fake:') else None
+
+
+class _DriveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, status, data, content_type='application/json'):
+        if not isinstance(data, bytes):
+            data = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_any(self, method):
+        drive = self.server.drive
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with drive.lock:
+            drive.requests += 1
+        time.sleep(drive.rtt)
+        url = urllib.parse.urlsplit(self.path)
+
+        if url.path == '/token':
+            # The jwt-bearer assertion of a service account: its payload names the account
+            assertion = urllib.parse.parse_qs(body.decode('utf-8')).get('assertion', [''])[0]
+            try:
+                payload = assertion.split('.')[1]
+                claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+            except (IndexError, ValueError):
+                return self.reply(400, {'error': 'invalid_grant'})
+            return self.reply(200, {'access_token': 'fake:' + claims.get('iss', ''), 'expires_in': 3600,
+                                    'token_type': 'Bearer'})
+
+        account = account_of(self.headers)
+        if account is None:
+            return self.reply(401, error(401, 'authError', 'Invalid Credentials'))
+
+        if url.path == '/batch/drive/v3':
+            message = email.parser.BytesParser().parsebytes(
+                b'Content-Type: ' + self.headers.get('Content-Type', '').encode('utf-8') + b'\r\n\r\n' + body)
+            boundary = 'batch_fake_{}'.format(time.time())
+            parts = []
+            for part in message.get_payload():
+                request = part.get_payload()
+                head, _, inner_body = request.partition('\r\n\r\n') if '\r\n\r\n' in request else request.partition('\n\n')
+                request_line = head.splitlines()[0].split(' ')
+                inner = urllib.parse.urlsplit(request_line[1])
+                status, reply = drive.call(request_line[0], inner.path, urllib.parse.parse_qs(inner.query),
+                                           json.loads(inner_body) if inner_body.strip() else {}, account)
+                parts.append('--{}\r\nContent-Type: application/http\r\nContent-ID: <response-{}>\r\n\r\n'
+                             'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n\r\n{}\r\n'.format(
+                                 boundary, part['Content-ID'].strip('<>'), status, 'OK' if status == 200 else 'Error',
+                                 json.dumps(reply)))
+            data = (''.join(parts) + '--{}--\r\n'.format(boundary)).encode('utf-8')
+            return self.reply(200, data, 'multipart/mixed; boundary={}'.format(boundary))
+
+        status, reply = drive.call(method, url.path, urllib.parse.parse_qs(url.query),
+                                   json.loads(body.decode('utf-8')) if body.strip() else {}, account)
+        self.reply(status, reply)
+
+    def do_GET(self):
+        self.handle_any('GET')
+
+    def do_POST(self):
+        self.handle_any('POST')
+
+    def log_message(self, *args):
+        pass
+
+
+def start_drive_server(drive, addr='localhost', port=0):
+    """serve drive from a background thread, returns the server"""
+    server = ThreadingHTTPServer((addr, port), _DriveHandler)
+    server.drive = drive
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A local stand-in for the Drive API calls of the batch copy engine.')
+    parser.add_argument('--port', type=int, default=8089, help='port to listen on.')
+    parser.add_argument('--rtt', type=float, default=0.1, help='seconds every HTTP request waits, like a round trip.')
+    parser.add_argument('--quota_files', type=int, default=None,
+                        help='copies an account may make before it only gets 403 userRateLimitExceeded.')
+    parser.add_argument('--lost_replies', type=float, default=0.0,
+                        help='share of the copies made but answered 503 backendError.')
+    args = parser.parse_args()
+    drive = FakeDrive(args.rtt, args.quota_files, args.lost_replies)
+    start_drive_server(drive, port=args.port)
+    print('fake Drive API on http://localhost:{}'.format(args.port))
+    try:
+        while True:
+            time.sleep(10)
+            print('{} requests, {} calls, {} files'.format(drive.requests, drive.calls, len(drive.files)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
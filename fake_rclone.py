@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# autorclone fake rclone
+#
+# A stand-in for the rclone binary, for measuring the supervisor offline: no
+# Google account, network or real rclone needed. `copy` starts an rc endpoint
+# (core/stats, core/pid, core/transferred, options/set, core/quit, ...) whose bytes
+# follow a scripted scenario, and writes rclone style lines to --log-file.
+#
+#   RCLONE=./fake_rclone.py FAKE_RCLONE_SCENARIO=scenario.json python3 rclone_sa_magic.py ...
+#
+# The scenario lists phases per account (the NNN of the dstNNN remote), "default"
+# is used for the others. Once the last phase is reached it lasts until killed.
+#
+#   {"default": [["stall", 3], ["grow", 10, 1073741824], ["quota", 600]],
+#    "003": [["grow", 5, 1073741824], ["exit"]]}
+#
+#   ["grow", seconds, bytes_per_second]  copy at that speed
+#   ["stall", seconds]                   no progress, nothing logged (listing, silent stall)
+#   ["quota", seconds]                   no progress, a 403 userRateLimitExceeded logged every second
+#   ["daily", seconds]                   no progress, a 403 dailyLimitExceeded logged every second
+#   ["throttle", seconds, bytes_per_second]  copy at that speed, a 403 userRateLimitExceeded logged every second
+#   ["exit"]                             the copy is done, rclone exits
+#
+# Like rclone, --max-transfer with --cutoff-mode soft ends the copy (exit code 8)
+# once that many bytes are done.
+#
+# core/transferred reports the files given with --files-from-raw as copied, in
+# order, one for every 64MB done (the last TRANSFERRED_MAX of them, like rclone), and
+# the log says "Copied" for each.
+#
+# `lsjson` lists a small fixed tree, with --fast-list it first takes
+# FAKE_RCLONE_ENTRY_BYTES of memory per entry, like the real one holding the tree.
+#
+# `rcd` serves the same endpoint without a copy, `sync/copy` with _async then starts
+# one as a job (job/status, job/stop, core/stats with group job/N).
+#
+# What happened and when is appended as json lines to FAKE_RCLONE_EVENTS if set.
+#
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_SCENARIO = {'default': [['stall', 2], ['grow', 10, 1 << 30], ['quota', 3600]]}
+RATE_LIMIT_ERROR = 'googleapi: Error 403: User rate limit exceeded., userRateLimitExceeded'
+DAILY_LIMIT_ERROR = 'googleapi: Error 403: Daily limit exceeded., dailyLimitExceeded'
+RC_TIMEOUT = 10  # seconds `rc` waits for the reply
+TRANSFERRED_MAX = 100  # core/transferred of rclone only keeps the last 100 transfers
+# flags of the real rclone that take a value as the next argument
+VALUE_FLAGS = ('--config', '--tpslimit', '--transfers', '--checkers', '--drive-chunk-size', '--disable',
+               '--filter-from', '--files-from', '--files-from-raw', '--low-level-retries', '--max-depth',
+               '--log-file', '--rc-addr', '--bwlimit', '--max-transfer', '--cutoff-mode', '--hash-type',
+               '--include', '--exclude', '--exclude-from', '--include-from', '--max-size', '--min-size',
+               '--fs-cache-expire-duration')
+
+
+def parse_argv(argv):
+    flags, positionals = {}, []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg.startswith('-') and len(arg) > 1:
+            if '=' in arg:
+                key, value = arg.split('=', 1)
+                flags[key] = value.strip('"')
+            elif arg in VALUE_FLAGS and i + 1 < len(argv):
+                flags[arg] = argv[i + 1]
+                i += 1
+            else:
+                flags[arg] = True
+        else:
+            positionals.append(arg)
+        i += 1
+    return flags, positionals
+
+
+def event(kind, **fields):
+    path = os.environ.get('FAKE_RCLONE_EVENTS')
+    if not path:
+        return
+    fields.update(event=kind, ts=time.time(), pid=os.getpid())
+    with io.open(path, 'a', encoding='utf-8') as fp:
+        fp.write(json.dumps(fields) + '\n')
+
+
+def load_scenario(account):
+    scenario = DEFAULT_SCENARIO
+    path = os.environ.get('FAKE_RCLONE_SCENARIO')
+    if path:
+        with io.open(path, 'r', encoding='utf-8') as fp:
+            scenario = json.load(fp)
+    return scenario.get(account) or scenario.get('default') or DEFAULT_SCENARIO['default']
+
+
+class Copy(object):
+    """the state of a fake `rclone copy`, as a function of the time since it started"""
+
+    def __init__(self, phases, account):
+        self.phases = phases
+        self.account = account
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.options = {}
+        self.polls = 0
+        # rcd jobs: set by job/stop, and once the copy ended
+        self.jobid = None
+        self.stopped = False
+        self.ended_at = None
+        self.error = ''
+        # with --files-from-raw: the files it was given, reported done in order as bytes grow
+        self.files = []
+
+    def phase_at(self, elapsed):
+        # Returns (phase, seconds into it, bytes done before it)
+        done = 0.0
+        start = 0.0
+        for phase in self.phases:
+            seconds = phase[1] if len(phase) > 1 else 0
+            if phase is self.phases[-1] or elapsed < start + seconds:
+                return phase, elapsed - start, done
+            if phase[0] in ('grow', 'throttle'):
+                done += seconds * phase[2]
+            start += seconds
+        return self.phases[-1], 0, done
+
+    def stats(self):
+        elapsed = (self.ended_at or time.time()) - self.started
+        phase, into, done = self.phase_at(elapsed)
+        speed = 0
+        if phase[0] in ('grow', 'throttle'):
+            if len(phase) > 1 and phase is not self.phases[-1]:
+                into = min(into, phase[1])
+            done += into * phase[2]
+            speed = phase[2]
+        last_error = ''
+        if phase[0] in ('quota', 'throttle'):
+            last_error = RATE_LIMIT_ERROR
+        elif phase[0] == 'daily':
+            last_error = DAILY_LIMIT_ERROR
+        files = int(done // (64 << 20))
+        # one error a second, like the lines logged
+        return {'bytes': int(done), 'checks': files, 'speed': speed, 'errors': int(into) + 1 if last_error else 0,
+                'lastError': last_error, 'transfers': files, 'elapsedTime': elapsed, 'retryError': bool(last_error),
+                'fatalError': False, 'totalBytes': 0, 'totalChecks': 0, 'totalTransfers': 0, 'deletes': 0,
+                'renames': 0}
+
+    def transferred(self, last=TRANSFERRED_MAX):
+        return [{'name': name, 'size': 1 << 20, 'error': '', 'checked': False}
+                for name in self.files[:self.stats()['transfers']][-last:]]
+
+
+class _RcHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            params = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+        except ValueError:
+            params = {}
+        command = self.path.strip('/')
+        status = 200
+        jobs = self.server.jobs
+        group = params.get('group') or ''
+        copy = jobs.get(int(group[4:])) if group.startswith('job/') and group[4:].isdigit() else self.server.copy
+        if copy is None:
+            # an rcd before its first job
+            copy = Copy([['stall', 0]], 'rcd')
+
+        if command == 'sync/copy':
+            match = re.match(r'dst(\d+)', params.get('dstFs', ''))
+            job = Copy(load_scenario(match.group(1) if match else 'default'), match.group(1) if match else 'default')
+            job.jobid = len(jobs) + 1
+            job.files = read_files_from(((params.get('_filter') or {}).get('FilesFromRaw') or [None])[0])
+            jobs[job.jobid] = self.server.copy = job
+            config = params.get('_config') or {}
+            max_transfer = None
+            if config.get('MaxTransfer') and str(config.get('CutoffMode', 'hard')).lower() == 'soft':
+                max_transfer = parse_size(config['MaxTransfer'])
+            event('launch', account=job.account, job=job.jobid, argv=['sync/copy', 'jobid={}'.format(job.jobid),
+                                                       '--rc-addr=localhost:{}'.format(self.server.server_address[1])])
+            threading.Thread(target=follow, args=(job, self.server.log, max_transfer), daemon=True).start()
+            reply = {'jobid': job.jobid}
+        elif command == 'job/status':
+            job = jobs.get(int(params.get('jobid', 0)))
+            if job is None:
+                status, reply = 404, {'error': 'job not found', 'status': 404}
+            else:
+                reply = {'id': job.jobid, 'finished': job.ended_at is not None, 'success': job.ended_at is not None and not job.error,
+                         'error': job.error, 'duration': time.time() - job.started}
+        elif command == 'job/stop':
+            job = jobs.get(int(params.get('jobid', 0)))
+            if job is not None:
+                job.stopped = True
+                event('stop', account=job.account, job=job.jobid)
+            reply = {}
+        elif command == 'operations/fsinfo':
+            event('fsinfo', fs=params.get('fs'))
+            reply = {'Name': params.get('fs', '').split(':')[0], 'Hashes': ['md5']}
+        elif command == 'core/stats':
+            with copy.lock:
+                copy.polls += 1
+            # CPU so far, the benchmark takes it out of the supervisor's children usage
+            event('poll', account=copy.account, job=copy.jobid, cpu=sum(os.times()[:2]))
+            reply = copy.stats()
+        elif command == 'core/pid':
+            reply = {'pid': os.getpid()}
+        elif command == 'core/transferred':
+            reply = {'transferred': copy.transferred()}
+        elif command == 'options/set':
+            copy.options.update(params.get('main', {}))
+            event('options', account=copy.account, options=params)
+            reply = {}
+        elif command == 'core/bwlimit':
+            event('bwlimit', account=copy.account, rate=params.get('rate'))
+            reply = {'rate': params.get('rate', 'off')}
+        elif command == 'core/quit':
+            event('quit', account=copy.account)
+            threading.Timer(0.05, os._exit, (int(params.get('exitCode', 0)),)).start()
+            reply = {}
+        elif command == 'rc/noop':
+            reply = params
+        else:
+            status, reply = 404, {'error': "couldn't find method {!r}".format(command), 'status': 404}
+
+        data = json.dumps(reply).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_rc_server(copy, addr='localhost:0', log=None):
+    """serve the rc endpoint of `copy` (None for an rcd) from a background thread, returns the server"""
+    host, _, port = addr.rpartition(':')
+    server = ThreadingHTTPServer((host or 'localhost', int(port)), _RcHandler)
+    server.copy = copy
+    server.jobs = {}
+    server.log = log or io.StringIO()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def log_line(fp, level, text):
+    fp.write('{} {:<6}: {}\n'.format(time.strftime('%Y/%m/%d %H:%M:%S'), level, text))
+    fp.flush()
+
+
+def parse_size(text):
+    # rclone size suffixes, KiB without one
+    units = {'B': 0, 'K': 10, 'M': 20, 'G': 30, 'T': 40, 'P': 50}
+    text = str(text).strip().upper()
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * 2 ** units[text[-1]])
+    return int(float(text) * 1024)
+
+
+def follow(copy, log, max_transfer=None):
+    """play the scenario of copy, one step a second, logging like rclone -vv; returns the exit code"""
+    last_phase, logged = None, 0
+    while True:
+        phase, into, done = copy.phase_at(time.time() - copy.started)
+        if copy.stopped:
+            copy.error = 'context canceled'
+            copy.ended_at = time.time()
+            return 1
+        if max_transfer is not None and copy.stats()['bytes'] >= max_transfer:
+            log_line(log, 'ERROR', 'Cancelling sync due to fatal error: max transfer limit reached as set by --max-transfer')
+            event('exit', account=copy.account, job=copy.jobid, bytes=copy.stats()['bytes'], code=8)
+            copy.error = 'max transfer limit reached as set by --max-transfer'
+            copy.ended_at = time.time()
+            return 8
+        if phase is not last_phase:
+            event('phase', account=copy.account, job=copy.jobid, phase=phase[0], bytes=copy.stats()['bytes'])
+            last_phase = phase
+        if phase[0] == 'exit':
+            log_line(log, 'INFO', 'There was nothing to transfer' if not done else 'Transferred: all done')
+            event('exit', account=copy.account, job=copy.jobid, bytes=copy.stats()['bytes'])
+            copy.ended_at = time.time()
+            return 0
+        if phase[0] in ('grow', 'throttle'):
+            # The files of --files-from-raw as core/transferred reports them, or a made up one
+            if copy.files:
+                names = [item['name'] for item in copy.transferred(len(copy.files))[logged:]]
+            else:
+                names = ['file{:08d}.bin'.format(copy.stats()['transfers'])]
+            for name in names:
+                log_line(log, 'INFO', '{}: Copied (server-side copy)'.format(name))
+            logged += len(names)
+        if phase[0] in ('quota', 'throttle', 'daily'):
+            error = DAILY_LIMIT_ERROR if phase[0] == 'daily' else RATE_LIMIT_ERROR
+            log_line(log, 'DEBUG', 'pacer: low level retry 1/1 (error {})'.format(error))
+            log_line(log, 'ERROR', 'file.bin: Failed to copy: {}'.format(error))
+        time.sleep(1)
+
+
+def open_log(flags):
+    return io.open(flags['--log-file'], 'a', encoding='utf-8') if flags.get('--log-file') else io.StringIO()
+
+
+def read_files_from(path):
+    if not path:
+        return []
+    with io.open(path, 'r', encoding='utf-8') as fp:
+        return [line.rstrip('\n') for line in fp if line.strip()]
+
+
+def run_copy(flags, positionals):
+    dst = positionals[-1] if positionals else ''
+    match = re.match(r'dst(\d+)', dst)
+    account = match.group(1) if match else 'default'
+    copy = Copy(load_scenario(account), account)
+    copy.files = read_files_from(flags.get('--files-from-raw'))
+    event('launch', account=account, argv=sys.argv[1:])
+
+    log = open_log(flags)
+    server = None
+    if flags.get('--rc'):
+        server = start_rc_server(copy, str(flags.get('--rc-addr', 'localhost:5572')).strip('"'), log)
+    log_line(log, 'INFO', 'Starting fake rclone copy to {}'.format(dst))
+
+    max_transfer = None
+    if flags.get('--max-transfer') and flags.get('--cutoff-mode', 'hard').lower() == 'soft':
+        max_transfer = parse_size(flags['--max-transfer'])
+
+    code = follow(copy, log, max_transfer)
+    if server is not None:
+        server.shutdown()
+    return code
+
+
+def run_rcd(flags):
+    log = open_log(flags)
+    start_rc_server(None, str(flags.get('--rc-addr', 'localhost:5572')).strip('"'), log)
+    event('rcd', argv=sys.argv[1:])
+    log_line(log, 'NOTICE', 'Serving remote control on fake rcd')
+    # core/quit ends the process
+    while True:
+        time.sleep(3600)
+
+
+def tree_files(remote):
+    """(path, size, md5) of the files of the fake tree: c.bin, a/0-99.bin and b/0-3/0-24.bin.
+        The destination already has every other one.
+    """
+    files = ['c.bin'] + ['a/{}.bin'.format(i) for i in range(100)] + \
+        ['b/{}/{}.bin'.format(k, i) for k in range(4) for i in range(25)]
+    if remote.split(':', 1)[0].startswith('dst'):
+        files = files[::2]
+    return [(path, 1 << 20, '{:032x}'.format(n)) for n, path in enumerate(files)]
+
+
+def run_lsjson(flags, remote):
+    # The folder listed, relative to the root of the remote
+    folder = remote.split(':', 1)[-1].strip('/')
+    prefix = folder + '/' if folder else ''
+    depth = None if flags.get('-R') and not flags.get('--max-depth') else int(flags.get('--max-depth') or 1)
+    entries, dirs = [], set()
+    for path, size, md5 in tree_files(remote):
+        if not path.startswith(prefix):
+            continue
+        parts = path[len(prefix):].split('/')
+        if depth is not None and len(parts) > depth:
+            dirs.add(parts[0])
+            continue
+        for k in range(1, len(parts)):
+            dirs.add('/'.join(parts[:k]))
+        entries.append({'Path': '/'.join(parts), 'Name': parts[-1], 'Size': size, 'IsDir': False, 'Hashes': {'md5': md5},
+                        'ID': 'fake' + md5[-12:]})
+    entries += [{'Path': path, 'Name': path.split('/')[-1], 'Size': -1, 'IsDir': True} for path in sorted(dirs)]
+    if flags.get('--files-only'):
+        entries = [entry for entry in entries if not entry['IsDir']]
+    if flags.get('--dirs-only'):
+        entries = [entry for entry in entries if entry['IsDir']]
+    if flags.get('--fast-list'):
+        # Like rclone, hold the whole listing in memory before printing it: FAKE_RCLONE_ENTRY_BYTES per entry
+        held = []
+        for _ in range(10 if os.environ.get('FAKE_RCLONE_ENTRY_BYTES') else 0):
+            held.append(b'\x01' * (len(entries) * int(os.environ['FAKE_RCLONE_ENTRY_BYTES']) // 10))
+            time.sleep(0.1)
+    print('[\n' + ',\n'.join(json.dumps(entry) for entry in entries) + '\n]')
+    return 0
+
+
+def main(argv):
+    flags, positionals = parse_argv(argv)
+    if flags.get('--version') or flags.get('version') or positionals[:1] == ['version']:
+        print('rclone v0.0.0-fake')
+        return 0
+    if not positionals:
+        return 1
+    command = positionals[0]
+
+    if command == 'copy':
+        return run_copy(flags, positionals[1:])
+    if command == 'rcd':
+        return run_rcd(flags)
+    if command == 'lsjson':
+        return run_lsjson(flags, positionals[-1])
+    if command == 'size':
+        print('Total objects: 100\nTotal size: 100 MiB (104857600 Byte)')
+        return 0
+    if command == 'rc':
+        from rclone_rc import RcClient, RcError
+        try:
+            print(json.dumps(RcClient(str(flags.get('--rc-addr', 'localhost:5572')), RC_TIMEOUT).call(positionals[1]), indent=1))
+        except RcError as error:
+            sys.stderr.write(str(error) + '\n')
+            return 1
+        return 0
+    sys.stderr.write('fake rclone: unsupported command {}\n'.format(command))
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
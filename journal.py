@@ -0,0 +1,85 @@
+# autorclone run journal
+#
+# Append-only JSONL record of what a run did: config generated, listings done,
+# account started, bytes and reason at every switch, files completed. Every line
+# is flushed and fsync'ed, so after a crash --resume can rebuild where the run was
+# and go straight back to copying.
+#
+import io
+import json
+import os
+import time
+
+# accounts stopped for these reasons are not handed out again on resume
+SPENT_REASONS = ('budget', 'quota', 'stall')
+
+
+def read_events(path):
+    """yield the events of a journal, skipping a line torn by a crash"""
+    if not os.path.exists(path):
+        return
+    with io.open(path, 'r', encoding='utf-8') as fp:
+        for line in fp:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def replay(path):
+    """rebuild the state of the run recorded in the journal"""
+    state = {'args': None, 'config_file': None, 'listed': set(), 'started_sa_ids': set(),
+             'spent_sa_ids': set(), 'bytes': 0, 'files_completed': 0, 'finished': False}
+    for event in read_events(path):
+        kind = event.get('event')
+        if kind == 'run_started':
+            state['args'] = event.get('args')
+            state['finished'] = False
+        elif kind == 'config_generated':
+            state['config_file'] = event.get('config_file')
+        elif kind == 'listing_done':
+            state['listed'].add(event.get('side'))
+        elif kind == 'sa_started':
+            state['started_sa_ids'].add(event['sa_id'])
+        elif kind == 'sa_stopped':
+            state['bytes'] += event.get('bytes', 0)
+            if event.get('reason') in SPENT_REASONS:
+                state['spent_sa_ids'].add(event['sa_id'])
+        elif kind == 'files_completed':
+            state['files_completed'] += len(event.get('files', []))
+        elif kind == 'run_finished':
+            state['finished'] = True
+    return state
+
+
+def completed_files(path):
+    for event in read_events(path):
+        if event.get('event') == 'files_completed':
+            for name in event.get('files', []):
+                yield name
+
+
+class Journal(object):
+
+    def __init__(self, path='journal.jsonl', resume=False):
+        self.path = path
+        # A new run starts a new journal, --resume keeps appending to the old one
+        torn = False
+        if resume and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as fp:
+                fp.seek(-1, os.SEEK_END)
+                torn = fp.read(1) != b'\n'
+        self.fp = io.open(path, 'a' if resume else 'w', encoding='utf-8')
+        # Do not glue the first new event to a line the crash cut short
+        if torn:
+            self.fp.write('\n')
+
+    def write(self, event, **fields):
+        fields['event'] = event
+        fields['ts'] = time.time()
+        self.fp.write(json.dumps(fields) + '\n')
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+
+    def close(self):
+        self.fp.close()
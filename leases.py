@@ -0,0 +1,120 @@
+# autorclone leases
+#
+# Lets several rclone_sa_magic.py run side by side on one host without picking the
+# same service account or rc port. A lease is a lock file in a directory shared by
+# all of them, locked (flock, or msvcrt on Windows) for as long as the process that
+# took it lives: nothing to clean up when a supervisor dies, the OS drops its locks.
+#
+import errno
+import hashlib
+import io
+import os
+import socket
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+LEASE_DIR = os.path.join(tempfile.gettempdir(), 'autorclone_leases')
+PORT_SCAN = 1000  # ports looked at after the first one before giving up
+
+
+def port_free(port, host='localhost'):
+    # Nothing else (an rclone left over, another program) listens on it
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind((host, port))
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+class Leases(object):
+    """the service accounts and rc ports this process holds, until it exits"""
+
+    def __init__(self, path=LEASE_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # name -> open locked file
+        self.held = {}
+
+    def _lock(self, name):
+        if name in self.held:
+            return True
+        fp = io.open(os.path.join(self.path, name + '.lock'), 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                fp.seek(0)
+                msvcrt.locking(fp.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError as error:
+            fp.close()
+            if error.errno in (errno.EACCES, errno.EAGAIN, errno.EDEADLK):
+                return False
+            raise
+        # Who holds it, for whoever finds it taken
+        fp.seek(0)
+        fp.truncate()
+        fp.write('{}\n'.format(os.getpid()))
+        fp.flush()
+        self.held[name] = fp
+        return True
+
+    def holder(self, name):
+        try:
+            with io.open(os.path.join(self.path, name + '.lock'), 'r') as fp:
+                return fp.read().strip() or None
+        except OSError:
+            return None
+
+    def release(self, name):
+        fp = self.held.pop(name, None)
+        if fp is not None:
+            fp.close()
+
+    @staticmethod
+    def sa_name(email):
+        return 'sa_' + hashlib.sha1(email.encode('utf-8')).hexdigest()[:16]
+
+    def take_sa(self, email):
+        """lease the service account email, False if another process has it"""
+        return self._lock(self.sa_name(email))
+
+    def sa_holder(self, email):
+        return self.holder(self.sa_name(email))
+
+    @staticmethod
+    def workdir_name(path):
+        return 'workdir_' + hashlib.sha1(os.path.realpath(path).encode('utf-8')).hexdigest()[:16]
+
+    def take_workdir(self, path):
+        """lease the working directory path, False if another process works in it"""
+        return self._lock(self.workdir_name(path))
+
+    def workdir_holder(self, path):
+        return self.holder(self.workdir_name(path))
+
+    def take_ports(self, first, count):
+        """lease count free rc ports from first on, returns them"""
+        ports = []
+        for port in range(first, first + PORT_SCAN):
+            if len(ports) == count:
+                break
+            if self._lock('port_{}'.format(port)):
+                if port_free(port):
+                    ports.append(port)
+                else:
+                    self.release('port_{}'.format(port))
+        if len(ports) < count:
+            raise RuntimeError('only {} free rc ports from {} on'.format(len(ports), first))
+        return ports
+
+    def close(self):
+        for name in list(self.held):
+            self.release(name)
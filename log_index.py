@@ -0,0 +1,183 @@
+# autorclone log index
+#
+# Turns what rclone logs with -vv into one row per file: copied, skipped or
+# failed (with the class of the error), the service account that did it and how
+# long it took. Lines are fed as the log is tailed, so memory stays bounded and
+# the log itself can be rotated away; the index is a small sqlite file. Rows are
+# kept per copy (its source and destination): one index serves many copies.
+#
+#   python3 log_index.py log_index.db                  # summary
+#   python3 log_index.py log_index.db --status failed  # the files that failed
+#
+from __future__ import print_function
+import argparse
+import re
+import sqlite3
+import sys
+
+from log_tail import line_time, is_quota_error
+
+COPIED, SKIPPED, FAILED = 'copied', 'skipped', 'failed'
+INSERT_BATCH = 5000  # rows kept in memory before they are written
+PENDING_MAX = 100000  # files seen but not finished yet, the oldest are forgotten beyond that
+
+# "2023/05/01 12:34:56 INFO  : a/b.bin: Copied (new)", the path may itself contain ": "
+FILE_LINE = re.compile(r'^\d{4}/\d\d/\d\d \d\d:\d\d:\d\d [A-Z]+\s*: (?P<path>.+): '
+                       r'(?P<message>(?:Multi-thread )?Copied \(|Failed to copy: |Destination exists, skipping'
+                       r'|Unchanged skipping|Need to transfer|Sizes differ|Starting )(?P<rest>.*)$')
+ERROR_CLASSES = (
+    ('rate_limit', re.compile(r'rateLimitExceeded|Rate Limit Exceeded|Too many requests|429', re.I)),
+    ('not_found', re.compile(r'notFound|File not found|404')),
+    ('permission', re.compile(r'insufficientFilePermissions|forbidden|cannotCopyFile|403')),
+    ('network', re.compile(r'connection reset|timeout|EOF|broken pipe|no such host|TLS', re.I)),
+)
+
+
+# Returns the class of an rclone error message: quota, rate_limit, not_found, permission, network or other
+def error_class(text):
+    if is_quota_error(text):
+        return 'quota'
+    for name, pattern in ERROR_CLASSES:
+        if pattern.search(text):
+            return name
+    return 'other'
+
+
+def parse_line(line):
+    """returns (path, outcome, error) of a line about one file, outcome is
+        COPIED, SKIPPED, FAILED or None when the file is only being worked on
+        (None for the other lines)
+    """
+    match = FILE_LINE.match(line)
+    if match is None:
+        return None
+    message = match.group('message')
+    if message.endswith('Copied ('):
+        return match.group('path'), COPIED, None
+    if message == 'Failed to copy: ':
+        return match.group('path'), FAILED, match.group('rest')
+    if 'skipping' in message:
+        return match.group('path'), SKIPPED, None
+    return match.group('path'), None, None
+
+
+class LogIndex(object):
+
+    def __init__(self, path='log_index.db', copy=''):
+        self.path = path
+        # the copy the lines fed belong to, rows of other copies are left alone
+        self.copy = copy
+        self.db = sqlite3.connect(path)
+        # Indexes written before the rows were kept per copy: their rows belong to no known copy
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(results)')]
+        if columns and 'copy' not in columns:
+            self.db.execute('ALTER TABLE results RENAME TO results_old')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS results (
+                copy TEXT NOT NULL,
+                path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                error_class TEXT,
+                error TEXT,
+                sa_id INTEGER,
+                started REAL,
+                finished REAL,
+                PRIMARY KEY (copy, path)
+            ) WITHOUT ROWID;
+        ''')
+        if columns and 'copy' not in columns:
+            self.db.execute("INSERT INTO results SELECT '', * FROM results_old")
+            self.db.execute('DROP TABLE results_old')
+        self.db.commit()
+        # when each file still being worked on was first seen
+        self.pending = {}
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def feed(self, line, sa_id=None):
+        # One line of the rclone log, written by the account sa_id, returns what parse_line made of it
+        parsed = parse_line(line)
+        if parsed is None:
+            return None
+        path, outcome, error = parsed
+        logged_at = line_time(line)
+        if outcome is None:
+            if path not in self.pending:
+                if len(self.pending) >= PENDING_MAX:
+                    del self.pending[next(iter(self.pending))]
+                self.pending[path] = logged_at
+            return parsed
+
+        started = self.pending.pop(path, None)
+        if started is None:
+            started = logged_at
+        self.rows.append((self.copy, path, outcome, error_class(error) if error else None, error, sa_id, started, logged_at))
+        if len(self.rows) >= INSERT_BATCH:
+            self.flush()
+        return parsed
+
+    def flush(self):
+        if self.rows:
+            # A file copied once stays copied, even if a later run skipped it
+            self.db.executemany(
+                'INSERT OR REPLACE INTO results SELECT ?, ?, ?, ?, ?, ?, ?, ? '
+                'WHERE NOT EXISTS (SELECT 1 FROM results WHERE copy = ? AND path = ? AND status = ? AND ? != ?)',
+                [row + (row[0], row[1], COPIED, row[2], COPIED) for row in self.rows])
+            self.db.commit()
+            self.rows = []
+
+    def copied(self):
+        # The files this copy logged as copied
+        self.flush()
+        for (path,) in self.db.execute('SELECT path FROM results WHERE copy = ? AND status = ?', (self.copy, COPIED)):
+            yield path
+
+    def done(self, paths):
+        # Which of paths this copy logged as copied or found already at the destination
+        self.flush()
+        for path in paths:
+            if self.db.execute('SELECT 1 FROM results WHERE copy = ? AND path = ? AND status IN (?, ?)',
+                               (self.copy, path, COPIED, SKIPPED)).fetchone() is not None:
+                yield path
+
+    def summary(self):
+        """{(status, error_class): (files, seconds spent)}"""
+        self.flush()
+        return dict(((status, error), (count, seconds or 0.0)) for status, error, count, seconds in self.db.execute(
+            'SELECT status, error_class, COUNT(*), SUM(finished - started) FROM results GROUP BY status, error_class'))
+
+    def query(self, status=None, error=None, sa_id=None):
+        self.flush()
+        sql = 'SELECT path, status, error_class, error, sa_id, finished - started FROM results WHERE 1'
+        params = []
+        for column, value in (('status', status), ('error_class', error), ('sa_id', sa_id)):
+            if value is not None:
+                sql += ' AND {} = ?'.format(column)
+                params.append(value)
+        return self.db.execute(sql + ' ORDER BY path', params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show what rclone did with every file, from a log index.")
+    parser.add_argument('index', help='the index written by rclone_sa_magic.py (--log_index).')
+    parser.add_argument('--status', choices=(COPIED, SKIPPED, FAILED), default=None, help='list the files with this outcome.')
+    parser.add_argument('--error', default=None, help='list the files that failed with this error class (quota, ...).')
+    parser.add_argument('--sa', type=int, default=None, help='list the files of this service account id.')
+    args = parser.parse_args()
+
+    index = LogIndex(args.index)
+    if args.status is None and args.error is None and args.sa is None:
+        for (status, error), (count, seconds) in sorted(index.summary().items(), key=lambda item: str(item[0])):
+            print('{:<8} {:<11} {:>10} files {:>12.0f}s'.format(status, error or '', count, seconds))
+        return
+
+    for path, status, error, message, sa_id, seconds in index.query(args.status, args.error, args.sa):
+        print('{}\t{}\t{}\t{}\t{}'.format(status, '' if sa_id is None else '{:03d}'.format(sa_id),
+                                          '' if seconds is None else '{:.0f}s'.format(seconds), path, message or ''))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+# autorclone log tail
+#
+# Follows the rclone log file while it is written and spots Google quota errors
+# (403 dailyLimitExceeded, upload limit, ...) as soon as rclone logs them, instead of
+# waiting for many polls without any byte growth. 403 userRateLimitExceeded is only
+# counted: it is the per user request rate limit rclone's pacer retries, and just as
+# well what the 750GB upload cap looks like once it persists without bytes moving.
+#
+import gzip
+import os
+import re
+import time
+
+READ_CHUNK = 1 << 20  # bytes read from the log at a time, keeps memory bounded
+ROTATE_ATTEMPTS = 3  # reads to catch up with rclone before a rotation is left for the next poll
+
+QUOTA_ERROR = re.compile(r'dailyLimitExceeded|Daily limit exceeded|Received upload limit error|storageQuotaExceeded'
+                         r'|(?<![A-Za-z])quotaExceeded')
+RATE_LIMIT = re.compile(r'rateLimitExceeded|Rate Limit Exceeded|User rate limit exceeded', re.I)
+# the pacer backing off or retrying a call (-vv)
+RETRY = re.compile(r'low level retry|Rate exceeded|pacer: Reducing sleep|Too many requests')
+# "2023/05/01 12:34:56 ERROR : ..." (rclone's default log format, local time)
+LOG_TIME = re.compile(r'^(\d{4})/(\d\d)/(\d\d) (\d\d):(\d\d):(\d\d)')
+
+
+# Returns the unix time of an rclone log line, or None if it has no timestamp
+def line_time(line):
+    match = LOG_TIME.match(line)
+    if match is None:
+        return None
+    return time.mktime(tuple(int(x) for x in match.groups()) + (0, 0, -1))
+
+
+def is_quota_error(text):
+    return bool(text) and QUOTA_ERROR.search(text) is not None
+
+
+def is_rate_limit(text):
+    return bool(text) and not is_quota_error(text) and RATE_LIMIT.search(text) is not None
+
+
+def copy_bytes(src, dst, count):
+    # Copies count bytes (or up to the end) of src to dst, returns how many
+    done = 0
+    while done < count:
+        chunk = src.read(min(READ_CHUNK, count - done))
+        if not chunk:
+            break
+        dst.write(chunk)
+        done += len(chunk)
+    return done
+
+
+def shift_archives(path, keep=5):
+    # path.1.gz becomes path.2.gz, ... up to keep
+    for k in range(keep - 1, 0, -1):
+        if os.path.exists('{}.{}.gz'.format(path, k)):
+            os.replace('{}.{}.gz'.format(path, k), '{}.{}.gz'.format(path, k + 1))
+
+
+class LogTail(object):
+    """reads the lines appended to a log file since the last call"""
+
+    def __init__(self, path, from_end=True, on_line=None):
+        self.path = path
+        self.offset = 0
+        self.partial = b''
+        # called with every new line, e.g. to index what happened to every file
+        self.on_line = on_line
+        # number of retry / back off lines, and of rate limit errors, seen so far
+        self.retries = 0
+        self.rate_limits = 0
+        # the first quota error read since the last first_quota_error()
+        self.quota_line = None
+        if from_end and os.path.exists(path):
+            self.offset = os.path.getsize(path)
+
+    def lines(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        # The file was truncated or rotated: start over
+        if size < self.offset:
+            self.offset = 0
+            self.partial = b''
+
+        with open(self.path, 'rb') as fp:
+            fp.seek(self.offset)
+            while True:
+                chunk = fp.read(READ_CHUNK)
+                if not chunk:
+                    break
+                self.offset += len(chunk)
+                chunk = self.partial + chunk
+                lines = chunk.split(b'\n')
+                # Keep an unfinished last line for the next call, but never let it grow without bound
+                self.partial = lines.pop()[-READ_CHUNK:]
+                for line in lines:
+                    yield line.decode('utf-8', 'replace').rstrip('\r')
+
+    def read(self):
+        # Everything new, so the next call starts from the end
+        for line in self.lines():
+            if self.on_line is not None:
+                self.on_line(line)
+            if self.quota_line is None and is_quota_error(line):
+                self.quota_line = line
+            if RETRY.search(line):
+                self.retries += 1
+            if is_rate_limit(line):
+                self.rate_limits += 1
+
+    def first_quota_error(self):
+        """returns (line, seconds since rclone logged it) for the first quota error
+            among the lines read since the last call (by a rotation too), or (None, None)
+        """
+        self.read()
+        found, self.quota_line = self.quota_line, None
+        if found is None:
+            return None, None
+
+        logged_at = line_time(found)
+        return found, None if logged_at is None else max(0.0, time.time() - logged_at)
+
+    def archive(self, max_bytes):
+        """once the log is max_bytes or more, compress what was read of it to path.1.gz.tmp,
+            returns the bytes archived or None. Only touches files: it can run in a thread
+            while the lines are read in another.
+        """
+        try:
+            if os.path.getsize(self.path) < max_bytes:
+                return None
+        except OSError:
+            return None
+        archived = self.offset
+        with open(self.path, 'rb') as src, gzip.open(self.path + '.1.gz.tmp', 'wb') as dst:
+            copy_bytes(src, dst, archived)
+        return archived
+
+    def rotate(self, archived, keep=5):
+        """finish what archive() started: read and archive what rclone appended meanwhile,
+            then empty the log and make the archive path.1.gz (path.1.gz becomes path.2.gz,
+            ... up to keep). The log is truncated rather than renamed, rclone keeps it open in
+            append mode, and only once every line of it was read. If rclone keeps writing the
+            rotation is given up, for the next call of archive().
+        """
+        tmp = self.path + '.1.gz.tmp'
+        emptied = False
+        with open(self.path, 'r+b') as src, gzip.open(tmp, 'ab') as dst:
+            for _ in range(ROTATE_ATTEMPTS):
+                self.read()
+                src.seek(archived)
+                archived += copy_bytes(src, dst, self.offset - archived)
+                if os.fstat(src.fileno()).st_size == self.offset:
+                    src.truncate(0)
+                    emptied = True
+                    break
+        if not emptied:
+            os.remove(tmp)
+            return False
+        shift_archives(self.path, keep)
+        os.replace(tmp, self.path + '.1.gz')
+        # An unfinished last line goes on at the start of the emptied file
+        self.offset = 0
+        return True
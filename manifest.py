@@ -0,0 +1,299 @@
+# autorclone manifest
+#
+# One listing of the source and of the destination (path, size, md5, modtime, ID),
+# kept on disk in sqlite. The files still to copy are computed locally and handed
+# to every rclone run with --files-from-raw, so switching account does not re-list
+# millions of objects on both sides again.
+#
+# With --fast-list rclone holds the whole tree in memory before printing anything.
+# list_chunked() lists one subtree at a time instead, and lists a subtree one level
+# down when rclone grows past a memory ceiling on it.
+#
+import io
+import json
+import sqlite3
+import subprocess
+import threading
+import zlib
+
+SRC, DST = 'src', 'dst'
+INSERT_BATCH = 5000  # rows inserted per sqlite transaction while listing
+RSS_POLL = 0.2  # seconds between two looks at the memory of a listing rclone
+
+
+# Peak resident memory of a running process in bytes (VmHWM), None where /proc is not available
+def peak_rss(pid):
+    try:
+        with io.open('/proc/{}/status'.format(pid), 'r', encoding='utf-8') as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class RssWatch(threading.Thread):
+    """follows the peak memory of a process, and kills it past limit bytes"""
+
+    def __init__(self, proc, limit=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.proc = proc
+        self.limit = limit
+        self.peak = 0
+        self.exceeded = False
+        self.start()
+
+    def run(self):
+        while self.proc.poll() is None:
+            self.peak = max(self.peak, peak_rss(self.proc.pid) or 0)
+            if self.limit and self.peak > self.limit:
+                self.exceeded = True
+                try:
+                    self.proc.kill()
+                except OSError:
+                    pass
+                return
+            try:
+                self.proc.wait(RSS_POLL)
+            except subprocess.TimeoutExpired:
+                pass
+
+
+def join_path(folder, name):
+    return folder + '/' + name if folder else name
+
+
+# Stable shard of a path, used to split the work between parallel workers
+def shard_of(path, shards):
+    return zlib.crc32(path.encode('utf-8')) % shards
+
+
+def iter_lsjson(stdout):
+    """parse the output of `rclone lsjson` one line at a time,
+        rclone prints one object per line so the listing never has to fit in memory
+    """
+    for line in stdout:
+        line = line.decode('utf-8', 'replace').strip().rstrip(',')
+        if not line.startswith('{'):
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+
+def md5_of(entry):
+    hashes = entry.get('Hashes') or {}
+    return hashes.get('md5') or hashes.get('MD5')
+
+
+class Manifest(object):
+
+    def __init__(self, path='manifest.db'):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.create_function('shard', 2, shard_of)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                side TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                md5 TEXT,
+                modtime TEXT,
+                id TEXT,
+                PRIMARY KEY (side, path)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS folders (
+                side TEXT NOT NULL,
+                path TEXT NOT NULL,
+                PRIMARY KEY (side, path)
+            ) WITHOUT ROWID;
+        ''')
+        # Manifests listed before the Drive IDs were kept
+        if 'id' not in [row[1] for row in self.db.execute('PRAGMA table_info(files)')]:
+            self.db.execute('ALTER TABLE files ADD COLUMN id TEXT')
+        self.db.commit()
+        # largest memory a listing rclone used, in bytes (0 where it cannot be read)
+        self.peak_rss = 0
+
+    def close(self):
+        self.db.close()
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+        self.db.commit()
+
+    def is_listed(self, side):
+        return self.get_meta('listed_' + side) == '1'
+
+    def add_entries(self, side, entries):
+        # Insert lsjson entries in batches, return how many were added
+        count = 0
+        batch = []
+        for entry in entries:
+            if entry.get('IsDir'):
+                continue
+            batch.append((side, entry['Path'], int(entry.get('Size', -1)), md5_of(entry), entry.get('ModTime'), entry.get('ID')))
+            if len(batch) >= INSERT_BATCH:
+                self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)', batch)
+                self.db.commit()
+                count += len(batch)
+                batch = []
+        if batch:
+            self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)', batch)
+            self.db.commit()
+            count += len(batch)
+        return count
+
+    def list_remote(self, side, config_file, remote_path, fast_list=True, rclone='rclone'):
+        """run `rclone lsjson -R` on remote_path and stream it into the manifest"""
+        self.db.execute('DELETE FROM files WHERE side = ?', (side,))
+        self.set_meta('listed_' + side, '0')
+
+        cmd = [rclone, '--config', config_file, 'lsjson', '-R', '--files-only', '--hash',
+               '--no-mimetype', remote_path]
+        if fast_list:
+            cmd.insert(3, '--fast-list')
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        watch = RssWatch(proc)
+        count = self.add_entries(side, iter_lsjson(proc.stdout))
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+        watch.join()
+        self.peak_rss = max(self.peak_rss, watch.peak)
+
+        self.set_meta('listed_' + side, '1')
+        return count
+
+    def _list_folder(self, side, cmd, folder, max_rss=None, subfolders=None):
+        # Stream one lsjson of folder into the manifest, False if rclone went past max_rss bytes
+        def entries():
+            for entry in iter_lsjson(proc.stdout):
+                if entry.get('IsDir'):
+                    if subfolders is not None:
+                        subfolders.append(join_path(folder, entry['Path']))
+                    continue
+                entry['Path'] = join_path(folder, entry['Path'])
+                yield entry
+
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        watch = RssWatch(proc, max_rss)
+        self.add_entries(side, entries())
+        returncode = proc.wait()
+        watch.join()
+        self.peak_rss = max(self.peak_rss, watch.peak)
+        if watch.exceeded:
+            return False
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+        return True
+
+    def _forget_subtree(self, side, folder):
+        if folder:
+            # Every path under folder/ sorts between "folder/" and "folder0" ('0' follows '/'):
+            # a range of the primary key, not a scan of the table
+            self.db.execute('DELETE FROM files WHERE side = ? AND path >= ? AND path < ?',
+                            (side, folder + '/', folder + '0'))
+        else:
+            self.db.execute('DELETE FROM files WHERE side = ?', (side,))
+
+    def list_chunked(self, side, config_file, remote_path, max_rss, rclone='rclone'):
+        """list remote_path into the manifest one subtree at a time, each with --fast-list.
+            A subtree that makes rclone use more than max_rss bytes is listed again one
+            level down: its own files, then each of its folders as a subtree. The folders
+            left are kept in the manifest, an interrupted listing goes on where it stopped.
+        """
+        if self.get_meta('chunked_' + side) != '1':
+            self.db.execute('DELETE FROM files WHERE side = ?', (side,))
+            self.db.execute('DELETE FROM folders WHERE side = ?', (side,))
+            self.db.execute('INSERT INTO folders VALUES (?, ?)', (side, ''))
+            self.set_meta('listed_' + side, '0')
+            self.set_meta('chunked_' + side, '1')
+
+        base = [rclone, '--config', config_file, 'lsjson', '--hash', '--no-mimetype']
+        while True:
+            row = self.db.execute('SELECT path FROM folders WHERE side = ? LIMIT 1', (side,)).fetchone()
+            if row is None:
+                break
+            folder = row[0]
+            remote = remote_path + ('/' if folder and not remote_path.endswith((':', '/')) else '') + folder
+            # What an interrupted listing left of this subtree
+            self._forget_subtree(side, folder)
+            if not self._list_folder(side, base + ['-R', '--fast-list', '--files-only', remote], folder, max_rss):
+                print('{} needs more than {}MB, listing it one level down.'.format(remote, max_rss // 2 ** 20))
+                self._forget_subtree(side, folder)
+                subfolders = []
+                self._list_folder(side, base + ['--max-depth', '1', remote], folder, subfolders=subfolders)
+                self.db.executemany('INSERT OR REPLACE INTO folders VALUES (?, ?)', [(side, path) for path in subfolders])
+            self.db.execute('DELETE FROM folders WHERE side = ? AND path = ?', (side, folder))
+            self.db.commit()
+
+        self.set_meta('chunked_' + side, '0')
+        self.set_meta('listed_' + side, '1')
+        return self.db.execute('SELECT COUNT(*) FROM files WHERE side = ?', (side,)).fetchone()[0]
+
+    def _todo_query(self, columns, shard=0, shards=1, after=None, limit=None):
+        # Everything in the source that the destination does not have (same rule as --ignore-existing)
+        sql = ('SELECT {} FROM files s WHERE s.side = ? AND shard(s.path, ?) = ? '
+               'AND NOT EXISTS (SELECT 1 FROM files d WHERE d.side = ? AND d.path = s.path)'.format(columns))
+        params = [SRC, shards, shard, DST]
+        if after is not None:
+            sql += ' AND s.path > ?'
+            params.append(after)
+        if limit:
+            # In path order, so the next chunk starts where this one ends
+            sql += ' ORDER BY s.path LIMIT ?'
+            params.append(limit)
+        return self.db.execute(sql, params)
+
+    def todo(self, shard=0, shards=1, after=None, limit=None):
+        return self._todo_query('s.path, s.size', shard, shards, after, limit)
+
+    def todo_ids(self, after=None, limit=None):
+        # With the Drive ID of every file, for copying it through the API
+        return self._todo_query('s.path, s.size, s.id', after=after, limit=limit)
+
+    def remaining(self, shard=0, shards=1):
+        count, size = self._todo_query('COUNT(*), COALESCE(SUM(s.size), 0)', shard, shards).fetchone()
+        return count, size
+
+    def write_files_from(self, filename, shard=0, shards=1, after=None, limit=None):
+        """write the paths still to copy to filename (for --files-from-raw), at most
+            limit of them after the path after. Returns the number of files, their total
+            size and the last path written
+        """
+        count = size = 0
+        last = None
+        with io.open(filename, 'w', encoding='utf-8', newline='\n') as fp:
+            for path, file_size in self.todo(shard, shards, after, limit):
+                fp.write(path + '\n')
+                count += 1
+                size += max(file_size, 0)
+                last = path
+        return count, size, last
+
+    def missing(self, paths):
+        """the paths not in the destination yet, with their total size"""
+        left, size = [], 0
+        for path in paths:
+            row = self.db.execute(
+                'SELECT s.size FROM files s WHERE s.side = ? AND s.path = ? '
+                'AND NOT EXISTS (SELECT 1 FROM files d WHERE d.side = ? AND d.path = s.path)', (SRC, path, DST)).fetchone()
+            if row is not None:
+                left.append(path)
+                size += max(row[0], 0)
+        return left, size
+
+    def mark_done(self, paths):
+        # A file landed in the destination: copy its source row over
+        self.db.executemany(
+            'INSERT OR REPLACE INTO files SELECT ?, path, size, md5, modtime, NULL FROM files WHERE side = ? AND path = ?',
+            [(DST, SRC, path) for path in paths])
+        self.db.commit()
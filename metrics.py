@@ -0,0 +1,91 @@
+# autorclone metrics
+#
+# A tiny Prometheus style registry and a /metrics endpoint, so throughput of the
+# supervisor can be graphed instead of read off print() and log_rclone.txt.
+#
+#   curl http://localhost:9572/metrics
+#
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.kinds = {}
+        self.values = {}
+
+    def declare(self, name, kind, help_text):
+        # kind is 'counter', 'gauge' or 'summary'
+        self.kinds[name] = (kind, help_text)
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        # summary without quantiles: <name>_sum and <name>_count
+        self.inc(name + '_sum', value, **labels)
+        self.inc(name + '_count', 1, **labels)
+
+    def get(self, name, **labels):
+        return self.values.get((name, tuple(sorted(labels.items()))), 0)
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        lines = []
+        for name, (kind, help_text) in sorted(self.kinds.items()):
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for (key, labels), value in items:
+                if key != name and key not in (name + '_sum', name + '_count'):
+                    continue
+                label_text = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                      for k, v in labels)
+                lines.append('{}{} {}'.format(key, '{' + label_text + '}' if label_text else '', value))
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+METRICS.declare('autorclone_bytes_transferred_total', 'counter', 'Bytes uploaded by all workers.')
+METRICS.declare('autorclone_speed_bytes_per_second', 'gauge', 'Current speed reported by rclone, per worker.')
+METRICS.declare('autorclone_checks', 'gauge', 'Files checked by the current rclone run, per worker.')
+METRICS.declare('autorclone_active_sa', 'gauge', 'Id of the service account a worker is using.')
+METRICS.declare('autorclone_sa_bytes_total', 'counter', 'Bytes uploaded per service account.')
+METRICS.declare('autorclone_switches_total', 'counter', 'Account switches, by reason.')
+METRICS.declare('autorclone_stall_events_total', 'counter', 'Polls without any byte growth after a run had started.')
+METRICS.declare('autorclone_rc_poll_seconds', 'summary', 'Latency of the core/stats call.')
+METRICS.declare('autorclone_rc_errors_total', 'counter', 'Failed rc calls.')
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        data = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, addr='localhost', metrics=METRICS):
+    """serve /metrics from a background thread, returns the server"""
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    server.metrics = metrics
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,112 @@
+# autorclone planner
+#
+# Splits what is left to copy into batches that each fit the budget of one
+# service account (its SIZE_GB_MAX, or what its daily quota still allows), so an
+# account is handed exactly what it can upload instead of being killed when it
+# runs out in the middle of a file.
+#
+# The files of one folder stay together when the folder fits an account. Batches
+# are packed best fit decreasing: every folder goes to the account with the least
+# room left that still holds it, which fills accounts up one after the other.
+#
+import bisect
+import io
+import os
+import posixpath
+
+
+class Batch(object):
+    """files for one rclone run, planned for account sa_id (None: the next free one)"""
+
+    def __init__(self, number, sa_id, paths, size, plan_dir='plan', attempts=1):
+        self.number = number
+        self.sa_id = sa_id
+        self.paths = paths
+        self.size = size
+        # runs that ended with rclone done but files still missing, these files keep failing
+        self.attempts = attempts
+        self.files_from = os.path.join(plan_dir, 'batch_{:03d}.txt'.format(number))
+
+    def write(self):
+        with io.open(self.files_from, 'w', encoding='utf-8', newline='\n') as fp:
+            for path in self.paths:
+                fp.write(path + '\n')
+
+
+def group_by_folder(files):
+    """[(folder, size, [(path, size)])] of the files, by the folder they are in"""
+    folders = {}
+    for path, size in files:
+        folders.setdefault(posixpath.dirname(path), []).append((path, max(size, 0)))
+    return [(folder, sum(size for _, size in items), items) for folder, items in folders.items()]
+
+
+def pack(items, capacities):
+    """best fit decreasing of items [(key, size)] into capacities [(sa_id, bytes)],
+        returns {sa_id: [keys]} and the keys that fit no account
+    """
+    # (room left, order, sa_id) sorted by room
+    rooms = sorted((room, order, sa_id) for order, (sa_id, room) in enumerate(capacities))
+    assigned = dict((sa_id, []) for sa_id, _ in capacities)
+    left = []
+    for key, size in sorted(items, key=lambda item: -item[1]):
+        k = bisect.bisect_left(rooms, (size,))
+        if k == len(rooms):
+            left.append(key)
+            continue
+        room, order, sa_id = rooms.pop(k)
+        assigned[sa_id].append(key)
+        bisect.insort(rooms, (room - size, order, sa_id))
+    return assigned, left
+
+
+class Plan(object):
+
+    def __init__(self, plan_dir='plan'):
+        self.plan_dir = plan_dir
+        self.batches = []
+        self.count = 0
+        # files no account had room for today
+        self.left_paths = []
+        self.left_size = 0
+
+    def build(self, files, capacities):
+        """plan files [(path, size)] over capacities [(sa_id, bytes)], in account order"""
+        if not os.path.isdir(self.plan_dir):
+            os.makedirs(self.plan_dir)
+        largest = max([room for _, room in capacities] or [0])
+
+        # Whole folders where they fit an account, the files of bigger folders one by one
+        items = {}
+        for folder, size, folder_files in group_by_folder(files):
+            if size <= largest:
+                items[('folder', folder)] = (size, folder_files)
+            else:
+                for path, file_size in folder_files:
+                    items[('file', path)] = (file_size, [(path, file_size)])
+        assigned, left = pack([(key, value[0]) for key, value in items.items()], capacities)
+
+        for sa_id, _ in capacities:
+            if assigned[sa_id]:
+                paths = sorted(path for key in assigned[sa_id] for path, _ in items[key][1])
+                self.add(sa_id, paths, sum(items[key][0] for key in assigned[sa_id]))
+        for key in left:
+            self.left_paths.extend(path for path, _ in items[key][1])
+            self.left_size += items[key][0]
+        return self
+
+    def add(self, sa_id, paths, size, attempts=1):
+        self.count += 1
+        batch = Batch(self.count, sa_id, paths, size, self.plan_dir, attempts)
+        batch.write()
+        self.batches.append(batch)
+        return batch
+
+    def next_batch(self):
+        return self.batches.pop(0) if self.batches else None
+
+    def requeue(self, paths, size, attempts=1):
+        # What a stopped run did not copy goes to the next free account
+        if paths:
+            return self.add(None, sorted(paths), size, attempts)
+        return None
@@ -0,0 +1,37 @@
+# autorclone project limits
+#
+# gen_sa_accounts.py makes 100 service accounts per GCP project, and part of the
+# Drive API request quota is per project: accounts of one project running side by
+# side share it. ProjectLimits counts the running accounts of every project, so the
+# pool hands out accounts of the least busy projects first, and splits the request
+# rate of a project (--project_tps) between its running rclone: each one gets
+# rate / running as its --tpslimit token bucket, so together they stay under it.
+#
+
+
+class ProjectLimits(object):
+
+    def __init__(self, tps=None):
+        # requests per second allowed per project, None for no limit
+        self.tps = tps
+        self.running = {}
+
+    def add(self, project):
+        if project is not None:
+            self.running[project] = self.running.get(project, 0) + 1
+
+    def remove(self, project):
+        if project is not None and self.running.get(project):
+            self.running[project] -= 1
+            if not self.running[project]:
+                del self.running[project]
+
+    def busy(self, project):
+        """number of accounts of project running"""
+        return self.running.get(project, 0) if project is not None else 0
+
+    def share(self, project, tpslimit):
+        """the --tpslimit of one running account of project, at most tpslimit"""
+        if self.tps is None or project is None:
+            return tpslimit
+        return min(tpslimit, float(self.tps) / max(1, self.busy(project)))
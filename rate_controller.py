@@ -0,0 +1,101 @@
+# autorclone rate controller
+#
+# Closed loop tuning of rclone's --tpslimit, --transfers and --checkers while it runs.
+# Every CONTROL_INTERVAL seconds the errors and pacer retries since the last step are
+# compared with the work done: a clean interval adds a little (additive increase),
+# a noisy one halves everything (multiplicative decrease). A 403 userRateLimitExceeded
+# halves everything right away, at most once per interval: it is the signal to back off,
+# not a reason to drop the account.
+#
+# New values are pushed to the running rclone with the rc call options/set, but a
+# running copy keeps the transfer and checker pool it started with: Transfers and
+# Checkers only take effect with the next rclone (or rcd job), i.e. the next account.
+#
+import time
+
+CONTROL_INTERVAL = 60  # seconds between two adjustments
+ERROR_RATE_MAX = 0.02  # (errors + retries) / operations above this is treated as throttling
+
+# (default start, min, max, step) for every option
+TPSLIMIT = (3, 1, 12, 1)
+TRANSFERS = (3, 1, 16, 1)
+CHECKERS = (10, 2, 32, 2)
+
+
+class RateController(object):
+
+    def __init__(self, tpslimit=TPSLIMIT[0], transfers=TRANSFERS[0], checkers=CHECKERS[0], interval=CONTROL_INTERVAL):
+        self.limits = {'TPSLimit': TPSLIMIT, 'Transfers': TRANSFERS, 'Checkers': CHECKERS}
+        self.values = {'TPSLimit': tpslimit, 'Transfers': transfers, 'Checkers': checkers}
+        self.interval = interval
+        self.last_back_off = 0
+        self.reset()
+
+    def reset(self):
+        # Called when a new rclone starts: its counters start from zero again
+        self.last_step = time.time()
+        self.last_ops = 0
+        self.last_errors = 0
+        self.last_retries = 0
+
+    @property
+    def tpslimit(self):
+        return self.values['TPSLimit']
+
+    @property
+    def transfers(self):
+        return self.values['Transfers']
+
+    @property
+    def checkers(self):
+        return self.values['Checkers']
+
+    def step(self, stats, retries, now=None):
+        """feed the latest core/stats and the retry count seen in the log,
+            returns (new option values or None if unchanged, error rate of the interval)
+        """
+        now = time.time() if now is None else now
+        if now - self.last_step < self.interval:
+            return None, None
+
+        ops = int(stats.get('transfers', 0)) + int(stats.get('checks', 0))
+        errors = int(stats.get('errors', 0))
+        d_ops = max(0, ops - self.last_ops)
+        d_bad = max(0, errors - self.last_errors) + max(0, retries - self.last_retries)
+        self.last_step, self.last_ops, self.last_errors, self.last_retries = now, ops, errors, retries
+
+        # Nothing happened at all (still listing, or idle): no signal to act on
+        if d_ops == 0 and d_bad == 0:
+            return None, None
+
+        error_rate = float(d_bad) / max(d_ops + d_bad, 1)
+        before = dict(self.values)
+        for name, (_, low, high, step) in self.limits.items():
+            if error_rate > ERROR_RATE_MAX:
+                self.values[name] = max(low, self.values[name] // 2)
+            else:
+                self.values[name] = min(high, self.values[name] + step)
+
+        if self.values == before:
+            return None, error_rate
+        return dict(self.values), error_rate
+
+    def back_off(self, stats, retries, now=None):
+        """rclone was rate limited: halve everything now, returns the new option values,
+            or None if unchanged or already halved within the last interval
+        """
+        now = time.time() if now is None else now
+        if now - self.last_back_off < self.interval:
+            return None
+        # The next additive increase waits for a whole interval after this one, and does not
+        # count the errors that caused it a second time
+        self.last_back_off = self.last_step = now
+        self.last_ops = int(stats.get('transfers', 0)) + int(stats.get('checks', 0))
+        self.last_errors = int(stats.get('errors', 0))
+        self.last_retries = retries
+        before = dict(self.values)
+        for name, (_, low, _, _) in self.limits.items():
+            self.values[name] = max(low, self.values[name] // 2)
+        if self.values == before:
+            return None
+        return dict(self.values)
@@ -0,0 +1,235 @@
+# autorclone rc client
+#
+# Minimal client for the rclone remote control API (`rclone --rc`).
+# Instead of forking `rclone rc --rc-addr=... core/stats` every poll, keep one
+# persistent HTTP/1.1 connection per rc address and POST the JSON directly.
+#
+# AsyncRcClient does the same from an asyncio event loop, so one supervisor can
+# poll hundreds of rclone processes without a thread each.
+#
+# https://rclone.org/rc/
+#
+import asyncio
+import http.client
+import json
+import socket
+import threading
+
+
+class RcError(Exception):
+    pass
+
+
+def _parse_addr(addr):
+    # Accept both "localhost:5572" and "http://localhost:5572/"
+    addr = addr.replace('http://', '').strip('/')
+    host, _, port = addr.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def _decode_reply(client, command, status, data):
+    try:
+        reply = json.loads(data.decode('utf-8').replace('\0', '') or '{}')
+    except ValueError:
+        raise RcError('{} {}: invalid reply {!r}'.format(client, command, data[:200]))
+
+    if status != 200:
+        raise RcError('{} {}: HTTP {} {}'.format(client, command, status, reply.get('error', '')))
+    return reply
+
+
+class RcClient(object):
+    """timeout: seconds a call may take, the caller's to choose"""
+
+    def __init__(self, addr, timeout):
+        self.host, self.port = _parse_addr(addr)
+        self.timeout = timeout
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'RcClient({}:{})'.format(self.host, self.port)
+
+    def _connection(self, timeout):
+        # Reuse the kept-alive connection, open a new one only when needed
+        if self._conn is not None and self._conn.sock is not None:
+            self._conn.sock.settimeout(timeout)
+            return self._conn, True
+
+        self.close()
+        self._conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        self._conn.connect()
+        # polls are tiny, do not let Nagle delay them
+        self._conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self._conn, False
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def call(self, command, params=None, timeout=None):
+        """POST `params` to rc `command` and return the decoded JSON reply.
+        Raises RcError if rclone is unreachable or answers with an error.
+        """
+        body = json.dumps(params or {}).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
+        timeout = self.timeout if timeout is None else timeout
+
+        with self._lock:
+            while True:
+                reused = False
+                try:
+                    conn, reused = self._connection(timeout)
+                    conn.request('POST', '/' + command.lstrip('/'), body, headers)
+                    resp = conn.getresponse()
+                    data = resp.read()
+                except (http.client.HTTPException, OSError) as error:
+                    self.close()
+                    # The server may have dropped an idle kept-alive connection; retry once on a fresh one
+                    if reused and not isinstance(error, socket.timeout):
+                        continue
+                    raise RcError('{} {}: {}'.format(self, command, error))
+                break
+
+            if resp.will_close:
+                self.close()
+
+        return _decode_reply(self, command, resp.status, data)
+
+    # =================rc commands used by the supervisor=================
+
+    def stats(self, group=None, timeout=None):
+        params = {'group': group} if group else None
+        return self.call('core/stats', params, timeout=timeout)
+
+    def pid(self, timeout=None):
+        return int(self.call('core/pid', timeout=timeout)['pid'])
+
+    def job_status(self, jobid, timeout=None):
+        return self.call('job/status', {'jobid': jobid}, timeout=timeout)
+
+    def job_stop(self, jobid, timeout=None):
+        return self.call('job/stop', {'jobid': jobid}, timeout=timeout)
+
+    def quit(self, exit_code=0, timeout=None):
+        try:
+            return self.call('core/quit', {'exitCode': exit_code}, timeout=timeout)
+        finally:
+            self.close()
+
+
+class AsyncRcClient(object):
+    """RcClient for asyncio: the same calls, awaited, over one kept-alive connection"""
+
+    def __init__(self, addr, timeout):
+        self.host, self.port = _parse_addr(addr)
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        # created on first use, inside the running event loop
+        self._lock = None
+
+    def __repr__(self):
+        return 'AsyncRcClient({}:{})'.format(self.host, self.port)
+
+    async def _connection(self):
+        # Reuse the kept-alive connection, open a new one only when needed (asyncio sets TCP_NODELAY itself)
+        if self._writer is not None and not self._writer.is_closing() and not self._reader.at_eof():
+            return True
+
+        self.close()
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        return False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    async def _request(self, command, body):
+        # Just enough HTTP/1.1 for rclone: Content-Length or chunked replies
+        head = ('POST /{} HTTP/1.1\r\nHost: {}:{}\r\nContent-Type: application/json\r\n'
+                'Content-Length: {}\r\n\r\n').format(command.lstrip('/'), self.host, self.port, len(body))
+        self._writer.write(head.encode('ascii') + body)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError('connection closed by rclone')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # skip the trailers
+                    while (await self._reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readexactly(2)
+            data = b''.join(chunks)
+        else:
+            data = await self._reader.readexactly(int(headers.get('content-length', 0)))
+        return status, data, headers.get('connection', '').lower() == 'close'
+
+    async def call(self, command, params=None, timeout=None):
+        """POST `params` to rc `command` and return the decoded JSON reply.
+        Raises RcError if rclone is unreachable or answers with an error.
+        """
+        body = json.dumps(params or {}).encode('utf-8')
+        timeout = self.timeout if timeout is None else timeout
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            while True:
+                reused = False
+                try:
+                    reused = await asyncio.wait_for(self._connection(), timeout)
+                    status, data, will_close = await asyncio.wait_for(self._request(command, body), timeout)
+                except (OSError, ValueError, IndexError, EOFError, asyncio.TimeoutError) as error:
+                    self.close()
+                    # The server may have dropped an idle kept-alive connection; retry once on a fresh one
+                    if reused and not isinstance(error, asyncio.TimeoutError):
+                        continue
+                    raise RcError('{} {}: {}'.format(self, command, str(error) or type(error).__name__))
+                break
+
+            if will_close:
+                self.close()
+
+        return _decode_reply(self, command, status, data)
+
+    # =================rc commands used by the supervisor=================
+
+    async def stats(self, group=None, timeout=None):
+        params = {'group': group} if group else None
+        return await self.call('core/stats', params, timeout=timeout)
+
+    async def pid(self, timeout=None):
+        return int((await self.call('core/pid', timeout=timeout))['pid'])
+
+    async def job_status(self, jobid, timeout=None):
+        return await self.call('job/status', {'jobid': jobid}, timeout=timeout)
+
+    async def job_stop(self, jobid, timeout=None):
+        return await self.call('job/stop', {'jobid': jobid}, timeout=timeout)
+
+    async def quit(self, exit_code=0, timeout=None):
+        try:
+            return await self.call('core/quit', {'exitCode': exit_code}, timeout=timeout)
+        finally:
+            self.close()
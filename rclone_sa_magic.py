@@ -16,16 +16,38 @@
 #
 from __future__ import print_function
 import argparse
+import asyncio
 import glob
 import json
 import os, io
 import platform
+import re
+import hashlib
+import shlex
 import subprocess
 import sys
 import time
 import shutil
 from signal import signal, SIGINT
 from dotenv import load_dotenv
+from rclone_rc import AsyncRcClient, RcError
+from sa_ledger import QuotaLedger, sa_email
+from manifest import Manifest, SRC, DST, peak_rss
+from log_tail import LogTail, is_quota_error, is_rate_limit
+from log_index import LogIndex, COPIED, SKIPPED
+from rate_controller import RateController
+from sa_index import SaIndex
+from sa_scores import SaScores
+from project_limits import ProjectLimits
+from leases import Leases, LEASE_DIR
+from metrics import METRICS
+from planner import Plan, Batch
+from coordinator import Coordinator, CoordinatorClient, CoordinatorError
+from batch_copy import BatchCopier, drive_service
+from journal import Journal
+import metrics
+import journal
+import verify
 
 # import distutils.spawn # deprecated, will be removed in python3.12
 # https://docs.python.org/3/library/distutils.html
@@ -33,12 +55,31 @@ from dotenv import load_dotenv
 load_dotenv()
 # =================modify here=================
 logfile = "log_rclone.txt"  # log file: tail -f log_rclone.txt
-PID = 0
+WORKERS = []  # every Worker supervised by this process
+LEDGER = None  # QuotaLedger of bytes moved per service account
+JOURNAL = None  # Journal of this run, for --resume
+LEASES = None  # Leases of the accounts and rc ports this process holds, with --lease
 
 # parameters for this script
 SIZE_GB_MAX = 650  # if one account has already copied 650GB, switch to next account
+MIN_SA_GB = 10  # skip accounts with less than 10GB of their daily quota left
+PLAN_FILL = 0.95  # --plan fills an account to 95% of its budget, the rest is room for retried uploads
+BATCH_ATTEMPTS = 3  # give up the files of a batch after rclone finished it 3 times without copying them
+LEDGER_SAVE_INTERVAL = 30  # seconds between two writes of the quota ledger
+LOG_KEEP = 5  # compressed rclone logs kept by --log_max_mb: log_rclone.txt.1.gz ... log_rclone.txt.5.gz
 CNT_DEAD_RETRY = 100  # if there is no files be copied for 100 times, switch to next account
+CNT_QUOTA_ERROR = 1  # if rclone logs 1 quota error (403 dailyLimitExceeded, upload limit), switch to next account
+CNT_RATE_LIMIT = 15  # if rclone hits 403 userRateLimitExceeded for 15 polls in a row without copying anything, switch too
 CNT_SA_EXIT = 4  # if continually switch account for 4 times stop script
+RC_TIMEOUT = 5  # seconds to wait for one rclone remote control call
+POLL_INTERVAL = 4  # seconds between two stats polls of every worker
+LAUNCH_WAIT = 5  # seconds to give a freshly started rclone before polling it
+DRAIN_TIMEOUT = 1800  # seconds the transfers running when an account reaches its budget get to finish
+MAX_TRANSFER_EXIT = 8  # rclone's exit code once --max-transfer is reached
+NODE_WAIT = 10  # seconds a --node waits before asking the coordinator for work again
+NODE_RETRIES = 30  # a --node gives up after the coordinator did not answer that many times in a row
+NODE_CONFIG = 'rclone_node.conf'  # the rclone config a --node gets from the coordinator
+NODE_DIR = 'units'  # the files-from of the units of a --node
 
 # change it when u know what are u doing
 # paramters for rclone.
@@ -46,10 +87,16 @@ CNT_SA_EXIT = 4  # if continually switch account for 4 times stop script
 # especially for tasks with a lot of small files
 TPSLIMIT = 3 # Default 3
 TRANSFERS = 3 # Default 3
+CHECKERS = 10 # Default 10
+BATCH_TPS = TPSLIMIT  # Drive API calls per second of every account with --engine batch: every call of a batch counts
+# With --adaptive these are only the starting values, see rate_controller.py
+
+RCLONE = os.environ.get('RCLONE', 'rclone')  # rclone program, RCLONE=./fake_rclone.py to benchmark offline
 
 CLIENT_ID = os.environ.get('CLIENT_ID')
 CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 TOKEN = os.environ.get('TOKEN')
+COORDINATOR_TOKEN = os.environ.get('COORDINATOR_TOKEN')  # shared by --coordinator and its nodes
 # =================modify here=================
 
 
@@ -57,27 +104,37 @@ TOKEN = os.environ.get('TOKEN')
 def is_windows():
     return platform.system() == 'Windows'
 
-# Signal handler function that kills a process with the specified PID
+# Builds the command that force-kills the process with the specified PID
+def kill_command(pid):
+    if is_windows():
+        return 'taskkill /PID {} /F'.format(pid)
+    return "kill -9 {}".format(pid)
+
+# Signal handler function that kills every rclone process started by the workers
 def handler(signal_received, frame):
-    global PROCESS_ID
+    # Print the current time
+    print("\n" + " " * 20 + " {}".format(time.strftime("%H:%M:%S")))
 
-    # Construct the appropriate kill command based on the operating system
-    if is_windows():
-        kill_cmd = 'taskkill /PID {} /F'.format(PROCESS_ID)
-    else:
-        kill_cmd = "kill -9 {}".format(PROCESS_ID)
+    if LEDGER is not None:
+        LEDGER.save()
 
-    try:
-        # Print the current time and execute the kill command
-        print("\n" + " " * 20 + " {}".format(time.strftime("%H:%M:%S")))
-        subprocess.check_call(kill_cmd, shell=True)
-    except:
-        # Ignore any errors that occur while trying to kill the process
-        pass
+    for worker in WORKERS:
+        if not worker.pid:
+            continue
+        try:
+            subprocess.check_call(kill_command(worker.pid), shell=True)
+        except:
+            # Ignore any errors that occur while trying to kill the process
+            pass
 
     # Exit the script with a status of 0 (success)
     sys.exit(0)
 
+# Appends an event to the run journal
+def journal_write(event, **fields):
+    if JOURNAL is not None:
+        JOURNAL.write(event, **fields)
+
 # Parses command-line arguments and returns an object containing the arguments
 def parse_args():
     # Create an argument parser with a description of what the script does
@@ -86,7 +143,7 @@ def parse_args():
     # Add command-line arguments to the parser
     parser.add_argument('-s', '--source_id', type=str,
                         help='the ID of the source folder. This can be a Team Drive ID or a publicly shared folder ID.')
-    parser.add_argument('-d', '--destination_id', type=str, required=True,
+    parser.add_argument('-d', '--destination_id', type=str,
                         help='the ID of the destination folder. This can be a Team Drive ID or a publicly shared folder ID.')
 
     parser.add_argument('-sp', '--source_path', type=str, default="",
@@ -111,6 +168,69 @@ def parse_args():
     parser.add_argument('-e', '--end_sa_id', type=int, default=600,
                         help='the ending ID of the service account to use for the destination folder.')
 
+    parser.add_argument('--sa_index', type=str, default='sa_index.json',
+                        help='the file caching the result of checking the service account json files.')
+    parser.add_argument('--verify_sa', action="store_true",
+                        help='also make sure every service account can get an access token before starting.')
+    parser.add_argument('--token_uri', type=str, default=None,
+                        help='for testing purposes: the token endpoint used by --verify_sa and --engine batch.')
+
+    parser.add_argument('--ledger', type=str, default=None,
+                        help='the file recording how much every service account uploaded in the last 24 hours '
+                             '(sa_ledger.json, in the --lease folder with --lease).')
+
+    parser.add_argument('--select', choices=('order', 'score'), default='order',
+                        help='which account a worker takes next: the next id, or the best scoring one from its past speed, '
+                             'errors, quota left and the errors of its project (see sa_scores.py).')
+    parser.add_argument('--scores', type=str, default='sa_scores.json',
+                        help='the file the speed and errors of every service account are kept in for --select score.')
+
+    parser.add_argument('--project_tps', type=float, default=None,
+                        help='the Drive API requests per second allowed per GCP project: the running accounts of a project '
+                             'share it (their --tpslimit). Accounts of the least busy projects are always picked first.')
+
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='list source and destination once into this file and give every rclone run only the '
+                             'files still missing (--files-from-raw) instead of re-listing both sides.')
+    parser.add_argument('--relist', action="store_true",
+                        help='list source and destination again even if the manifest already has them.')
+    parser.add_argument('--chunked', action="store_true",
+                        help='with --manifest, for huge trees: list one subtree at a time instead of the whole tree with '
+                             '--fast-list, and hand every rclone run at most --chunk_files files, so rclone memory stays bounded.')
+    parser.add_argument('--chunk_mb', type=int, default=1024,
+                        help='with --chunked: list a subtree one level down when rclone needs more memory than this for it.')
+    parser.add_argument('--chunk_files', type=int, default=100000,
+                        help='with --chunked: the most files one rclone run is given, the next run goes on from there.')
+    parser.add_argument('--engine', choices=('rclone', 'batch'), default='rclone',
+                        help='with --manifest and a Drive source (-s): copy with rclone, or with batches of up to 100 '
+                             'Drive API files.copy calls per request (see batch_copy.py), for trees of many small files.')
+    parser.add_argument('--batch_tps', type=float, default=BATCH_TPS,
+                        help='with --engine batch: the Drive API calls per second of every account, batched or not '
+                             '(default: the --tpslimit of rclone, Drive counts every call of a batch).')
+    parser.add_argument('--drive_api', type=str, default=None,
+                        help='for testing purposes: the Drive API endpoint of --engine batch (see fake_drive_api.py).')
+    parser.add_argument('--plan', action="store_true",
+                        help='with --manifest: split the files to copy into batches that fit the remaining quota of one '
+                             'account each (see planner.py) and give every account its batch.')
+
+    parser.add_argument('--verify', action="store_true",
+                        help='after the copy, compare source and destination by size and md5 from their listings, '
+                             'write the differences to verify_report.txt and the files to copy again to verify_retry.txt.')
+    parser.add_argument('--verify_only', action="store_true",
+                        help='only compare source and destination (see --verify), do not copy.')
+
+    parser.add_argument('--log_index', type=str, default='log_index.db',
+                        help='record what rclone did with every file (copied, skipped, failed) in this file, '
+                             'see log_index.py. Empty to disable.')
+    parser.add_argument('--log_max_mb', type=int, default=512,
+                        help='compress and empty the rclone log once it reaches this size (0 to never rotate).')
+
+    parser.add_argument('--journal', type=str, default='journal.jsonl',
+                        help='the file every step of the run is recorded to.')
+    parser.add_argument('--resume', action="store_true",
+                        help='continue the run recorded in --journal after a crash: skip the accounts it used up '
+                             'and reuse its config and listings.')
+
     parser.add_argument('-c', '--rclone_config_file', type=str,
                         help='the path of the rclone config file.')
     parser.add_argument('-test', '--test_only', action="store_true",
@@ -118,6 +238,23 @@ def parse_args():
     parser.add_argument('-t', '--dry_run', action="store_true",
                         help='for testing purposes: make rclone perform a dry run (no files are actually copied).')
 
+    parser.add_argument('--standby', action="store_true",
+                        help='keep one rclone rcd running per worker and copy with every account as a job of it, '
+                             'preparing the next account while the current one copies: no restart between accounts.')
+    parser.add_argument('--rcd', action="store_true",
+                        help='run a single rclone rcd for all the workers, every account copying as a job of it '
+                             '(on the first rc port), so they share its process and caches. Implies --standby.')
+    parser.add_argument('--adaptive', action="store_true",
+                        help='tune tpslimit, transfers and checkers from the error, retry and rate limit rates of rclone '
+                             '(transfers and checkers take effect with the next account).')
+
+    parser.add_argument('--metrics_port', type=int, default=None,
+                        help='serve Prometheus metrics of this script on http://localhost:PORT/metrics.')
+
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='the number of rclone instances to run in parallel, each with its own service account, '
+                             'rc port (--port, --port + 1, ...) and share of the source folder.')
+
     parser.add_argument('--disable_list_r', action="store_true",
                         help='for debugging purposes: do not use this.')
 
@@ -127,118 +264,263 @@ def parse_args():
     parser.add_argument('--cache', action="store_true",
                         help="for testing purposes: cache the destination folder.")
 
+    parser.add_argument('--lease', type=str, nargs='?', const=LEASE_DIR, default=None,
+                        help='several copies on one host: lease every service account and rc port through lock files in '
+                             'this folder ({} if not given), skipping the ones another copy of the script holds.'.format(LEASE_DIR))
+    parser.add_argument('--workdir', type=str, default=None,
+                        help='run in this folder (created if needed): rclone.conf, the logs, current_sa.txt, the journal, '
+                             'ledger and manifest go there. Paths given on the command line stay relative to where it is run.')
+
+    parser.add_argument('--coordinator', type=int, default=None, metavar='PORT',
+                        help='with --manifest: copy on several machines. Plan the copy and hand its batches, each with an '
+                             'account, to the nodes (--node) asking on this port; no rclone runs here.')
+    parser.add_argument('--coordinator_addr', type=str, default='localhost',
+                        help='the address --coordinator listens on, 0.0.0.0 for nodes on other machines (needs a token).')
+    parser.add_argument('--node', type=str, default=None, metavar='URL',
+                        help='copy the batches the coordinator at this url (http://host:PORT) hands out, with --workers '
+                             'rclone. The copy arguments and the rclone config come from the coordinator.')
+    parser.add_argument('--coordinator_token', type=str, default=COORDINATOR_TOKEN,
+                        help='the secret the nodes give the coordinator (default: COORDINATOR_TOKEN of .env). The '
+                             'coordinator hands out the service account keys: use one outside of localhost.')
+
+    parser.add_argument('--jobs', type=str, default=None,
+                        help='daemon mode: run the copies listed in this json file (see Readme), highest priority first, '
+                             'sharing the service accounts and the --workers rc ports between them.')
+
     # Parse the command-line arguments and return the result
     args = parser.parse_args()
+    if args.jobs is None and args.node is None and args.destination_id is None:
+        parser.error('the following arguments are required: -d/--destination_id')
+    if args.node is not None and (args.jobs or args.coordinator is not None or args.manifest or args.plan or args.resume
+                                  or args.rclone_config_file or args.verify or args.verify_only):
+        parser.error('--node takes its work from the coordinator, it cannot be used with --jobs, --coordinator, '
+                     '--manifest, --plan, --resume, -c/--rclone_config_file or --verify')
+    if args.coordinator is not None and (args.jobs or args.verify_only or not args.manifest):
+        parser.error('--coordinator needs --manifest and cannot be used with --jobs or --verify_only')
+    if args.coordinator is not None and args.coordinator_addr not in ('localhost', '127.0.0.1', '::1') \
+            and not args.coordinator_token:
+        parser.error('--coordinator_addr {} needs --coordinator_token'.format(args.coordinator_addr))
+    if args.jobs is not None and (args.rclone_config_file or args.resume or args.verify_only or args.plan):
+        parser.error('--jobs cannot be used with -c/--rclone_config_file, --resume, --verify_only or --plan')
+    if args.lease and not args.workdir:
+        parser.error('--lease needs --workdir: copies running side by side cannot share their config, logs and journal')
+    if args.plan and not args.manifest:
+        parser.error('--plan needs --manifest')
+    if args.chunked and not args.manifest:
+        parser.error('--chunked needs --manifest')
+    if args.engine == 'batch' and (not args.manifest or not args.source_id or args.crypt or args.cache or args.plan
+                                   or args.jobs or args.coordinator is not None or args.node is not None):
+        parser.error('--engine batch needs --manifest and -s/--source_id, and cannot be used with --crypt, --cache, '
+                     '--plan, --jobs, --coordinator or --node')
+    if args.rcd and (args.adaptive or args.project_tps):
+        # options/set would change the rate of every job of the rcd at once
+        parser.error('--adaptive and --project_tps cannot be used with --rcd')
+    args.standby = args.standby or args.rcd
     return args
 
+# Returns the service account json files, sorted so the remote numbers stay the same between runs
+def list_sa_files(args):
+    return sorted(glob.glob(os.path.join(args.service_account, '*.json')))
+
+# The arguments that tell one copy from another, for --resume and the log index
+COPY_KEYS = ('source_id', 'source_path', 'destination_id', 'destination_path')
+
+
+def copy_key(args):
+    return json.dumps([getattr(args, key, None) for key in COPY_KEYS])
+
+
+# The arguments never written to the journal
+SECRET_ARGS = ('coordinator_token',)
+
+
+# The rclone option of a Drive id: a publicly shared root folder id has 33 characters, a team drive id 19
+def drive_kind(drive_id):
+    return {33: 'root_folder_id', 19: 'team_drive'}.get(len(drive_id or ''))
+
+
+def id_error(args):
+    """what is wrong with the Drive ids of args, None if nothing"""
+    if args.source_id:
+        if drive_kind(args.source_id) is None:
+            return 'Wrong length of team_drive_id or publicly shared root_folder_id'
+        # use path id instead path name, for team drive only
+        if args.source_path_id:
+            if len(args.source_id) != 19:
+                return 'For publicly shared folder please do not set -spi flag'
+            if len(args.source_path_id) != 33:
+                return 'Wrong length of source_path_id'
+    if drive_kind(args.destination_id) is None:
+        return 'Wrong length of team_drive_id or publicly shared root_folder_id'
+    return None
+
+
+# Hash of everything the generated config depends on: the arguments, the .env values and the json files
+def config_fingerprint(args, sa_files):
+    digest = hashlib.sha256()
+    for value in (args.source_id, args.destination_id, args.source_path_id, args.crypt, args.cache,
+                  CLIENT_ID, CLIENT_SECRET, TOKEN, os.path.realpath(args.service_account)):
+        digest.update('{!r}\n'.format(value).encode('utf-8'))
+    for filename in sa_files:
+        stat = os.stat(filename)
+        digest.update('{} {} {}\n'.format(filename, stat.st_mtime_ns, stat.st_size).encode('utf-8'))
+    return digest.hexdigest()
+
 # This function generates a rclone configuration file based on the input arguments
-def gen_rclone_cfg(args):
+# and returns its path with the service account json file of every remote number
+def gen_rclone_cfg(args, sa_files=None, output_of_config_file='./rclone.conf'):
     # Find all .json files in the service account folder
-    sa_files = glob.glob(os.path.join(args.service_account, '*.json'))
-    # Output file path for the rclone configuration
-    output_of_config_file = './rclone.conf'
+    if sa_files is None:
+        sa_files = list_sa_files(args)
 
     # If no json files found in the service account folder, exit the script
     if len(sa_files) == 0:
         sys.exit('No json files found in ./{}'.format(args.service_account))
 
+    sa_files_by_id = dict((i + 1, filename) for i, filename in enumerate(sa_files))
+
+    # Nothing changed since the config was written last time: reuse it
+    fingerprint = '# autorclone {}\n'.format(config_fingerprint(args, sa_files))
+    if os.path.exists(output_of_config_file):
+        with io.open(output_of_config_file, 'r', encoding='utf-8') as fp:
+            if fp.readline() == fingerprint:
+                print('rclone config file is up to date.')
+                return output_of_config_file, sa_files_by_id
+
+    error = id_error(args)
+    if error is not None:
+        sys.exit(error)
+    # Whether source and destination are a root folder id or a team drive id
+    folder_or_team_drive_src = drive_kind(args.source_id)
+    folder_or_team_drive_dst = drive_kind(args.destination_id)
+
+    # Get the directory path of this script once, json paths are made absolute from it
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+
+    # Build the whole config in memory, then write it at once
+    sections = [fingerprint]
+    for i, filename in enumerate(sa_files):
+
+        # Join the directory path and filename to get the full path
+        filename = os.path.join(dir_path, filename)
+        # Replace the os separator with forward slash
+        filename = filename.replace(os.sep, '/')
+
+        # For source
+        if args.source_id:
+            # Write the text for the source configuration to the output file
+            text_to_write = "[{}{:03d}]\n" \
+                            "type = drive\n" \
+                            "scope = drive\n" \
+                            "token = {}\n" \
+                            "client_id ={}\n" \
+                            "client_secret = {}\n" \
+                            "{} = {}\n".format('src', i + 1, TOKEN, CLIENT_ID, CLIENT_SECRET,folder_or_team_drive_src, args.source_id)
+
+            # use path id instead path name
+            if args.source_path_id:
+                text_to_write += 'root_folder_id = {}\n'.format(args.source_path_id)
+
+            sections.append(text_to_write + "\n")
+
+        # Create the text to write for the destination configuration
+        sections.append('[{}{:03d}]\n'
+                        'type = drive\n'
+                        'scope = drive\n'
+                        'client_id = {}\n'
+                        'client_secret = {}\n'
+                        'service_account_file = {}\n'
+                        '{} = {}\n\n'.format('dst', i + 1, CLIENT_ID, CLIENT_SECRET, filename, folder_or_team_drive_dst, args.destination_id))
+
+        # For crypt destination
+        if args.crypt:
+            remote_name = '{}{:03d}'.format('dst', i + 1)
+            sections.append('[{}_crypt]\n'
+                            'type = crypt\n'
+                            'remote = {}:\n'
+                            'filename_encryption = standard\n'
+                            'password = hfSJiSRFrgyeQ_xNyx-rwOpsN2P2ZHZV\n'
+                            'directory_name_encryption = true\n\n'.format(remote_name, remote_name))
+
+        # For cache destination
+        if args.cache:
+            remote_name = '{}{:03d}'.format('dst', i + 1)
+            sections.append('[{}_cache]\n'
+                            'type = cache\n'
+                            'remote = {}:\n'
+                            'chunk_total_size = 1G\n\n'.format(remote_name, remote_name))
+
     # Open the output file and write the configuration
-    with open(output_of_config_file, 'w') as fp:
-        # Loop over each json file found in the service account folder
-        for i, filename in enumerate(sa_files):
-
-            # Get the directory path of the current file
-            dir_path = os.path.dirname(os.path.realpath(__file__))
-            # Join the directory path and filename to get the full path
-            filename = os.path.join(dir_path, filename)
-            # Replace the os separator with forward slash
-            filename = filename.replace(os.sep, '/')
-
-            # For source
-            if args.source_id:
-                # For team drive only
-                if len(args.source_id) == 33:
-                    folder_or_team_drive_src = 'root_folder_id'
-                elif len(args.source_id) == 19:
-                    folder_or_team_drive_src = 'team_drive'
-                else:
-                    sys.exit('Wrong length of team_drive_id or publicly shared root_folder_id')
-                
-                # Write the text for the source configuration to the output file
-                text_to_write = "[{}{:03d}]\n" \
-                                "type = drive\n" \
-                                "scope = drive\n" \
-                                "token = {}\n" \
-                                "client_id ={}\n" \
-                                "client_secret = {}\n" \
-                                "{} = {}\n".format('src', i + 1, TOKEN, CLIENT_ID, CLIENT_SECRET,folder_or_team_drive_src, args.source_id)
-
-                # use path id instead path name
-                if args.source_path_id:
-                    # for team drive only
-                    if len(args.source_id) == 19:
-                        if len(args.source_path_id) == 33:
-                            text_to_write += 'root_folder_id = {}\n'.format(args.source_path_id)
-                        else:
-                            sys.exit('Wrong length of source_path_id')
-                    else:
-                        sys.exit('For publicly shared folder please do not set -spi flag')
-
-                text_to_write += "\n"
+    try:
+        with io.open(output_of_config_file, 'w', encoding='utf-8') as fp:
+            fp.write(''.join(sections))
+    except OSError:
+        sys.exit("failed to write {}".format(output_of_config_file))
 
-                try:
-                    fp.write(text_to_write)
-                except:
-                    sys.exit("failed to write {} to {}".format(args.source_id, output_of_config_file))
-            else:
-                pass
+    return output_of_config_file, sa_files_by_id
 
-            # For destination
-            # Determine whether the destination is a root folder id or a team drive id
-            if len(args.destination_id) == 33:
-                folder_or_team_drive_dst = 'root_folder_id'
-            elif len(args.destination_id) == 19:
-                folder_or_team_drive_dst = 'team_drive'
-            else:
-                sys.exit('Wrong length of team_drive_id or publicly shared root_folder_id')
 
-            # Create the text to write for the destination configuration
-            try:
-                fp.write('[{}{:03d}]\n'
-                         'type = drive\n'
-                         'scope = drive\n'
-                         'client_id = {}\n'
-                         'client_secret = {}\n'
-                         'service_account_file = {}\n'
-                         '{} = {}\n\n'.format('dst', i + 1, CLIENT_ID, CLIENT_SECRET, filename, folder_or_team_drive_dst, args.destination_id))
-            except:
-                sys.exit("failed to write {} to {}".format(args.destination_id, output_of_config_file))
-
-            # For crypt destination
-            if args.crypt:
-                remote_name = '{}{:03d}'.format('dst', i + 1)
-                try:
-                    fp.write('[{}_crypt]\n'
-                             'type = crypt\n'
-                             'remote = {}:\n'
-                             'filename_encryption = standard\n'
-                             'password = hfSJiSRFrgyeQ_xNyx-rwOpsN2P2ZHZV\n'
-                             'directory_name_encryption = true\n\n'.format(remote_name, remote_name))
-                except:
-                    sys.exit("failed to write {} to {}".format(args.destination_id, output_of_config_file))
-
-            # For cache destination
-            if args.cache:
-                remote_name = '{}{:03d}'.format('dst', i + 1)
-                try:
-                    fp.write('[{}_cache]\n'
-                             'type = cache\n'
-                             'remote = {}:\n'
-                             'chunk_total_size = 1G\n\n'.format(remote_name, remote_name))
-                except:
-                    sys.exit("failed to write {} to {}".format(args.destination_id, output_of_config_file))
+# Section header of a remote written by gen_rclone_cfg: [src001], [dst001], [dst001_crypt], [dst001_cache]
+REMOTE_LABEL = re.compile(r'^\[(src|dst)(\d+)(_crypt|_cache)?\]$')
 
-    return output_of_config_file, i
+def index_rclone_cfg(config_file):
+    """parse an existing rclone config once and index its remotes by number:
+        {1: {'labels': {'src', 'dst', 'dst_crypt'}, 'service_account_file': '/path/sa.json'}, ...}
+    """
+    index = {}
+    sa_id = None
+    label = None
+    try:
+        with io.open(config_file, 'r', encoding='utf-8') as fp:
+            for line in fp:
+                line = line.strip()
+                if line.startswith('['):
+                    match = REMOTE_LABEL.match(line)
+                    sa_id = None
+                    if match:
+                        sa_id = int(match.group(2))
+                        label = match.group(1) + (match.group(3) or '')
+                        index.setdefault(sa_id, {'labels': set(), 'service_account_file': None})['labels'].add(label)
+                elif sa_id is not None and label == 'dst' and line.split('=')[0].strip() == 'service_account_file':
+                    index[sa_id]['service_account_file'] = line.split('=', 1)[1].strip()
+    except OSError as error:
+        sys.exit('failed to read {}: {}'.format(config_file, error))
+    return index
+
+# Uses an existing rclone config, returns its path with the service account json file of every usable remote number
+def load_rclone_cfg(args):
+    config_file = args.rclone_config_file
+    index = index_rclone_cfg(config_file)
+
+    # The remotes sa_paths() will ask for
+    needed = {'dst'}
+    if args.source_id:
+        needed.add('src')
+    if args.crypt:
+        needed.add('dst_crypt')
+    if args.cache:
+        needed.add('dst_cache')
+
+    sa_files_by_id = dict((sa_id, remote['service_account_file']) for sa_id, remote in index.items()
+                          if needed <= remote['labels'])
+    if not sa_files_by_id:
+        sys.exit('No remotes named {} found in {}'.format(', '.join(label + 'NNN' for label in sorted(needed)), config_file))
+    return config_file, sa_files_by_id
+
+# The rclone config as text for other machines: the json key files inlined as service_account_credentials
+def portable_rclone_cfg(config_file):
+    lines = []
+    try:
+        with io.open(config_file, 'r', encoding='utf-8') as fp:
+            for line in fp:
+                key, _, value = line.partition('=')
+                if key.strip() == 'service_account_file':
+                    with io.open(value.strip(), 'r', encoding='utf-8') as sa_fp:
+                        line = 'service_account_credentials = {}\n'.format(json.dumps(json.load(sa_fp)))
+                lines.append(line)
+    except (OSError, ValueError) as error:
+        sys.exit('failed to read {}: {}'.format(config_file, error))
+    return ''.join(lines)
 
 
 def print_during(time_start):
@@ -256,8 +538,8 @@ def print_during(time_start):
 
 def check_rclone_program():
     # Check if running on Windows and add .exe extension to rclone program name
-    rclone_prog = 'rclone'
-    if is_windows():
+    rclone_prog = RCLONE
+    if is_windows() and rclone_prog == 'rclone':
         rclone_prog += ".exe"
 
     # Find the path to rclone program
@@ -271,13 +553,13 @@ def check_rclone_program():
     return rclone_path
 
 
-def check_path(path):
+def check_path(path, config_file='rclone.conf'):
     """run rclone command to check the size of the path
-        using the configuration file 'rclone.conf'
+        using the configuration file (default 'rclone.conf')
         and disabling the ListR mode to speed up the operation
     """
     try:
-        ret = subprocess.check_output('rclone --config {} --disable ListR size \"{}\"'.format('rclone.conf', path),
+        ret = subprocess.check_output('{} --config {} --disable ListR size \"{}\"'.format(RCLONE, config_file, path),
                                       shell=True)
         # if the command ran successfully, print the output
         print('It is okay:\n{}'.format(ret.decode('utf-8').replace('\0', '')))
@@ -287,302 +569,1653 @@ def check_path(path):
         sys.exit(str(error))
 
 
-def main():
-    
-    # Set signal handler for interrupt (SIGINT) signal
-    signal(SIGINT, handler)
 
-    # Check if rclone is installed
-    ret = check_rclone_program()
-    print("rclone is detected: {}".format(ret))
-    
-    # Parse command-line arguments
-    args = parse_args()
 
-    # Set the start and end IDs for the service accounts to be used on uploads.
-    id = args.begin_sa_id
-    end_id = args.end_sa_id
+# Returns the full source and destination paths (and the destination label) for one service account
+def sa_paths(args, sa_id):
+    # Set the source and destination labels based on the ID and whether encryption and caching are enabled
+    src_label = "src" + "{0:03d}".format(sa_id) + ":"
+    dst_label = "dst" + "{0:03d}".format(sa_id) + ":"
+    if args.crypt:
+        dst_label = "dst" + "{0:03d}_crypt".format(sa_id) + ":"
 
-    # If no rclone config file is specified, generate one
-    config_file = args.rclone_config_file
-    if config_file is None:
-        print('generating rclone config file.')
-        config_file, end_id = gen_rclone_cfg(args)
-        print('rclone config file generated.')
-    else:
-        return print('not supported yet.')
-        pass
-        # need parse labels from config files
-    
-    # Record the start time
-    time_start = time.time()
-    print("Start: {}".format(time.strftime("%H:%M:%S")))
+    if args.cache:
+        dst_label = "dst" + "{0:03d}_cache".format(sa_id) + ":"
 
-    cnt_acc_error = 0
-    while id <= end_id + 1:
+    # Set the full source path based on whether a source ID is specified or not
+    src_full_path = src_label + args.source_path
+    if args.source_id is None:
+        src_full_path = args.source_path
 
-        if id == end_id + 1:
-            break
-            # id = 1
+    # Set the full destination path based on whether a destination ID is specified or not
+    dst_full_path = dst_label + args.destination_path
+    if args.destination_id is None:
+        dst_full_path = args.destination_path
 
-    # Create a file named 'current_sa.txt' and write the current ID to it
-        with io.open('current_sa.txt', 'w', encoding='utf-8') as fp:
-            fp.write(str(id) + '\n')
+    return src_full_path, dst_full_path, dst_label
 
-    # Set the source and destination labels based on the current ID and whether encryption and caching are enabled
-        src_label = "src" + "{0:03d}".format(id) + ":"
-        dst_label = "dst" + "{0:03d}".format(id) + ":"
-        if args.crypt:
-            dst_label = "dst" + "{0:03d}_crypt".format(id) + ":"
 
-        if args.cache:
-            dst_label = "dst" + "{0:03d}_cache".format(id) + ":"
-    
-    # Set the full source path based on whether a source ID is specified or not
-        src_full_path = src_label + args.source_path
-        if args.source_id is None:
-            src_full_path = args.source_path
+# Escapes a file name so rclone filter rules match it literally
+def escape_glob(name):
+    for char in '\\*?[]{}':
+        name = name.replace(char, '\\' + char)
+    return name
 
-    # Set the full destination path based on whether a destination ID is specified or not
-        dst_full_path = dst_label + args.destination_path
-        if args.destination_id is None:
-            dst_full_path = args.destination_path
 
-    # Print the source and destination paths if test mode is enabled
-        if args.test_only:
-            print('\nsrc full path\n', src_full_path)
-            print('\ndst full path\n', dst_full_path, '\n')
-    
-    # Check the source and destination paths if path checking is enabled and this is the first SA ID
-        if args.check_path and id == args.begin_sa_id:
-            print("Please wait. Checking source path...")
-            check_path(src_full_path)
+def split_source(args, config_file, workers, sa_id, prefix=''):
+    """list the top level of the source folder once and give every worker
+        a disjoint share of its folders through an rclone filter file.
+        The files lying directly in the source folder go to the first worker.
+    """
+    src_full_path, _, _ = sa_paths(args, sa_id)
+    try:
+        ret = subprocess.check_output('{} --config {} lsjson --max-depth 1 --no-modtime --no-mimetype \"{}\"'.format(
+            RCLONE, config_file, src_full_path), shell=True)
+    except subprocess.SubprocessError as error:
+        sys.exit(str(error))
+
+    entries = json.loads(ret.decode('utf-8').replace('\0', ''))
+    dirs = sorted(entry['Path'] for entry in entries if entry['IsDir'])
+    has_files = any(not entry['IsDir'] for entry in entries)
+
+    # Deal the folders out round robin
+    shares = [[] for _ in range(workers)]
+    for k, name in enumerate(dirs):
+        shares[k % workers].append(name)
+
+    filter_files = []
+    for k, share in enumerate(shares):
+        if not share and not (k == 0 and has_files):
+            continue
+        filter_file = 'filter_{}w{:02d}.txt'.format(prefix, k + 1)
+        with io.open(filter_file, 'w', encoding='utf-8') as fp:
+            if k == 0:
+                fp.write('+ /*\n')
+            for name in share:
+                fp.write('+ /{}/**\n'.format(escape_glob(name)))
+            fp.write('- **\n')
+        filter_files.append(filter_file)
+
+    print('source split into {} shares ({} folders).'.format(len(filter_files), len(dirs)))
+    return filter_files
+
+
+class SaPool(object):
+    """hands out the service account ids begin..end, each of them at most once,
+        skipping the accounts the quota ledger knows to be (nearly) exhausted.
+        With scores the best scoring account goes first, otherwise the lowest id
+    """
+
+    def __init__(self, begin_id, end_id, sa_files, ledger, email_of=sa_email, scores=None, project_of=None,
+                 project_tps=None, leases=None):
+        # remote srcNNN/dstNNN uses the json file sa_files[NNN]
+        self.ids = [sa_id for sa_id in range(begin_id, end_id + 1) if sa_id in sa_files]
+        self.ledger = ledger
+        self.scores = scores
+        self.limits = ProjectLimits(project_tps)
+        self.leases = leases
+        self.emails = {}
+        self.projects = {}
+        for sa_id in self.ids:
+            try:
+                self.emails[sa_id] = email_of(sa_files[sa_id])
+            except (TypeError, OSError, ValueError, KeyError):
+                self.emails[sa_id] = None
+            self.projects[sa_id] = project_of(sa_files[sa_id]) if project_of is not None else None
+
+    def email(self, sa_id):
+        return self.emails.get(sa_id)
+
+    def project(self, sa_id):
+        return self.projects.get(sa_id)
+
+    def rank(self):
+        # Best scoring account first, the order of the ids among equals. Returns the scores
+        scores = self.scores.scores([(sa_id, self.email(sa_id), self.project(sa_id),
+                                      self.budget_bytes(sa_id) / float(SIZE_GB_MAX * 2 ** 30)) for sa_id in self.ids])
+        self.ids.sort(key=lambda sa_id: -scores[sa_id])
+        return scores
+
+    def started(self, sa_id):
+        self.limits.add(self.project(sa_id))
+
+    def stopped(self, sa_id):
+        self.limits.remove(self.project(sa_id))
+
+    def tpslimit(self, sa_id, tpslimit):
+        # What the account may use of the request rate of its project
+        return self.limits.share(self.project(sa_id), tpslimit)
+
+    def record_run(self, sa_id, nbytes, seconds, reason):
+        # How the run of an account went, for picking accounts in this run and the next ones
+        if self.scores is not None:
+            self.scores.record(self.email(sa_id), self.project(sa_id), nbytes, seconds, reason)
+            self.scores.save()
+
+    def budget_bytes(self, sa_id):
+        # What this account may still upload in this run
+        budget = SIZE_GB_MAX * 2 ** 30
+        email = self.email(sa_id)
+        if email is not None:
+            budget = min(budget, self.ledger.remaining_bytes(email))
+        return budget
+
+    def give_back(self, sa_id, last=False):
+        # An account that finished its work early is handed to the next worker first (or last)
+        if sa_id is not None and sa_id not in self.ids:
+            self.ids.insert(len(self.ids) if last else 0, sa_id)
+
+    def lease(self, sa_id):
+        # Another copy of the script running on this host may hold the account
+        email = self.email(sa_id)
+        if self.leases is None or email is None or self.leases.take_sa(email):
+            return True
+        print('skip {:03d} ({}): in use by process {}'.format(sa_id, email, self.leases.sa_holder(email)))
+        return False
+
+    def reader_id(self):
+        # An account for checking and listing the paths: leased like the ones handed out, but left in the pool
+        for sa_id in list(self.ids):
+            if self.lease(sa_id):
+                return sa_id
+        return None
+
+    def next_id(self):
+        scores = self.rank() if self.scores is not None else None
+        # Parallel workers on distinct projects: the least busy projects first, keeping the order among equals
+        self.ids.sort(key=lambda sa_id: self.limits.busy(self.project(sa_id)))
+        while self.ids:
+            sa_id = self.ids.pop(0)
+            if self.budget_bytes(sa_id) >= MIN_SA_GB * 2 ** 30:
+                if not self.lease(sa_id):
+                    continue
+                if scores is not None:
+                    print('picked {:03d} ({}): score {:.2f}MB/s'.format(sa_id, self.email(sa_id), scores[sa_id] / 2 ** 20))
+                return sa_id
+            print('skip {:03d} ({}): daily quota used up until {}'.format(
+                sa_id, self.email(sa_id), time.strftime("%H:%M:%S", time.localtime(self.ledger.reset_at(self.email(sa_id))))))
+        return None
+
+
+async def rotate_log(log_tail, logfile, max_mb):
+    # Compress the log in a thread, then read what rclone appended meanwhile here, where the lines are indexed
+    loop = asyncio.get_event_loop()
+    archived = await loop.run_in_executor(None, log_tail.archive, max_mb * 2 ** 20)
+    if archived is not None and log_tail.rotate(archived, LOG_KEEP):
+        print('{} compressed to {}.1.gz'.format(logfile, logfile))
+
+
+class Rcd(object):
+    """one rclone rcd, every copy is an async sync/copy job of it (see https://rclone.org/rc/).
+        With --standby every worker has its own, with --rcd the workers share one.
+    """
+
+    def __init__(self, args, config_file, port, logfile, tpslimit=TPSLIMIT, shared=False, log_index=None):
+        self.args = args
+        self.config_file = config_file
+        self.port = port
+        self.logfile = logfile
+        self.tpslimit = tpslimit
+        self.shared = shared
+        self.log_index = log_index
+        self.rc = AsyncRcClient('localhost:{}'.format(port), timeout=RC_TIMEOUT)
+        self.process = None
+        self.pid = 0
+        self.log_tail = None
+        self.lock = None
+        self.following = False
+
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+    def rclone_args(self):
+        # The flags of Worker.rclone_args() that hold for the whole process, the others go with every job
+        rclone_args = [RCLONE, 'rcd', '--rc-addr=localhost:{}'.format(self.port), '--rc-no-auth', '--config', self.config_file,
+                       '--drive-server-side-across-configs', '--drive-chunk-size', '256M', '--drive-acknowledge-abuse',
+                       '--tpslimit', str(self.tpslimit), '--fs-cache-expire-duration', '24h',
+                       '-vv', '--log-file={}'.format(self.logfile)]
+        if self.args.disable_list_r:
+            rclone_args += ['--disable', 'ListR']
+        return rclone_args
+
+    async def start(self):
+        """start rclone rcd unless it is running, and wait for its rc server"""
+        # Workers sharing it all ask at once, only the first one starts it
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.running():
+                return
+            self.rc.close()
+            rclone_args = self.rclone_args()
+            print(' '.join(shlex.quote(arg) for arg in rclone_args))
+            self.process = await asyncio.create_subprocess_exec(*rclone_args, stdin=subprocess.DEVNULL)
+            self.pid = self.process.pid
+            if self.shared:
+                # Its log does not tell the jobs apart: it is only indexed, without the account
+                self.log_tail = LogTail(self.logfile, on_line=self.log_index.feed if self.log_index is not None else None)
+            started = time.time()
+            while True:
+                try:
+                    await self.rc.call('rc/noop', timeout=1)
+                    return
+                except RcError:
+                    if self.process.returncode is not None or time.time() - started > LAUNCH_WAIT * 2:
+                        raise
+                    await asyncio.sleep(0.1)
+
+    async def follow_log(self):
+        # Index and rotate the log of a shared rcd, whichever worker polls first
+        if self.log_tail is None or self.following:
+            return
+        self.following = True
+        try:
+            self.log_tail.first_quota_error()
+            if self.log_index is not None:
+                self.log_index.flush()
+            if self.args.log_max_mb:
+                await rotate_log(self.log_tail, self.logfile, self.args.log_max_mb)
+        finally:
+            self.following = False
+
+    async def quit(self):
+        if self.running():
+            try:
+                await self.rc.quit()
+            except RcError:
+                pass
+        self.rc.close()
+
 
-            print("Please wait. Checking destination path...")
-            check_path(dst_full_path)
+# The rcd the workers share with --rcd, None without
+def shared_rcd(args, config_file, port, workers, logfile, log_index=None):
+    if not args.rcd:
+        return None
+    # One pacer for all the jobs: give it what the workers would have had together
+    return Rcd(args, config_file, port, logfile, TPSLIMIT * workers, shared=True, log_index=log_index)
 
-        # =================cmd to run=================
 
+class Worker(object):
+    """one rclone copy process, bound to one service account at a time.
+        poll() is called every POLL_INTERVAL seconds and tells the supervisor
+        whether to keep going, switch to the next account or stop this worker.
+    """
+    RUNNING, SWITCH, DONE = 'running', 'switch', 'done'
+
+    def __init__(self, index, args, config_file, pool, filter_file=None, manifest=None,
+                 port=None, name=None, shard=None, shards=1, log_index=None, plan=None, rcd=None):
+        self.index = index
+        self.args = args
+        self.config_file = config_file
+        self.pool = pool
+        self.filter_file = filter_file
+        self.manifest = manifest
+        self.log_index = log_index
+        # with --plan the batches come from the plan, not from a shard of the manifest
+        self.plan = plan
+        self.batch = None
+        # this worker copies the paths of manifest shard `shard` out of `shards`
+        self.shard = index if shard is None else shard
+        self.shards = shards
+        self.files_from = None
+        # with --chunked: the path the next chunk of the manifest starts after, and where this one started
+        self.chunk_after = None
+        self.chunk_from = None
+        self.cnt_acc_error_at_chunk = 0
+        self.port = args.port + index if port is None else port
+        if rcd is not None:
+            self.port = rcd.port
+        self.rc = AsyncRcClient('localhost:{}'.format(self.port), timeout=RC_TIMEOUT)
+        # used in the names of the files of this worker: log_rclone_w02.txt, files_from_w02.txt, ...
+        self.name = 'w{:02d}'.format(index + 1) if name is None else name
+        self.logfile = logfile
+        if index > 0 or name is not None:
+            self.logfile = '{}_{}{}'.format(os.path.splitext(logfile)[0], self.name, os.path.splitext(logfile)[1])
+
+        self.sa_id = None
+        self.process = None
+        self.pid = 0
+        # with --standby: the rcd, the job of the current account in it, and the next account, kept warm
+        self.rcd = rcd
+        if rcd is None and args.standby:
+            self.rcd = Rcd(args, config_file, self.port, self.logfile)
+        self.jobid = None
+        self.warm_id = None
+        # the --tpslimit the running rclone was given last
+        self.tpslimit_set = None
+        self.warm_rc = AsyncRcClient('localhost:{}'.format(self.port), timeout=RC_TIMEOUT * 6)
+        self.done = False
+        self.dst_label = None
+        self.launched_at = 0
+        self.log_tail = None
+        # files the log of this worker says are copied (or already there) since the last poll
+        self.done_paths = []
+        # with a shared rcd: the files of this batch core/transferred reported
+        self.batch_done = set()
+        # why the last rclone run was stopped: budget, quota, stall or finished
+        self.stop_reason = None
+        # since when rclone has been finishing its last transfers at the budget, 0 if not
+        self.draining_since = 0
+        self.controller = None
+        if args.adaptive:
+            self.controller = RateController(TPSLIMIT, TRANSFERS, CHECKERS)
+        # seconds between rclone logging a quota error and this script noticing it
+        self.quota_latencies = []
+
+        # These survive account switches: they detect that there is nothing left to copy
+        self.cnt_acc_error = 0
+        self.cnt_exit = 0
+
+    def rates(self):
+        # Carry the values learned with the previous account over to the next one
+        tpslimit, transfers, checkers = TPSLIMIT, TRANSFERS, CHECKERS
+        if self.controller is not None:
+            tpslimit, transfers, checkers = self.controller.tpslimit, self.controller.transfers, self.controller.checkers
+        # Within the share of the request rate of the project of the account
+        if self.sa_id is not None:
+            tpslimit = self.pool.tpslimit(self.sa_id, tpslimit)
+        return tpslimit, transfers, checkers
+
+    def rclone_args(self, src_full_path, dst_full_path):
         # Construct the rclone command to run
-        rclone_cmd = "rclone copy --config {} ".format(config_file)
-        if args.dry_run:
-           rclone_cmd += "--dry-run "
+        rclone_args = [RCLONE, 'copy', '--config', self.config_file]
+        if self.args.dry_run:
+            rclone_args += ['--dry-run']
 
         # ================= edit below if needed =================
         # edit here to add more flags for rclone command !
-        rclone_cmd += "--fast-list --drive-server-side-across-configs --rc --rc-addr=\"localhost:{}\" --low-level-retries 1 -vv --ignore-existing --checkers 10 --progress ".format(args.port)
-        rclone_cmd += "--tpslimit {} --transfers {} --drive-chunk-size 256M ".format(TPSLIMIT, TRANSFERS)
-        if args.disable_list_r:
-            rclone_cmd += "--disable ListR "
-        rclone_cmd += "--drive-acknowledge-abuse --log-file={} \"{}\" \"{}\"".format(logfile, src_full_path,
-                                                                                     dst_full_path)
-        
-    # Add an '&' to the end of the rclone command if the operating system is not Windows, otherwise add 'start /b'
-        if not is_windows():
-            rclone_cmd = rclone_cmd + " &"
+        if self.files_from:
+            # Only the files listed, looked up one by one: no listing of source or destination
+            rclone_args += ['--files-from-raw', self.files_from, '--no-traverse']
+        else:
+            rclone_args += ['--fast-list']
+        rclone_args += ['--drive-server-side-across-configs', '--rc', '--rc-addr=localhost:{}'.format(self.port),
+                        '--low-level-retries', '1', '-vv', '--ignore-existing']
+        # Several rclone writing progress to the same terminal is unreadable
+        if len(WORKERS) <= 1:
+            rclone_args += ['--progress']
+        tpslimit, transfers, checkers = self.rates()
+        rclone_args += ['--tpslimit', '{:g}'.format(tpslimit), '--transfers', str(transfers), '--checkers', str(checkers),
+                        '--drive-chunk-size', '256M']
+        if self.args.disable_list_r:
+            rclone_args += ['--disable', 'ListR']
+        if self.filter_file:
+            rclone_args += ['--filter-from', self.filter_file]
+        # Short of the budget rclone starts no new transfer but finishes the running ones, and it
+        # leaves the files bigger than the whole budget to an account with more left
+        budget = '{}M'.format(self.budget_bytes // 2 ** 20)
+        cutoff = '{}M'.format(self.cutoff_bytes // 2 ** 20)
+        rclone_args += ['--max-transfer', cutoff, '--cutoff-mode', 'soft', '--max-size', budget]
+        rclone_args += ['--drive-acknowledge-abuse', '--log-file={}'.format(self.logfile), src_full_path, dst_full_path]
+        return rclone_args
+
+    def job_params(self, src_full_path, dst_full_path):
+        # rc sync/copy doing what rclone_args() does, see https://rclone.org/rc/#sync-copy
+        _, transfers, checkers = self.rates()
+        budget = '{}M'.format(self.budget_bytes // 2 ** 20)
+        config = {'IgnoreExisting': True, 'LowLevelRetries': 1, 'Transfers': transfers, 'Checkers': checkers,
+                  'MaxTransfer': '{}M'.format(self.cutoff_bytes // 2 ** 20), 'CutoffMode': 'SOFT',
+                  'DryRun': bool(self.args.dry_run)}
+        job_filter = {'MaxSize': budget}
+        if self.files_from:
+            config['NoTraverse'] = True
+            job_filter['FilesFromRaw'] = [os.path.abspath(self.files_from)]
         else:
-            rclone_cmd = "start /b " + rclone_cmd
-        # =================cmd to run=================
-        # Print the rclone command
+            config['UseListR'] = True
+        if self.filter_file:
+            job_filter['FilterFrom'] = [os.path.abspath(self.filter_file)]
+        return {'srcFs': src_full_path, 'dstFs': dst_full_path, '_async': True, '_config': config, '_filter': job_filter}
+
+    async def prewarm(self, sa_id):
+        # Let the rcd create the remotes of the next account (and get its token) while this one copies
+        src_full_path, dst_full_path, _ = sa_paths(self.args, sa_id)
+        for remote in (src_full_path, dst_full_path):
+            try:
+                await self.warm_rc.call('operations/fsinfo', {'fs': remote})
+            except RcError as error:
+                if self.args.test_only: print('\nFailed to prepare {}: {}'.format(remote, error))
+
+    async def close(self):
+        # Hand back the account kept warm and stop the rcd
+        if self.warm_id is not None:
+            self.pool.give_back(self.warm_id)
+            self.warm_id = None
+        if self.rcd is not None and not self.rcd.shared:
+            await self.rcd.quit()
+        self.warm_rc.close()
+
+    async def start(self, sa_id, batch=None):
+        # Index what the previous run logged after its last poll
+        if self.log_tail is not None:
+            self.log_tail.first_quota_error()
+            if self.log_index is not None:
+                self.log_index.flush()
+                await self.mark_transferred()
+
+        self.sa_id = sa_id
+        self.email = self.pool.email(sa_id)
+        self.budget_bytes = self.pool.budget_bytes(sa_id)
+        # rclone stops starting transfers here, the rest of the budget is room for the ones still running
+        self.cutoff_bytes = int(self.budget_bytes * PLAN_FILL)
+        src_full_path, dst_full_path, self.dst_label = sa_paths(self.args, sa_id)
+
+        # Hand this run its planned batch, or only what is left of this worker's share
+        self.batch = batch
+        if batch is not None:
+            self.files_from = batch.files_from
+            print('batch {}: {} files ({:.2f}GB) for worker {}.'.format(
+                batch.number, len(batch.paths), batch.size / 2 ** 30, self.name))
+        elif self.manifest is not None:
+            self.files_from = 'files_from_{}.txt'.format(self.name)
+            limit = self.args.chunk_files if self.args.chunked else None
+            self.chunk_from = self.chunk_after
+            count, size, last = self.manifest.write_files_from(self.files_from, self.shard, self.shards, self.chunk_from, limit)
+            if count == 0 and self.chunk_from is not None:
+                # The end of the tree: start over with what the chunks did not copy
+                self.chunk_from = None
+                count, size, last = self.manifest.write_files_from(self.files_from, self.shard, self.shards, None, limit)
+            if count == 0:
+                print('Nothing left to copy for worker {}.'.format(self.name))
+                return False
+            # The next chunk starts after this one, unless this one went to the end
+            self.chunk_after = last if limit and count >= limit else None
+            self.cnt_acc_error_at_chunk = self.cnt_acc_error
+            print('{} files ({:.2f}GB) {} for worker {}.'.format(
+                count, size / 2 ** 30, 'in this chunk' if limit else 'left', self.name))
+
+        # Print the source and destination paths if test mode is enabled
+        if self.args.test_only:
+            print('\nsrc full path\n', src_full_path)
+            print('\ndst full path\n', dst_full_path, '\n')
 
-        print(rclone_cmd)
+        # Only look at what this run appends to the log (the rcd reads the log it shares)
+        self.log_tail = None
+        if self.rcd is None or not self.rcd.shared:
+            self.log_tail = LogTail(self.logfile, on_line=self.index_line if self.log_index is not None else None)
 
-    # Attempt to run the rclone command in the shell
+        # Attempt to start rclone, without waiting for it
+        self.pool.started(sa_id)
+        self.tpslimit_set, _, _ = self.rates()
+        try:
+            if self.rcd is not None:
+                # A new job for the rcd already running: no process start, no config to parse
+                await self.rcd.start()
+                self.process, self.pid = self.rcd.process, self.rcd.pid
+                self.tpslimit_set = None
+                self.jobid = (await self.rc.call('sync/copy', self.job_params(src_full_path, dst_full_path)))['jobid']
+                print('rc sync/copy job {}: {} -> {}'.format(self.jobid, src_full_path, dst_full_path))
+                # its rc server is up already
+                self.launched_at = time.time() - LAUNCH_WAIT
+            else:
+                rclone_args = self.rclone_args(src_full_path, dst_full_path)
+                print(' '.join(shlex.quote(arg) for arg in rclone_args))
+                self.jobid = None
+                self.process = await asyncio.create_subprocess_exec(*rclone_args, stdin=subprocess.DEVNULL)
+                self.pid = self.process.pid
+                self.launched_at = time.time()
+            if self.args.test_only: print('\npid is: {}\n'.format(self.pid))
+            print(">> Let us go {} {}".format(self.dst_label, time.strftime("%H:%M:%S")))
+            METRICS.set('autorclone_active_sa', sa_id, worker=self.index + 1)
+            journal_write('sa_started', worker=self.index + 1, sa_id=sa_id, email=self.email, budget=self.budget_bytes)
+
+        # If there's an error, print the error message and give up this worker
+        except (OSError, RcError) as error:
+            print("error: " + str(error))
+            self.pool.stopped(sa_id)
+            return False
+
+        # Initialize the per account counters and flags
+        self.cnt_error = 0
+        self.cnt_dead_retry = 0
+        self.size_bytes_done_before = 0
+        self.cnt_acc_sucess = 0
+        self.already_start = False
+        self.size_bytes_recorded = 0
+        self.peak_rss = 0
+        self.cnt_quota_error = 0
+        self.cnt_rate_limit = 0
+        self.rate_limits_before = self.log_tail.rate_limits if self.log_tail is not None else 0
+        self.errors_before = 0
+        self.draining_since = 0
+        self.last_transferred = set()
+        self.batch_done = set()
+        if self.controller is not None:
+            self.controller.reset()
+        return True
+
+    def index_line(self, line):
+        parsed = self.log_index.feed(line, self.sa_id)
+        if parsed is not None and parsed[1] in (COPIED, SKIPPED):
+            self.done_paths.append(parsed[0])
+
+    def rate_limited(self, stats):
+        # Whether rclone hit 403 userRateLimitExceeded since the last poll: in its log, or
+        # (the log of a shared rcd mixes the jobs) as the last error of a new error of the job
+        errors = int(stats.get('errors', 0))
+        if self.log_tail is not None:
+            limited = self.log_tail.rate_limits > self.rate_limits_before
+            self.rate_limits_before = self.log_tail.rate_limits
+        else:
+            limited = errors > self.errors_before and is_rate_limit(stats.get('lastError'))
+        self.errors_before = errors
+        return limited
+
+    async def adjust_rate(self, stats, rate_limited=False):
+        # Additive increase / multiplicative decrease of the rate of the running rclone,
+        # a rate limit error halves it right away
+        if rate_limited:
+            values, error_rate = self.controller.back_off(stats, self.log_tail.retries), None
+        else:
+            values, error_rate = self.controller.step(stats, self.log_tail.retries)
+        if values is None:
+            return
+        values['TPSLimit'] = self.pool.tpslimit(self.sa_id, values['TPSLimit'])
+        # A running copy keeps its transfer and checker pool: those go to the next rclone (rates())
+        try:
+            await self.rc.call('options/set', {'main': {'TPSLimit': values['TPSLimit']}})
+        except RcError as error:
+            if self.args.test_only: print('\nFailed to set options: {}'.format(error))
+            return
+        self.tpslimit_set = values['TPSLimit']
+        print('{} ({}) {}: tpslimit {}, transfers {} checkers {} from the next account'.format(
+            self.dst_label, self.email, 'rate limited' if error_rate is None else 'error rate {:.3f}'.format(error_rate),
+            values['TPSLimit'], values['Transfers'], values['Checkers']))
+
+    async def follow_project(self):
+        # Accounts of the same project started or stopped: take the new share of its request rate
+        tpslimit, _, _ = self.rates()
+        if tpslimit == self.tpslimit_set:
+            return
+        try:
+            await self.rc.call('options/set', {'main': {'TPSLimit': tpslimit}})
+        except RcError as error:
+            if self.args.test_only: print('\nFailed to set options: {}'.format(error))
+            return
+        self.tpslimit_set = tpslimit
+        print('{} ({}): tpslimit {:g}, the share of project {}'.format(self.dst_label, self.email, tpslimit,
+                                                                       self.pool.project(self.sa_id)))
+
+    def record_bytes(self, size_bytes_done):
+        # Add what was uploaded since the last poll to the quota ledger
+        if size_bytes_done > self.size_bytes_recorded:
+            if self.email is not None:
+                self.pool.ledger.record(self.email, size_bytes_done - self.size_bytes_recorded)
+            METRICS.inc('autorclone_bytes_transferred_total', size_bytes_done - self.size_bytes_recorded)
+            METRICS.inc('autorclone_sa_bytes_total', size_bytes_done - self.size_bytes_recorded,
+                        sa='{:03d}'.format(self.sa_id), email=self.email or '')
+        self.size_bytes_recorded = max(self.size_bytes_recorded, size_bytes_done)
+
+    async def kill(self):
+        # Print the current time
+        print("\n" + " " * 20 + " {}".format(time.strftime("%H:%M:%S")))
+        # With --standby only the job goes, the rcd stays for the next account
+        if self.jobid is not None:
+            try:
+                await self.rc.job_stop(self.jobid)
+                print('\n')
+            except RcError:
+                if self.args.test_only: print("\nFailed to stop the job.")
+            return
+        try:
+            self.process.kill()
+            await self.process.wait()
+            print('\n')
+        except ProcessLookupError:
+            # If the kill command fails, print an error message (if in test mode) and continue
+            if self.args.test_only: print("\nFailed to kill.")
+            pass
+        self.rc.close()
+
+    def group(self):
+        # rc parameters selecting the stats of the current job of an rcd
+        return {'group': 'job/{}'.format(self.jobid)} if self.jobid is not None else None
+
+    def job_finished(self, job):
+        # The job of this account in the rcd ended, like an rclone exiting
+        error = job.get('error') or ''
+        if self.draining_since or 'max transfer' in error:
+            print('{} reached its budget, all transfers finished.'.format(self.dst_label))
+            self.stop_reason = 'budget'
+            self.cnt_exit = 0
+            return self.SWITCH
+
+        # As much as three polls without any rclone
+        self.cnt_acc_error += 3
+        print('rclone job {} ended{} (possibly done for this account). ({}/3)'.format(
+            self.jobid, ': ' + error if error else '', self.cnt_acc_error // 3))
+        self.stop_reason = 'finished'
+        if self.cnt_acc_error >= 9:
+            print('All done (3/3).')
+            return self.DONE
+        return self.SWITCH
+
+    def record_files(self, names):
+        if not names:
+            return
+        journal_write('files_completed', worker=self.index + 1, sa_id=self.sa_id, files=names)
+        if self.manifest is not None:
+            self.manifest.mark_done(names)
+
+    async def mark_transferred(self):
+        # Record the files rclone finished since the last poll in the journal and the manifest.
+        # core/transferred only keeps the last 100 or so: the log of this worker, indexed line by
+        # line, tells every one of them, copied or found at the destination
+        if self.log_tail is not None and self.log_index is not None:
+            names, self.done_paths = sorted(set(self.done_paths)), []
+            return self.record_files(names)
         try:
-            subprocess.check_call(rclone_cmd, shell=True)
+            transferred = (await self.rc.call('core/transferred', self.group())).get('transferred') or []
+        except RcError:
+            return
+        # Keep only the ones not seen last time. With --ignore-existing rclone only checks the files
+        # already at the destination: the checked ones it skipped are done as well.
+        names = set(item['name'] for item in transferred if not item.get('error'))
+        new_names = sorted(names - self.last_transferred)
+        self.last_transferred = names
+        if self.batch is not None:
+            self.batch_done.update(new_names)
+        self.record_files(new_names)
+
+    async def settle_files(self):
+        """the run of this account is over: record what rclone logged after the last poll"""
+        if self.log_tail is not None:
+            self.log_tail.first_quota_error()
+            return await self.mark_transferred()
+        await self.mark_transferred()
+        # The log of a shared rcd mixes the jobs: only the files of the batch can be looked up in the index
+        if self.rcd is not None and self.log_index is not None and self.batch is not None:
+            await self.rcd.follow_log()
+            self.record_files(sorted(set(self.log_index.done(self.batch.paths)) - self.batch_done))
+            self.batch_done = set()
+
+    async def poll(self):
+        # Give rclone some time to start its remote control server
+        if time.time() - self.launched_at < LAUNCH_WAIT:
+            return self.RUNNING
+
+        # How much memory rclone needed so far, to compare --chunked with --fast-list
+        self.peak_rss = max(self.peak_rss, peak_rss(self.pid) or 0)
 
-        # Print message and sleep for 10 seconds if successful
-            print(">> Let us go {} {}".format(dst_label, time.strftime("%H:%M:%S")))
-            time.sleep(5)
+        try:
+            # Get rclone stats using rclone remote control
+            poll_start = time.time()
+            response_processed_json = await self.rc.call('core/stats', self.group())
+            METRICS.observe('autorclone_rc_poll_seconds', time.time() - poll_start, worker=self.index + 1)
+            # Increment counter for successful responses
+            self.cnt_acc_sucess += 1
+            # Reset error counter if there were multiple successful responses after a long waiting time
+            self.cnt_error = 0
 
-    # If there's an error, print the error message and return
-        except subprocess.SubprocessError as error:
-            return print("error: " + str(error))
+            """
+            Reset error counter if there were multiple successful responses after a long waiting time
+            if there is a long time waiting, this will be easily satisfied, so check if it is started using
+            already_started flag
+            """
+            if self.already_start and self.cnt_acc_sucess >= 9:
+                self.cnt_acc_error = 0
+                self.cnt_acc_sucess = 0
+                if self.args.test_only: print(
+                    "total 9 times success. the cnt_acc_error is reset to {}\n".format(self.cnt_acc_error))
+
+        except RcError:
+            METRICS.inc('autorclone_rc_errors_total', worker=self.index + 1)
+            # rclone exited after finishing the transfers it had running at the budget
+            if self.process.returncode is not None and (self.draining_since or self.process.returncode == MAX_TRANSFER_EXIT):
+                print('{} reached its budget, all transfers finished.'.format(self.dst_label))
+                self.stop_reason = 'budget'
+                self.cnt_exit = 0
+                return self.SWITCH
+
+            # Continually increase error counter until a certain threshold
+            self.cnt_error = self.cnt_error + 1
+            self.cnt_acc_error = self.cnt_acc_error + 1
+            if self.cnt_error >= 3:
+                self.cnt_acc_sucess = 0
+                if self.args.test_only: print(
+                    "total 3 times failure. the cnt_acc_sucess is reset to {}\n".format(self.cnt_acc_sucess))
+
+                # If the error threshold is reached, assume the task is finished for this account
+                print('No rclone task detected (possibly done for this '
+                      'account). ({}/3)'.format(int(self.cnt_acc_error / self.cnt_error)))
+
+                self.stop_reason = 'finished'
+                # Regard continually exit as *all done*.
+                if self.cnt_acc_error >= 9:
+                    print('All done (3/3).')
+                    return self.DONE
+                return self.SWITCH
+            return self.RUNNING
 
-    # Initialize some counters and flags
-        cnt_error = 0
-        cnt_dead_retry = 0
-        size_bytes_done_before = 0
-        cnt_acc_sucess = 0
-        already_start = False
+        # Process the response and extract relevant data
+        size_bytes_done = int(response_processed_json['bytes'])
+        checks_done = int(response_processed_json['checks'])
+        size_GB_done = int(size_bytes_done * 9.31322e-10)
+        speed_now = float(int(response_processed_json['speed']) * 9.31322e-10 * 1024)
+        METRICS.set('autorclone_speed_bytes_per_second', float(response_processed_json['speed']), worker=self.index + 1)
+        METRICS.set('autorclone_checks', checks_done, worker=self.index + 1)
+        self.record_bytes(size_bytes_done)
+        await self.mark_transferred()
+
+        moved = size_bytes_done > self.size_bytes_done_before
+        # continually no ...
+        if size_bytes_done - self.size_bytes_done_before == 0:
+            # If there has been no increase in the amount of data transferred since the last check and the job has already started
+            if self.already_start:
+                # Increase the count of times there has been no increase in data transferred
+                self.cnt_dead_retry += 1
+                METRICS.inc('autorclone_stall_events_total', worker=self.index + 1)
+
+                # If the script is in test mode, print some debugging information
+                if self.args.test_only:
+                    print('\nsize_bytes_done', size_bytes_done)
+                    print('size_bytes_done_before', self.size_bytes_done_before)
+                    print("No. No size increase after job started.")
+        else:
+            # If there has been an increase in the amount of data transferred, reset the count of times there has been no increase
+            self.cnt_dead_retry = 0
+
+            # If the script is in test mode, print some debugging information
+            if self.args.test_only: print("\nOk. I think the job has started")
+
+            # Mark the job as having started
+            self.already_start = True
 
-    # Try to get the PID of the rclone process running on the specified port
+        # Remember the amount of data transferred for the next check
+        self.size_bytes_done_before = size_bytes_done
+
+        # Look for quota errors in what rclone logged since the last check, and in its last error
+        quota_line, latency = None, None
+        if self.log_tail is not None:
+            quota_line, latency = self.log_tail.first_quota_error()
+        else:
+            # the log of a shared rcd mixes all the jobs, only the stats of this one are its own
+            await self.rcd.follow_log()
+        if quota_line is None and is_quota_error(response_processed_json.get('lastError')):
+            quota_line = response_processed_json['lastError']
+        if quota_line is not None:
+            self.cnt_quota_error += 1
+            if latency is not None:
+                self.quota_latencies.append(latency)
+                print('{} quota error noticed {:.1f}s after rclone logged it:\n{}'.format(self.dst_label, latency, quota_line))
+            else:
+                print('{} quota error:\n{}'.format(self.dst_label, quota_line))
+        # A rate limit is retried by rclone's pacer, it only ends the account when it persists
+        # without any bytes moving (which is also how the 750GB upload cap shows)
+        rate_limited = self.rate_limited(response_processed_json)
+        if moved:
+            self.cnt_rate_limit = 0
+        elif rate_limited:
+            self.cnt_rate_limit += 1
+            if self.cnt_rate_limit == CNT_RATE_LIMIT:
+                print('{} rate limited for {} polls without copying anything.'.format(self.dst_label, CNT_RATE_LIMIT))
+        quota_hit = self.cnt_quota_error >= CNT_QUOTA_ERROR or self.cnt_rate_limit >= CNT_RATE_LIMIT
+        if self.log_index is not None:
+            self.log_index.flush()
+
+        # Keep the log from growing without bound, what it said is in the index by now
+        if self.args.log_max_mb and self.log_tail is not None:
+            await rotate_log(self.log_tail, self.logfile, self.args.log_max_mb)
+
+        # In an rcd the end of the job, not of the process, ends the run of this account
+        if self.jobid is not None and not quota_hit:
+            try:
+                job = await self.rc.job_status(self.jobid)
+            except RcError:
+                job = {}
+            if job.get('finished'):
+                return self.job_finished(job)
+
+        if self.controller is not None and not quota_hit:
+            await self.adjust_rate(response_processed_json, rate_limited)
+        if self.pool.limits.tps is not None and not quota_hit:
+            await self.follow_project()
+
+        # At the cutoff do not kill rclone in the middle of a file: it starts no new transfer
+        # (--max-transfer, soft cutoff) and exits once the running ones are done. Only the ones
+        # that would take the account past its whole budget are cut short.
+        if size_bytes_done >= self.cutoff_bytes and not self.draining_since:
+            self.draining_since = time.time()
+            print('{} reached its cutoff, waiting for the running transfers to finish.'.format(self.dst_label))
+        draining_too_long = self.draining_since and (time.time() - self.draining_since >= DRAIN_TIMEOUT or
+                                                     size_bytes_done >= self.budget_bytes)
+
+        # Stop by error (403, etc) info
+        if draining_too_long or self.cnt_dead_retry >= CNT_DEAD_RETRY or quota_hit:
+            # If the running transfers did not finish in time, Google refused more uploads or there have been too many consecutive checks with no increase in data transferred:
+            await self.kill()
+            self.stop_reason = 'quota' if quota_hit else 'stall' if self.cnt_dead_retry >= CNT_DEAD_RETRY else 'budget'
+
+            # =================Finish it=================
+            # A quota error, or a stalled account, means Google's daily limit was hit before our own count did
+            if (quota_hit or self.cnt_dead_retry >= CNT_DEAD_RETRY) and self.email is not None:
+                self.pool.ledger.mark_exhausted(self.email)
+
+            if self.cnt_dead_retry >= CNT_DEAD_RETRY or (quota_hit and not self.already_start):
+                # Increase the count of times the worker has exited without copying anything more
+                self.cnt_exit += 1
+                if self.args.test_only: print(
+                    "1 more time for long time waiting. the cnt_exit is added to {}\n".format(self.cnt_exit))
+            else:
+                # clear cnt if there is one time
+                self.cnt_exit = 0
+                if self.args.test_only: print("1 time sucess. the cnt_exit is reset to {}\n".format(self.cnt_exit))
+
+            # Regard continually exit as *all done*.
+            if self.cnt_exit >= CNT_SA_EXIT:
+                # exit directly rather than switch to next account.
+                print('All Done.')
+                return self.DONE
+            # =================Finish it=================
+
+            return self.SWITCH
+
+        return self.RUNNING
+
+
+# The rc ports of the workers: --port, --port + 1, ... or, with --lease, the first free ones from --port on
+def rc_ports(args, count):
+    if LEASES is None:
+        return list(range(args.port, args.port + count))
+    try:
+        ports = LEASES.take_ports(args.port, count)
+    except RuntimeError as error:
+        sys.exit(str(error))
+    print('rc ports: {}'.format(', '.join(str(port) for port in ports)))
+    return ports
+
+
+# Runs in args.workdir: what the script writes goes there, the paths given keep pointing where they did
+def enter_workdir(args):
+    global RCLONE
+    for key in ('service_account', 'jobs', 'rclone_config_file', 'lease'):
+        if getattr(args, key, None):
+            setattr(args, key, os.path.abspath(getattr(args, key)))
+    # Local source or destination folders
+    if args.source_id is None and args.source_path:
+        args.source_path = os.path.abspath(args.source_path)
+    if args.destination_id is None and args.destination_path:
+        args.destination_path = os.path.abspath(args.destination_path)
+    if os.sep in RCLONE and not os.path.isabs(RCLONE):
+        RCLONE = os.path.abspath(RCLONE)
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    print('working in {}'.format(os.getcwd()))
+
+
+# Write the service account id of every running worker to 'current_sa.txt', one per line
+def write_current_sa(workers):
+    with io.open('current_sa.txt', 'w', encoding='utf-8') as fp:
+        for worker in workers:
+            if not worker.done:
+                fp.write(str(worker.sa_id) + '\n')
+            else:
+                METRICS.set('autorclone_active_sa', 0, worker=worker.index + 1)
+
+
+# Checks the service account json files and returns the usable ones
+def usable_sa_files(args, sa_index):
+    all_sa_files = list_sa_files(args)
+    usable = sa_index.build(all_sa_files, verify=args.verify_sa, token_uri=args.token_uri)
+    for filename, error in sorted(sa_index.errors().items()):
+        print('skip {}: {}'.format(filename, error))
+    print('{} of {} service accounts are usable.'.format(len(usable), len(all_sa_files)))
+    if all_sa_files and not usable:
+        sys.exit('No usable json files found in ./{}'.format(args.service_account))
+    return usable
+
+
+# Checks the source and destination paths of a copy with the given account
+def check_paths(args, config_file, sa_id):
+    src_full_path, dst_full_path, _ = sa_paths(args, sa_id)
+    print("Please wait. Checking source path...")
+    check_path(src_full_path, config_file)
+
+    print("Please wait. Checking destination path...")
+    check_path(dst_full_path, config_file)
+
+
+def list_manifest(args, config_file, sa_id):
+    """list both sides of the copy into the manifest args.manifest (unless
+        already done), so the workers only get what is missing
+    """
+    manifest = Manifest(args.manifest)
+    src_full_path, dst_full_path, _ = sa_paths(args, sa_id)
+    for side, path in ((SRC, src_full_path), (DST, dst_full_path)):
+        if manifest.is_listed(side) and not args.relist:
+            continue
+        print("Please wait. Listing {} into {}...".format(path, args.manifest))
         try:
-            response = subprocess.check_output('rclone rc --rc-addr="localhost:{}" core/pid'.format(args.port), shell=True)
-        
-        # Extract the PID from the response and convert it to an integer
-            pid = json.loads(response.decode('utf-8').replace('\0', ''))['pid']
-        
-        # Print the PID if test_only flag is set
-            if args.test_only: print('\npid is: {}\n'.format(pid))
-
-        # Set the global variable PID to the extracted PID
-            global PID
-            PID = int(pid)
-
-   # If there's an error, do nothing (i.e. continue with the script)
+            if args.chunked:
+                # A listing cut short goes on with the subtrees it had left, unless listing again
+                if args.relist:
+                    manifest.set_meta('chunked_' + side, '0')
+                count = manifest.list_chunked(side, config_file, path, args.chunk_mb * 2 ** 20, rclone=RCLONE)
+            else:
+                count = manifest.list_remote(side, config_file, path, fast_list=not args.disable_list_r, rclone=RCLONE)
         except subprocess.SubprocessError as error:
-            pass
+            sys.exit(str(error))
+        if manifest.peak_rss:
+            print('{} files listed, rclone used up to {}MB.'.format(count, manifest.peak_rss // 2 ** 20))
+        else:
+            print('{} files listed.'.format(count))
+        journal_write('listing_done', side=side, files=count, peak_rss=manifest.peak_rss)
+        manifest.peak_rss = 0
+    return manifest
 
-    # A while loop to constantly check for the status of the rclone task
+
+def make_plan(manifest, pool):
+    """plan the files left in the manifest over the accounts of the pool. The planned
+        accounts leave the pool, what remains of it copies the batches planned again
+    """
+    capacities = []
+    # The best accounts get the first batches
+    if pool.scores is not None:
+        pool.rank()
+    for sa_id in list(pool.ids):
+        budget = pool.budget_bytes(sa_id)
+        if budget >= MIN_SA_GB * 2 ** 30 and pool.lease(sa_id):
+            capacities.append((sa_id, int(budget * PLAN_FILL)))
+    plan = Plan().build(manifest.todo(), capacities)
+    planned = set(batch.sa_id for batch in plan.batches)
+    pool.ids = [sa_id for sa_id in pool.ids if sa_id not in planned]
+
+    print('{} batches planned ({:.2f}GB), {} accounts kept for the rest.'.format(
+        len(plan.batches), sum(batch.size for batch in plan.batches) / 2 ** 30, len(pool.ids)))
+    if plan.left_paths:
+        print('{} files ({:.2f}GB) do not fit the quota left today.'.format(len(plan.left_paths), plan.left_size / 2 ** 30))
+    journal_write('plan_made', batches=len(plan.batches), left_files=len(plan.left_paths), left_bytes=plan.left_size)
+    return plan
+
+
+def run_verify(args, config_file, sa_ids, prefix=''):
+    """compare source and destination by listing, one top level folder per account
+        at a time (listing does not count against the upload quota)
+    """
+    report, retry = '{}verify_report.txt'.format(prefix), '{}verify_retry.txt'.format(prefix)
+    print("Please wait. Verifying the copy with {} accounts...".format(len(sa_ids)))
+    try:
+        summary = verify.verify(config_file, sa_ids, lambda sa_id: sa_paths(args, sa_id)[:2], report=report, retry=retry,
+                                fast_list=not args.disable_list_r, rclone=RCLONE)
+    except (RuntimeError, subprocess.SubprocessError) as error:
+        print('Verification failed: {}'.format(error))
+        return None
+    print('{} files ({:.2f}GB) verified in {} shards: {} missing, {} size and {} md5 mismatches, {} only in the destination.'.format(
+        summary['files'], summary['bytes'] / 2 ** 30, summary['shards'], summary[verify.MISSING],
+        summary[verify.SIZE_MISMATCH], summary[verify.MD5_MISMATCH], summary[verify.EXTRA]))
+    if summary[verify.MISSING] + summary[verify.SIZE_MISMATCH] + summary[verify.MD5_MISMATCH]:
+        print('See {}, the files to copy again are in {}.'.format(report, retry))
+    journal_write('verify_done', **summary)
+    return summary
+
+
+# Starts a worker on the next usable account (and batch), returns False if there was none left
+async def start_next(worker, pool):
+    batch = None
+    if worker.plan is not None:
+        batch = worker.plan.next_batch()
+        if batch is None:
+            worker.done = True
+            # Files no account had room for are still waiting
+            return not worker.plan.left_paths
+
+    if batch is not None and batch.sa_id is not None:
+        sa_id = batch.sa_id
+    elif worker.warm_id is not None:
+        # --standby: the account prepared while the last one copied
+        sa_id, worker.warm_id = worker.warm_id, None
+    else:
+        sa_id = pool.next_id()
+    if sa_id is None:
+        worker.done = True
+        if batch is not None:
+            worker.plan.left_paths.extend(batch.paths)
+            worker.plan.left_size += batch.size
+        return False
+    if not await worker.start(sa_id, batch):
+        worker.done = True
+        # This account never ran: another worker can have it
+        pool.give_back(sa_id)
+    elif worker.rcd is not None and worker.plan is None:
+        # Keep the next account ready in the rcd
+        worker.warm_id = pool.next_id()
+        if worker.warm_id is not None:
+            asyncio.ensure_future(worker.prewarm(worker.warm_id))
+    return True
+
+
+async def step_worker(worker, pool):
+    """poll a worker and move it on to the next account when its rclone stopped,
+        returns False if the worker had to stop because no account was left
+    """
+    state = await worker.poll()
+    if state == Worker.RUNNING:
+        return True
+    await worker.settle_files()
+
+    METRICS.inc('autorclone_switches_total', reason=worker.stop_reason)
+    journal_write('sa_stopped', worker=worker.index + 1, sa_id=worker.sa_id,
+                  bytes=worker.size_bytes_recorded, reason=worker.stop_reason, peak_rss=worker.peak_rss)
+    pool.record_run(worker.sa_id, worker.size_bytes_recorded, time.time() - worker.launched_at, worker.stop_reason)
+    pool.stopped(worker.sa_id)
+    if worker.peak_rss:
+        print('rclone used up to {}MB.'.format(worker.peak_rss // 2 ** 20))
+    accounts_left = True
+    chunk_left = worker.stop_reason == 'finished' and worker.chunk_after is not None
+    # rclone ran out of work, not out of quota: the account goes to the next worker (or job) first.
+    # Unless it was already partly used: the files too big for it (--max-size) need a fresh account
+    if worker.stop_reason == 'finished':
+        pool.give_back(worker.sa_id, last=pool.budget_bytes(worker.sa_id) < SIZE_GB_MAX * 2 ** 30 and not chunk_left)
+    if chunk_left:
+        # Only a chunk is done, not the copy: go on with the next one. Only the
+        # last chunk of the tree ending counts towards "all done"
+        worker.cnt_acc_error = worker.cnt_acc_error_at_chunk
+        state = Worker.SWITCH
+    elif worker.stop_reason != 'finished':
+        # The next account copies what is left of the same chunk
+        worker.chunk_after = worker.chunk_from
+    if worker.batch is not None:
+        # What this batch did not copy is planned again for the next free account
+        paths, size = worker.manifest.missing(worker.batch.paths)
+        attempts = worker.batch.attempts + (worker.stop_reason == 'finished')
+        if paths and attempts > BATCH_ATTEMPTS:
+            print('batch {}: giving up {} files that failed {} times.'.format(worker.batch.number, len(paths), BATCH_ATTEMPTS))
+            journal_write('batch_failed', batch=worker.batch.number, files=paths)
+        else:
+            batch = worker.plan.requeue(paths, size, attempts)
+            if batch is not None:
+                print('batch {}: {} files ({:.2f}GB) left, planned again as batch {}.'.format(
+                    worker.batch.number, len(paths), size / 2 ** 30, batch.number))
+        # The plan, not the exit counters, knows when there is nothing left
+        if worker.stop_reason == 'finished':
+            state = Worker.SWITCH
+    if state == Worker.DONE:
+        worker.done = True
+    else:
+        # Move this worker on to the next unused service account
+        accounts_left = await start_next(worker, pool)
+    write_current_sa(WORKERS)
+    LEDGER.save()
+    return accounts_left
+
+
+async def drive(worker, pool):
+    """start a worker and poll it every POLL_INTERVAL seconds until it is done,
+        returns False if it stopped because no account was left
+    """
+    accounts_left = await start_next(worker, pool)
+    write_current_sa(WORKERS)
+    while not worker.done:
+        # wait before checking the job progress again
+        await asyncio.sleep(POLL_INTERVAL)
+        if not await step_worker(worker, pool):
+            accounts_left = False
+    await worker.close()
+    return accounts_left
+
+
+async def run_workers(workers, pool):
+    # Every worker is its own coroutine, polled on its own timer
+    results = await asyncio.gather(*(drive(worker, pool) for worker in workers))
+    for rcd in set(worker.rcd for worker in workers if worker.rcd is not None and worker.rcd.shared):
+        await rcd.quit()
+    return all(results)
+
+
+async def supervise(coroutine):
+    """run the workers (or the jobs) of coroutine, saving the ledger every LEDGER_SAVE_INTERVAL"""
+    async def save_ledger():
         while True:
+            await asyncio.sleep(LEDGER_SAVE_INTERVAL)
+            # A shared ledger is read back even when nothing was recorded, for what the other copies used up
+            LEDGER.save(force=LEASES is not None)
 
-        # Command to get rclone stats using rclone remote control
-            rc_cmd = 'rclone rc --rc-addr="localhost:{}" core/stats'.format(format(args.port))
-            
+    saver = asyncio.ensure_future(save_ledger())
+    try:
+        return await coroutine
+    finally:
+        saver.cancel()
+
+
+class JobError(Exception):
+    pass
+
+
+class Job(object):
+    """one copy of the --jobs file, run by its own workers"""
+    # keys of a job that override the command line arguments
+    FIELDS = ('source_id', 'source_path', 'source_path_id', 'destination_id', 'destination_path',
+              'crypt', 'cache', 'manifest', 'workers')
+
+    def __init__(self, number, spec, args):
+        self.name = str(spec.get('name') or 'job{:02d}'.format(number))
+        self.priority = int(spec.get('priority', 0))
+        self.args = argparse.Namespace(**vars(args))
+        # One worker per job unless asked, the others wait for a free rc port
+        self.args.workers = 1
+        # The files of a job are its own
+        for key in ('manifest', 'log_index'):
+            if getattr(args, key):
+                base, ext = os.path.splitext(getattr(args, key))
+                setattr(self.args, key, '{}_{}{}'.format(base, self.name, ext))
+        for key in self.FIELDS:
+            if key in spec:
+                setattr(self.args, key, spec[key])
+        self.workers = []
+        # rc ports of the workers of this job while it runs
+        self.ports = []
+
+    def prepare(self, ports, pool, sa_files):
+        """write the config of this job, list or split its source, returns
+            the config file and the filter file of every worker
+        """
+        args = self.args
+        config_file, _ = gen_rclone_cfg(args, sa_files, 'rclone_{}.conf'.format(self.name))
+        first_id = pool.reader_id()
+        if first_id is None:
+            raise JobError('no service account left to list it')
+        if args.check_path:
+            check_paths(args, config_file, first_id)
+
+        filter_files = [None] * len(ports)
+        if args.manifest:
+            # sqlite connections stay in their thread: the workers open their own
+            list_manifest(args, config_file, first_id).close()
+        elif len(ports) > 1:
+            filter_files = split_source(args, config_file, len(ports), first_id, prefix=self.name + '_')
+        return config_file, filter_files
+
+    async def run(self, ports, pool, sa_files):
+        """run this job on the given rc ports until it is done, returns False if it
+            stopped because no account was left
+        """
+        # Listing can take minutes: keep polling the other jobs meanwhile
+        loop = asyncio.get_event_loop()
+        try:
+            config_file, filter_files = await loop.run_in_executor(None, self.prepare, ports, pool, sa_files)
+        except SystemExit as error:
+            # What stops a single copy (bad ids, a failed listing) only stops this job
+            raise JobError(error.code)
+        log_index = LogIndex(self.args.log_index, copy_key(self.args)) if self.args.log_index else None
+        manifest = None
+        if self.args.manifest:
+            manifest = Manifest(self.args.manifest)
+            # What an earlier run of this copy logged as copied, unless the destination was just listed again
+            if log_index is not None and not self.args.relist:
+                manifest.mark_done(log_index.copied())
+
+        rcd = shared_rcd(self.args, config_file, ports[0], len(ports),
+                         '{}_{}{}'.format(os.path.splitext(logfile)[0], self.name, os.path.splitext(logfile)[1]), log_index)
+        self.workers = [Worker(len(WORKERS) + k, self.args, config_file, pool, filter_file, manifest,
+                               port=ports[k], name='{}_w{:02d}'.format(self.name, k + 1),
+                               shard=k, shards=len(filter_files), log_index=log_index, rcd=rcd)
+                        for k, filter_file in enumerate(filter_files)]
+        WORKERS.extend(self.workers)
+        try:
+            accounts_left = await run_workers(self.workers, pool)
+        finally:
+            if log_index is not None:
+                log_index.close()
+        if accounts_left and self.args.verify:
+            verify_ids = [sa_id for sa_id in range(1, len(sa_files) + 1)
+                          if self.args.begin_sa_id <= sa_id <= self.args.end_sa_id]
             try:
-            # Get the response from running the command
-                response = subprocess.check_output(rc_cmd, shell=True)
-            # Increment counter for successful responses
-                cnt_acc_sucess += 1
-            # Reset error counter if there were multiple successful responses after a long waiting time
-                cnt_error = 0
-                
-                """
-                Reset error counter if there were multiple successful responses after a long waiting time
-                if there is a long time waiting, this will be easily satisfied, so check if it is started using
-                already_started flag
-                """
-
-                if already_start and cnt_acc_sucess >= 9:
-                    cnt_acc_error = 0
-                    cnt_acc_sucess = 0
-                    if args.test_only: print(
-                        "total 9 times success. the cnt_acc_error is reset to {}\n".format(cnt_acc_error))
-
-            except subprocess.SubprocessError as error:
-                # Continually increase error counter until a certain threshold
-                # continually ...
-                cnt_error = cnt_error + 1
-                cnt_acc_error = cnt_acc_error + 1
-                if cnt_error >= 3:
-                    cnt_acc_sucess = 0
-                
-                    if args.test_only: print(
-                        "total 3 times failure. the cnt_acc_sucess is reset to {}\n".format(cnt_acc_sucess))
-
-                # If the error threshold is reached, assume the task is finished and break the loop
-                    print('No rclone task detected (possibly done for this '
-                          'account). ({}/3)'.format(int(cnt_acc_error / cnt_error)))
-                    
-                    # Regard continually exit as *all done*.
-                    if cnt_acc_error >= 9:
-                        print('All done (3/3).')
-                        print_during(time_start)
-                        return
-                    break
+                await loop.run_in_executor(None, run_verify, self.args, config_file, verify_ids, self.name + '_')
+            except SystemExit as error:
+                raise JobError(error.code)
+        return accounts_left
+
+
+def load_jobs(path, args):
+    """read the --jobs file, a json list of jobs such as
+        {"name": "movies", "source_id": "...", "source_path": "Movies",
+         "destination_id": "...", "destination_path": "Movies", "priority": 10}
+        returned highest priority first (file order among equals)
+    """
+    try:
+        with io.open(path, 'r', encoding='utf-8') as fp:
+            specs = json.load(fp)
+    except (OSError, ValueError) as error:
+        sys.exit('failed to read {}: {}'.format(path, error))
+    if not isinstance(specs, list):
+        sys.exit('{} must hold a list of jobs'.format(path))
+
+    jobs = []
+    for number, spec in enumerate(specs, 1):
+        if not isinstance(spec, dict):
+            sys.exit('{}: job {} is not a json object'.format(path, number))
+        if not spec.get('destination_id'):
+            sys.exit('{}: job {} has no destination_id'.format(path, spec.get('name') or number))
+        job = Job(number, spec, args)
+        error = id_error(job.args)
+        if error is not None:
+            sys.exit('{}: job {}: {}'.format(path, job.name, error))
+        jobs.append(job)
+    names = [job.name for job in jobs]
+    if len(set(names)) != len(names):
+        sys.exit('{}: job names must be unique'.format(path))
+    return sorted(jobs, key=lambda job: -job.priority)
+
+
+async def run_jobs(args, pool, sa_files):
+    """daemon mode: run the jobs of args.jobs on --workers rc ports, highest priority
+        first. All jobs share the one account pool: an account used up by a job is
+        never handed out again, an account a finished job did not use up goes to the next.
+    """
+    pending = load_jobs(args.jobs, args)
+    failed = []
+    # running job of every task
+    running = {}
+    # Free rc ports, one per worker
+    slots = rc_ports(args, args.workers)
+
+    while pending or running:
+        # Start the most important waiting jobs while there are ports and accounts
+        while pending and slots and pool.ids:
+            job = pending.pop(0)
+            print('Starting job {} (priority {}).'.format(job.name, job.priority))
+            journal_write('job_started', job=job.name, priority=job.priority)
+            count = max(1, min(job.args.workers, len(slots)))
+            job.ports, slots = slots[:count], slots[count:]
+            running[asyncio.ensure_future(job.run(job.ports, pool, sa_files))] = job
+        if not running:
+            break
+
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            job = running.pop(task)
+            slots = sorted(slots + job.ports)
+            try:
+                accounts_left = task.result()
+            except Exception as error:
+                # The other jobs go on
+                print('Job {} failed: {}'.format(job.name, error))
+                journal_write('job_failed', job=job.name, error=str(error))
+                failed.append(job)
                 continue
-            
-        # Process the response and extract relevant data
-            response_processed = response.decode('utf-8').replace('\0', '')
-            response_processed_json = json.loads(response_processed)
-            size_bytes_done = int(response_processed_json['bytes'])
-            checks_done = int(response_processed_json['checks'])
-            size_GB_done = int(size_bytes_done * 9.31322e-10)
-            speed_now = float(int(response_processed_json['speed']) * 9.31322e-10 * 1024)
-
-            # try:
-            #     print(json.loads(response.decode('utf-8')))
-            # except:
-            #     print("have some encoding problem to print info")
-            
-        
-        # Comment is removed as peer now the script prints all the progress stats automatically, but for tracing the code remains here.
-            """
-            if already_start:
-                print("\n%s %dGB Done @ %fMB/s | checks: %d files" % (dst_label, size_GB_done, speed_now, checks_done), end="\r")
+            if accounts_left:
+                print('Job {} finished.'.format(job.name))
+                journal_write('job_finished', job=job.name)
             else:
-                print("\n%s reading source/destination | checks: %d files" % (dst_label, checks_done), end="\r")
-            """
-            # continually no ...
-            if size_bytes_done - size_bytes_done_before == 0:
+                # Not complete: wait for an account another job gives back
+                print('Job {} paused: no service account left.'.format(job.name))
+                journal_write('job_paused', job=job.name)
+                pending.insert(0, job)
 
-            # If there has been no increase in the amount of data transferred since the last check and the job has already started
-                if already_start:
+    for job in pending:
+        print('Job {} not done: no service account left.'.format(job.name))
+    return not pending and not failed
 
-            # Increase the count of times there has been no increase in data transferred
-                    cnt_dead_retry += 1
 
-            # If the script is in test mode, print some debugging information
-                    if args.test_only:
-                        print('\nsize_bytes_done', size_bytes_done)
-                        print('size_bytes_done_before', size_bytes_done_before)
-                        print("No. No size increase after job started.")
-       
-            else:
-            # If there has been an increase in the amount of data transferred, reset the count of times there has been no increase        
-                cnt_dead_retry = 0
+def run_batch_copy(args, pool, sa_files, manifest):
+    """--engine batch: copy what the manifest has left through the Drive API,
+        returns False if the accounts ran out first
+    """
+    try:
+        import googleapiclient.http
+    except ImportError:
+        sys.exit('--engine batch needs google-api-python-client, pip3 install -r requirements.txt')
+    row = manifest.todo_ids(limit=1).fetchone()
+    if row is not None and row[2] is None:
+        sys.exit('{} has no Drive IDs, list it again with --relist.'.format(args.manifest))
+    copier = BatchCopier(pool, lambda sa_id: drive_service(sa_files[sa_id], args.drive_api, args.token_uri), manifest,
+                         args.destination_id, args.destination_path, workers=args.workers, tps=args.batch_tps,
+                         full_budget=SIZE_GB_MAX * 2 ** 30, api_endpoint=args.drive_api, on_event=journal_write)
+    return copier.run()
+
+
+# Arguments of the copy a --node takes from the coordinator
+NODE_ARGS = ('source_id', 'source_path', 'source_path_id', 'destination_id', 'destination_path',
+             'crypt', 'cache', 'dry_run', 'disable_list_r')
+
+def run_coordinator(args, config_file, pool, plan, manifest):
+    """hand the batches of plan to the nodes until none is left, returns False if
+        files are left because the accounts ran out
+    """
+    node_config = {'rclone_config': portable_rclone_cfg(config_file),
+                   'args': dict((key, getattr(args, key)) for key in NODE_ARGS)}
+    coordinator = Coordinator(pool, plan, manifest, node_config, token=args.coordinator_token, tpslimit=TPSLIMIT,
+                              full_budget=SIZE_GB_MAX * 2 ** 30, batch_attempts=BATCH_ATTEMPTS,
+                              save_interval=LEDGER_SAVE_INTERVAL, on_event=journal_write)
+    print('coordinator on http://{}:{}/, start the nodes with --node.'.format(args.coordinator_addr, args.coordinator))
+    try:
+        coordinator.serve(args.coordinator, args.coordinator_addr)
+    except OSError as error:
+        sys.exit('coordinator: {}'.format(error))
+    count, size = manifest.remaining()
+    print('{} files ({:.2f}GB) left to copy.'.format(count, size / 2 ** 30))
+    return not plan.batches and not plan.left_paths
 
-            # If the script is in test mode, print some debugging information
-                if args.test_only: print("\nOk. I think the job has started")
 
-            # Mark the job as having started
-                already_start = True
+class NodePool(object):
+    """what a Worker asks its pool, on a --node: the coordinator picked the account
+        and keeps its ledger, its budget and rate come with the unit
+    """
 
-        # Remember the amount of data transferred for the next check
-            size_bytes_done_before = size_bytes_done
-
-            # Stop by error (403, etc) info
-            if size_GB_done >= SIZE_GB_MAX or cnt_dead_retry >= CNT_DEAD_RETRY:
-   
-             # If the amount of data transferred exceeds the maximum size or there have been too many consecutive checks with no increase in data transferred:
-                if is_windows():
-                    # kill_cmd = 'taskkill /IM "rclone.exe" /F'
-                    kill_cmd = 'taskkill /PID {} /F'.format(PID)
-                else:
-
-                # If the script is running on Linux, use the 'kill' command to terminate the rclone process
-                    kill_cmd = "kill -9 {}".format(PID)
-                
-                # Print the current time
-                print("\n" + " " * 20 + " {}".format(time.strftime("%H:%M:%S")))
-                try:
-                    subprocess.check_call(kill_cmd, shell=True)
-
-                # Run the kill command to terminate the rclone process
-                    print('\n')
-                except:
-                
-                # If the kill command fails, print an error message (if in test mode) and continue
-                    if args.test_only: print("\nFailed to kill.")
-                    pass
-
-                # =================Finish it=================
-                if cnt_dead_retry >= CNT_DEAD_RETRY:
-
-                # If there have been too many consecutive checks with no increase in data transferred:
-                    try:
-                    # Increase the count of times the script has exited due to this reason
-                        cnt_exit += 1
-                    except:
-                    # If cnt_exit hasn't been initialized yet, set it to 1
-                        cnt_exit = 1
-            
-                    # If the script is in test mode, print some debugging information
-                    if args.test_only: print(
-                        "1 more time for long time waiting. the cnt_exit is added to {}\n".format(cnt_exit))
-                else:
-                    # clear cnt if there is one time
-                    cnt_exit = 0
-                    if args.test_only: print("1 time sucess. the cnt_exit is reset to {}\n".format(cnt_exit))
+    def __init__(self):
+        # sa_id -> unit being copied with it
+        self.units = {}
+        self.limits = ProjectLimits()
+        self.scores = None
 
-                # Regard continually exit as *all done*.
-                if cnt_exit >= CNT_SA_EXIT:
-                
-                # If the script has exited due to this reason enough times, print the duration of the job and a completion message and exit
-                    print_during(time_start)
-                    # exit directly rather than switch to next account.
-                    print('All Done.')
-                    return
-                # =================Finish it=================
+    def email(self, sa_id):
+        return None
+
+    def project(self, sa_id):
+        return None
+
+    def budget_bytes(self, sa_id):
+        return self.units[sa_id]['budget']
+
+    def tpslimit(self, sa_id, tpslimit):
+        return min(tpslimit, self.units[sa_id].get('tpslimit') or tpslimit)
+
+    def started(self, sa_id):
+        pass
+
+    def stopped(self, sa_id):
+        pass
+
+    def give_back(self, sa_id, last=False):
+        pass
+
+
+class UnitFiles(object):
+    """stands for the manifest of a Worker on a --node: keeps the files it copied for the coordinator"""
+
+    def __init__(self):
+        self.paths = []
 
+    def mark_done(self, paths):
+        self.paths.extend(paths)
+
+    def take(self):
+        paths, self.paths = self.paths, []
+        return paths
+
+
+async def run_unit(worker, client, unit):
+    """copy one unit the coordinator handed out, reporting progress every poll,
+        returns False if rclone could not be started
+    """
+    loop = asyncio.get_event_loop()
+    batch = Batch(unit['id'], unit['sa_id'], unit['paths'], unit['size'], plan_dir=NODE_DIR)
+    batch.write()
+    worker.pool.units[unit['sa_id']] = unit
+    started = await worker.start(unit['sa_id'], batch)
+    worker.stop_reason = None if started else 'failed'
+    while started:
+        await asyncio.sleep(POLL_INTERVAL)
+        if await worker.poll() != Worker.RUNNING:
+            break
+        files = worker.manifest.take()
+        try:
+            reply = await loop.run_in_executor(None, client.progress, unit['id'], worker.size_bytes_recorded, files)
+        except CoordinatorError as error:
+            print('coordinator: {}'.format(error))
+            worker.manifest.mark_done(files)
+            continue
+        if reply.get('stop'):
+            print('unit {} taken back by the coordinator.'.format(unit['id']))
+            await worker.kill()
+            worker.stop_reason = 'lost'
+            break
+
+    if started:
+        await worker.settle_files()
+    nbytes = worker.size_bytes_recorded if started else 0
+    for attempt in range(3):
+        try:
+            await loop.run_in_executor(None, client.finish, unit['id'], worker.stop_reason, nbytes, worker.manifest.take())
+            break
+        except CoordinatorError as error:
+            print('coordinator: {}'.format(error))
+            await asyncio.sleep(NODE_WAIT)
+    del worker.pool.units[unit['sa_id']]
+    os.remove(batch.files_from)
+    return started
+
+
+async def drive_node(worker, client, node):
+    """lease units from the coordinator and copy them with worker until there is none left"""
+    loop = asyncio.get_event_loop()
+    # The coordinator waits until every worker of every node knows it is done
+    node = '{}/{}'.format(node, worker.name)
+    failures = 0
+    while failures < NODE_RETRIES:
+        try:
+            reply = await loop.run_in_executor(None, client.lease, node)
+        except CoordinatorError as error:
+            failures += 1
+            print('coordinator: {} ({}/{})'.format(error, failures, NODE_RETRIES))
+            await asyncio.sleep(NODE_WAIT)
+            continue
+        failures = 0
+        if reply.get('unit') is not None:
+            if not await run_unit(worker, client, reply['unit']):
                 break
+        elif reply.get('done'):
+            print('Nothing left to copy for worker {}.'.format(worker.name))
+            break
+        else:
+            # The other nodes have the batches left, some may come back
+            await asyncio.sleep(NODE_WAIT)
+    worker.done = True
+    await worker.close()
+
+
+def run_node(args):
+    """copy what the coordinator at args.node hands out, with args.workers rclone"""
+    client = CoordinatorClient(args.node, args.coordinator_token)
+    try:
+        config = client.config()
+    except CoordinatorError as error:
+        sys.exit('coordinator: {}'.format(error))
+    for key, value in config['args'].items():
+        setattr(args, key, value)
+    # It holds the service account keys: readable by this user only
+    fd = os.open(NODE_CONFIG, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with io.open(fd, 'w', encoding='utf-8') as fp:
+        fp.write(config['rclone_config'])
+    os.makedirs(NODE_DIR, exist_ok=True)
+    node = '{}-{}'.format(platform.node(), os.getpid())
+    print('node {} copying for {}.'.format(node, args.node))
+
+    async def run_node_workers(workers):
+        await asyncio.gather(*(drive_node(worker, client, node) for worker in workers))
+        for rcd in set(worker.rcd for worker in workers if worker.rcd is not None and worker.rcd.shared):
+            await rcd.quit()
+
+    log_index = LogIndex(args.log_index, copy_key(args)) if args.log_index else None
+    pool = NodePool()
+    ports = rc_ports(args, args.workers)
+    rcd = shared_rcd(args, NODE_CONFIG, ports[0], args.workers, logfile, log_index)
+    WORKERS[:] = [Worker(k, args, NODE_CONFIG, pool, manifest=UnitFiles(), port=ports[k], log_index=log_index, rcd=rcd)
+                  for k in range(args.workers)]
+    asyncio.run(run_node_workers(WORKERS))
+    if log_index is not None:
+        log_index.close()
+
+
+def main():
+
+    # Set signal handler for interrupt (SIGINT) signal
+    signal(SIGINT, handler)
+
+    # Check if rclone is installed
+    ret = check_rclone_program()
+    print("rclone is detected: {}".format(ret))
 
-        # wait for 2 seconds before checking the job progress again
-            time.sleep(4)
+    # Parse command-line arguments
+    args = parse_args()
+    if args.workdir:
+        enter_workdir(args)
+    global LEASES
+    if args.lease:
+        LEASES = Leases(args.lease)
+        if not LEASES.take_workdir(os.getcwd()):
+            sys.exit('--workdir {} is used by another copy of the script (pid {}).'.format(
+                args.workdir, LEASES.workdir_holder(os.getcwd())))
+    # The coordinator tells a node what to copy and with which account
+    if args.node is not None:
+        time_start = time.time()
+        run_node(args)
+        return print_during(time_start)
+
+    # Rebuild the state of an interrupted run from its journal
+    resume_state = None
+    if args.resume:
+        resume_state = journal.replay(args.journal)
+        if resume_state['args'] is None:
+            print('Nothing to resume in {}, starting a new run.'.format(args.journal))
+            resume_state = None
+        elif resume_state['finished']:
+            return print('The run recorded in {} has already finished.'.format(args.journal))
+        else:
+            for key in COPY_KEYS:
+                if resume_state['args'].get(key) != getattr(args, key):
+                    sys.exit('--resume: {} differs from the run recorded in {}'.format(key, args.journal))
+            print('Resuming: {:.2f}GB and {} files already copied, {} accounts used up.'.format(
+                resume_state['bytes'] / 2 ** 30, resume_state['files_completed'], len(resume_state['spent_sa_ids'])))
+
+    global JOURNAL
+    JOURNAL = Journal(args.journal, resume=resume_state is not None)
+    journal_write('run_started', args=dict((key, value) for key, value in vars(args).items() if key not in SECRET_ARGS),
+                  resumed=resume_state is not None)
+
+    # Check the service account json files before they become remotes
+    sa_index = SaIndex(args.sa_index)
+
+    # If no rclone config file is specified, generate one
+    if args.rclone_config_file is None:
+        usable = usable_sa_files(args, sa_index)
+        sa_files = dict((i + 1, filename) for i, filename in enumerate(usable))
+        # With --jobs every job gets its own config, written when the job starts
+        if args.jobs is None:
+            print('generating rclone config file.')
+            config_file, sa_files = gen_rclone_cfg(args, usable)
+            print('rclone config file generated.')
+            journal_write('config_generated', config_file=config_file, remotes=len(sa_files))
+    else:
+        # Use the srcNNN/dstNNN remotes already in the given config file
+        config_file, sa_files = load_rclone_cfg(args)
+        print('{} remotes found in {}.'.format(len(sa_files), config_file))
+
+        # Drop the remotes whose json file is broken or a duplicate
+        usable = set(sa_index.build([f for f in sa_files.values() if f], verify=args.verify_sa, token_uri=args.token_uri))
+        for sa_id in sorted(sa_files):
+            if sa_files[sa_id] and sa_files[sa_id] not in usable:
+                print('skip {:03d}: {}'.format(sa_id, sa_index.error(sa_files[sa_id])))
+                del sa_files[sa_id]
+        journal_write('config_generated', config_file=config_file, remotes=len(sa_files))
+
+    # Set the start and end IDs for the service accounts to be used on uploads.
+    global LEDGER
+    # Copies leasing from one folder share their ledger too, so none picks an account another used up
+    LEDGER = QuotaLedger(args.ledger or os.path.join(args.lease or '', 'sa_ledger.json'))
+    pool = SaPool(args.begin_sa_id, args.end_sa_id, sa_files, LEDGER,
+                  email_of=lambda filename: sa_index.get(filename, 'client_email') or sa_email(filename),
+                  scores=SaScores(args.scores) if args.select == 'score' else None,
+                  project_of=lambda filename: sa_index.get(filename, 'project_id'), project_tps=args.project_tps,
+                  leases=LEASES)
+    # Accounts the interrupted run already used up
+    if resume_state is not None:
+        pool.ids = [sa_id for sa_id in pool.ids if sa_id not in resume_state['spent_sa_ids']]
+    if not pool.ids:
+        sys.exit('No service account between {} and {}.'.format(args.begin_sa_id, args.end_sa_id))
+    # The account used for checking and listing the paths
+    first_id = pool.reader_id()
+    if first_id is None:
+        sys.exit('Every service account between {} and {} is in use.'.format(args.begin_sa_id, args.end_sa_id))
+
+    # Expose the progress of all workers to Prometheus
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        print('metrics on http://localhost:{}/metrics'.format(args.metrics_port))
+
+    # Record the start time
+    time_start = time.time()
+    print("Start: {}".format(time.strftime("%H:%M:%S")))
 
-    # increment the id of the job being processed
-        id = id + 1
+    if args.jobs is not None:
+        all_done = asyncio.run(supervise(run_jobs(args, pool, [sa_files[sa_id] for sa_id in sorted(sa_files)])))
+        LEDGER.save()
+        journal_write('run_finished' if all_done else 'run_paused')
+        print_during(time_start)
+        return
+
+    # Check the source and destination paths if path checking is enabled
+    if args.check_path:
+        check_paths(args, config_file, first_id)
+
+    # Listing only needs read access: every account in the range can help verifying
+    verify_ids = [sa_id for sa_id in sorted(sa_files) if args.begin_sa_id <= sa_id <= args.end_sa_id]
+    if args.verify_only:
+        run_verify(args, config_file, verify_ids)
+        return print_during(time_start)
+
+    log_index = LogIndex(args.log_index, copy_key(args)) if args.log_index else None
+
+    # List both sides once, the workers then only get what is missing
+    manifest = None
+    if args.manifest:
+        manifest = list_manifest(args, config_file, first_id)
+        # Files the interrupted run copied may not have reached the manifest yet
+        if resume_state is not None:
+            manifest.mark_done(journal.completed_files(args.journal))
+        # Nor the ones an earlier run of this copy logged as copied, unless the destination was just listed again
+        if log_index is not None and not args.relist:
+            manifest.mark_done(log_index.copied())
+        count, size = manifest.remaining()
+        print('{} files ({:.2f}GB) to copy.'.format(count, size / 2 ** 30))
+
+    # Copy through the Drive API instead of rclone
+    if args.engine == 'batch':
+        all_done = run_batch_copy(args, pool, sa_files, manifest)
+        LEDGER.save()
+        if log_index is not None:
+            log_index.close()
+        if all_done and args.verify:
+            run_verify(args, config_file, verify_ids)
+        journal_write('run_finished' if all_done else 'run_paused')
+        return print_during(time_start)
+
+    # Give every account a batch that fits what it may still upload today
+    plan = None
+    if args.plan or args.coordinator is not None:
+        plan = make_plan(manifest, pool)
+
+    # The nodes copy, not this process
+    if args.coordinator is not None:
+        all_done = run_coordinator(args, config_file, pool, plan, manifest)
+        LEDGER.save()
+        if log_index is not None:
+            log_index.close()
+        if all_done and args.verify:
+            run_verify(args, config_file, verify_ids)
+        journal_write('run_finished' if all_done else 'run_paused')
+        return print_during(time_start)
+
+    # Give every worker its own share of the source folder
+    filter_files = [None] * args.workers
+    if args.workers > 1 and manifest is None and plan is None:
+        filter_files = split_source(args, config_file, args.workers, first_id)
+
+    ports = rc_ports(args, len(filter_files))
+    rcd = shared_rcd(args, config_file, ports[0], len(filter_files), logfile, log_index)
+    WORKERS[:] = [Worker(k, args, config_file, pool, filter_file, manifest, port=ports[k], shards=len(filter_files),
+                         log_index=log_index, plan=plan, rcd=rcd)
+                  for k, filter_file in enumerate(filter_files)]
+    # Drive every rclone task from one event loop until all are done,
+    # accounts_left is False when the copy stopped because every account was used
+    accounts_left = asyncio.run(supervise(run_workers(WORKERS, pool)))
+
+    LEDGER.save()
+    if log_index is not None:
+        log_index.close()
+    if accounts_left and args.verify:
+        run_verify(args, config_file, verify_ids)
+    # Without accounts left the copy is not complete: keep it resumable
+    journal_write('run_finished' if accounts_left else 'run_paused')
 
     # print the time taken to complete the job
     print_during(time_start)
@@ -0,0 +1,145 @@
+# autorclone quota ledger
+#
+# Google lets one service account upload about 750GB a day. The ledger remembers,
+# across runs, how many bytes every service account (keyed by its client_email)
+# has moved and when, so accounts that already used up their rolling 24h window
+# are not picked again until it resets. Several supervisors may share one ledger
+# (--lease): every save locks it, reads what the others wrote and adds its own
+# moves to that, so an account one of them used up is skipped by all.
+#
+import io
+import json
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+QUOTA_WINDOW = 24 * 3600  # seconds, Google's daily upload quota is a rolling window
+DAILY_QUOTA_GB = 750  # upload quota of one service account per window
+MERGE_SECONDS = 60  # moves recorded closer than this are merged into one entry
+
+
+# Reads the client_email out of a service account json file
+def sa_email(filename):
+    with io.open(filename, 'r', encoding='utf-8') as fp:
+        return json.load(fp)['client_email']
+
+
+class QuotaLedger(object):
+    """bytes moved per service account, with timestamps, saved as json:
+        {"client_email": {"moves": [[timestamp, bytes], ...], "exhausted_at": timestamp}}
+    """
+
+    def __init__(self, path='sa_ledger.json', quota_gb=DAILY_QUOTA_GB, window=QUOTA_WINDOW):
+        self.path = path
+        self.quota_bytes = int(quota_gb * 2 ** 30)
+        self.window = window
+        # What this process recorded since its last save, added to the file on the next one
+        self.pending = {}
+        self.dirty = False
+        self.accounts = self.load()
+        self.prune()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with io.open(self.path, 'r', encoding='utf-8') as fp:
+                return json.load(fp)
+        except ValueError:
+            print('ledger {} is corrupted, starting a new one.'.format(self.path))
+            return {}
+
+    @staticmethod
+    def _account(accounts, email):
+        return accounts.setdefault(email, {'moves': [], 'exhausted_at': None})
+
+    def prune(self, now=None):
+        # Forget everything that fell out of the window
+        now = time.time() if now is None else now
+        for email in list(self.accounts):
+            account = self.accounts[email]
+            account['moves'] = [move for move in account['moves'] if move[0] > now - self.window]
+            if account.get('exhausted_at') and account['exhausted_at'] <= now - self.window:
+                account['exhausted_at'] = None
+            if not account['moves'] and not account.get('exhausted_at'):
+                del self.accounts[email]
+                self.dirty = True
+
+    def record(self, email, nbytes, now=None):
+        if nbytes <= 0:
+            return
+        now = time.time() if now is None else now
+        for accounts in (self.accounts, self.pending):
+            moves = self._account(accounts, email)['moves']
+            if moves and now - moves[-1][0] < MERGE_SECONDS:
+                moves[-1][1] += nbytes
+            else:
+                moves.append([now, nbytes])
+        self.dirty = True
+
+    def mark_exhausted(self, email, now=None):
+        # Google refused more uploads (403) before our own count reached the quota
+        now = time.time() if now is None else now
+        for accounts in (self.accounts, self.pending):
+            self._account(accounts, email)['exhausted_at'] = now
+        self.dirty = True
+
+    def used_bytes(self, email, now=None):
+        now = time.time() if now is None else now
+        account = self.accounts.get(email)
+        if account is None:
+            return 0
+        return sum(move[1] for move in account['moves'] if move[0] > now - self.window)
+
+    def remaining_bytes(self, email, now=None):
+        now = time.time() if now is None else now
+        account = self.accounts.get(email)
+        if account and account.get('exhausted_at') and account['exhausted_at'] > now - self.window:
+            return 0
+        return max(0, self.quota_bytes - self.used_bytes(email, now))
+
+    def reset_at(self, email):
+        # When the oldest entry leaves the window some quota is available again
+        account = self.accounts.get(email)
+        if not account:
+            return time.time()
+        stamps = [move[0] for move in account['moves']]
+        if account.get('exhausted_at'):
+            stamps.append(account['exhausted_at'])
+        return min(stamps) + self.window
+
+    def _lock(self):
+        # Blocks until no other process is saving the ledger, released when the file is closed
+        fp = io.open(self.path + '.lock', 'a+')
+        if fcntl is not None:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        else:
+            fp.seek(0)
+            msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)
+        return fp
+
+    def save(self, force=False):
+        """add the moves recorded since the last save to the ledger file, and read back what the others added"""
+        if not self.dirty and not force:
+            return
+        with self._lock():
+            accounts = self.load()
+            for email, mine in self.pending.items():
+                account = self._account(accounts, email)
+                account['moves'] = sorted(account['moves'] + mine['moves'])
+                if mine['exhausted_at']:
+                    account['exhausted_at'] = max(account.get('exhausted_at') or 0, mine['exhausted_at'])
+            self.accounts = accounts
+            self.prune()
+            # Write to a temporary file first so a crash never leaves a half written ledger
+            tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+            with io.open(tmp, 'w', encoding='utf-8') as fp:
+                json.dump(self.accounts, fp)
+            os.replace(tmp, self.path)
+        self.pending = {}
+        self.dirty = False
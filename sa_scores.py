@@ -0,0 +1,93 @@
+# autorclone account scores
+#
+# Remembers, across runs, how every service account (keyed by its client_email)
+# did: its upload speed and how often its runs ended on a quota error or a stall.
+# The pool then picks the account with the best score instead of the next id:
+#
+#   score = speed * share of the daily budget left * (1 - errors) * (1 - errors of its project / 2)
+#
+# Speed and errors are moving averages over the last runs, errors are forgiven with
+# a half life of ERROR_HALF_LIFE. An account never used gets the mean speed of the
+# others, so new accounts are tried rather than starved.
+#
+import io
+import json
+import os
+import time
+
+SPEED_WEIGHT = 0.3  # weight of the last run in the moving averages
+ERROR_HALF_LIFE = 6 * 3600  # seconds after which half of an error is forgiven
+MIN_RUN_SECONDS = 30  # shorter runs say nothing about the speed of an account
+BAD_STOPS = ('quota', 'stall')  # stop reasons that count as errors
+
+
+class SaScores(object):
+    """speed and error rate per service account, saved as json:
+        {"client_email": {"speed": bytes/s, "errors": 0..1, "project": id, "runs": n, "at": timestamp}}
+    """
+
+    def __init__(self, path='sa_scores.json'):
+        self.path = path
+        self.accounts = {}
+        self.dirty = False
+        if os.path.exists(path):
+            try:
+                with io.open(path, 'r', encoding='utf-8') as fp:
+                    self.accounts = json.load(fp)
+            except ValueError:
+                print('scores {} are corrupted, starting over.'.format(path))
+
+    def record(self, email, project, nbytes, seconds, reason, now=None):
+        """one run of the account ended, after nbytes in seconds, for reason"""
+        if email is None:
+            return
+        now = time.time() if now is None else now
+        account = self.accounts.setdefault(email, {'speed': None, 'errors': 0.0, 'project': project, 'runs': 0, 'at': now})
+        account['errors'] = self.errors(email, now) * (1 - SPEED_WEIGHT) + SPEED_WEIGHT * (reason in BAD_STOPS)
+        if seconds >= MIN_RUN_SECONDS:
+            speed = nbytes / seconds
+            account['speed'] = speed if account['speed'] is None else \
+                account['speed'] * (1 - SPEED_WEIGHT) + speed * SPEED_WEIGHT
+        account['project'] = project
+        account['runs'] += 1
+        account['at'] = now
+        self.dirty = True
+
+    def errors(self, email, now=None):
+        account = self.accounts.get(email)
+        if account is None:
+            return 0.0
+        now = time.time() if now is None else now
+        return account['errors'] * 0.5 ** (max(0.0, now - account['at']) / ERROR_HALF_LIFE)
+
+    def project_errors(self, now=None):
+        """{project: mean errors of its accounts}"""
+        errors = {}
+        for email, account in self.accounts.items():
+            if account.get('project') is not None:
+                errors.setdefault(account['project'], []).append(self.errors(email, now))
+        return dict((project, sum(values) / len(values)) for project, values in errors.items())
+
+    def mean_speed(self):
+        speeds = [account['speed'] for account in self.accounts.values() if account.get('speed')]
+        return sum(speeds) / len(speeds) if speeds else 1.0
+
+    def scores(self, candidates, now=None):
+        """{key: score} of the candidates [(key, email, project, share of the daily budget left)]"""
+        now = time.time() if now is None else now
+        project_errors = self.project_errors(now)
+        mean_speed = self.mean_speed()
+        result = {}
+        for key, email, project, budget_share in candidates:
+            speed = (self.accounts.get(email) or {}).get('speed') or mean_speed
+            result[key] = speed * budget_share * (1 - self.errors(email, now)) * (1 - project_errors.get(project, 0.0) / 2)
+        return result
+
+    def save(self, force=False):
+        if not self.dirty and not force:
+            return
+        tmp = self.path + '.tmp'
+        with io.open(tmp, 'w', encoding='utf-8') as fp:
+            json.dump(self.accounts, fp)
+        os.replace(tmp, self.path)
+        self.dirty = False
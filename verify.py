@@ -0,0 +1,111 @@
+# autorclone verify
+#
+# Checks a finished copy without downloading anything: both sides are listed
+# with `rclone lsjson --hash` (Drive keeps the md5 in the file metadata) and
+# compared by size and md5. Every top level folder is one shard, listed on both
+# sides by its own service account, several shards at a time.
+#
+# Differences go to a report, the source paths to copy again to a retry list
+# that can be handed to rclone with --files-from-raw.
+#
+import io
+import json
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from manifest import iter_lsjson, md5_of
+
+VERIFY_THREADS = 8  # shards listed at the same time
+NOT_FOUND_EXIT = 3  # rclone's exit code for "directory not found"
+MISSING, SIZE_MISMATCH, MD5_MISMATCH, EXTRA = 'missing', 'size_mismatch', 'md5_mismatch', 'extra'
+
+
+def join_remote(base, name):
+    if not name:
+        return base
+    if base.endswith(':') or base.endswith('/'):
+        return base + name
+    return base + '/' + name
+
+
+def list_files(config_file, remote_path, recursive=True, fast_list=True, rclone='rclone'):
+    """yield the files under remote_path as lsjson entries, nothing if the folder does not exist"""
+    cmd = [rclone, '--config', config_file, 'lsjson', '--files-only', '--hash', '--no-mimetype', remote_path]
+    if not recursive:
+        cmd[4:4] = ['--max-depth', '1']
+    else:
+        cmd[4:4] = ['-R', '--fast-list'] if fast_list else ['-R']
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    for entry in iter_lsjson(proc.stdout):
+        yield entry
+    returncode = proc.wait()
+    if returncode not in (0, NOT_FOUND_EXIT):
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+
+def compare_shard(config_file, src_path, dst_path, shard, recursive, fast_list=True, rclone='rclone'):
+    """compare one shard (a top level folder, or the files directly in the source
+        folder when shard is ''), returns (files, bytes) verified and the differences
+    """
+    # The source side is kept in memory, the destination is streamed against it
+    source = {}
+    for entry in list_files(config_file, join_remote(src_path, shard), recursive, fast_list, rclone):
+        source[entry['Path']] = (int(entry.get('Size', -1)), md5_of(entry))
+
+    prefix = shard + '/' if shard else ''
+    diffs = []
+    files = size = 0
+    for entry in list_files(config_file, join_remote(dst_path, shard), recursive, fast_list, rclone):
+        expected = source.pop(entry['Path'], None)
+        if expected is None:
+            diffs.append((EXTRA, prefix + entry['Path'], ''))
+            continue
+        src_size, src_md5 = expected
+        dst_size, dst_md5 = int(entry.get('Size', -1)), md5_of(entry)
+        # Google Docs have no size, crypt remotes no md5: compare what both sides have
+        if src_size >= 0 and dst_size >= 0 and src_size != dst_size:
+            diffs.append((SIZE_MISMATCH, prefix + entry['Path'], '{} != {}'.format(src_size, dst_size)))
+        elif src_md5 and dst_md5 and src_md5.lower() != dst_md5.lower():
+            diffs.append((MD5_MISMATCH, prefix + entry['Path'], '{} != {}'.format(src_md5, dst_md5)))
+        else:
+            files += 1
+            size += max(src_size, 0)
+    for path, (src_size, _) in source.items():
+        diffs.append((MISSING, prefix + path, str(src_size)))
+    return files, size, diffs
+
+
+def verify(config_file, sa_ids, paths_of, report='verify_report.txt', retry='verify_retry.txt',
+           threads=VERIFY_THREADS, fast_list=True, rclone='rclone'):
+    """compare source and destination, shard by shard across the accounts sa_ids.
+        paths_of(sa_id) returns the (source, destination) paths as that account sees them.
+        Writes the report and the retry list, returns a summary dict.
+    """
+    src_path, _ = paths_of(sa_ids[0])
+    try:
+        ret = subprocess.check_output([rclone, '--config', config_file, 'lsjson', '--max-depth', '1', '--dirs-only',
+                                       '--no-modtime', '--no-mimetype', src_path])
+    except subprocess.SubprocessError as error:
+        raise RuntimeError('failed to list {}: {}'.format(src_path, error))
+    dirs = sorted(entry['Path'] for entry in json.loads(ret.decode('utf-8').replace('\0', '') or '[]'))
+    # The files lying directly in the source folder are one more shard
+    shards = [('', False)] + [(name, True) for name in dirs]
+
+    def run(k):
+        shard, recursive = shards[k]
+        src, dst = paths_of(sa_ids[k % len(sa_ids)])
+        return compare_shard(config_file, src, dst, shard, recursive, fast_list, rclone)
+
+    summary = {'shards': len(shards), 'files': 0, 'bytes': 0, MISSING: 0, SIZE_MISMATCH: 0, MD5_MISMATCH: 0, EXTRA: 0}
+    with io.open(report, 'w', encoding='utf-8', newline='\n') as report_fp, \
+            io.open(retry, 'w', encoding='utf-8', newline='\n') as retry_fp:
+        with ThreadPoolExecutor(max_workers=max(1, min(threads, len(shards)))) as executor:
+            for files, size, diffs in executor.map(run, range(len(shards))):
+                summary['files'] += files
+                summary['bytes'] += size
+                for status, path, detail in sorted(diffs, key=lambda diff: diff[1]):
+                    summary[status] += 1
+                    report_fp.write('{}\t{}\t{}\n'.format(status, path, detail))
+                    if status != EXTRA:
+                        retry_fp.write(path + '\n')
+    return summary